@@ -0,0 +1,252 @@
+import os
+import math
+import time
+import bisect
+import logging
+import itertools
+import threading
+
+from metrics import Gauge, ADMISSION_REJECTED
+from render_pool import default_pool_size
+
+logger = logging.getLogger(__name__)
+
+# ---------------- ADMISSION CONFIG ----------------
+# Renders queued on or running in the render pool at once, across every
+# batch and request of this process (0 = twice the pool size)
+ADMISSION_MAX_RENDERS = int(os.getenv("ADMISSION_MAX_RENDERS", "0"))
+# Estimated memory the admitted work may hold in the app process together
+ADMISSION_MEMORY_MB = float(os.getenv("ADMISSION_MEMORY_MB", "256"))
+# Estimate for one running bulk batch (sheet chunk, pending PDFs, upload
+# queue, ZIP buffer) ...
+ADMISSION_BATCH_MB = float(os.getenv("ADMISSION_BATCH_MB", "96"))
+# ... and for one render in flight (its HTML and resulting PDF bytes)
+ADMISSION_RENDER_MB = float(os.getenv("ADMISSION_RENDER_MB", "4"))
+# A request waits at most this long for capacity before it gets a 429
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+# Requests allowed to wait at once; further ones get a 429 straight away
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", "16"))
+
+# Priorities, served lowest first: interactive single certificates, rows
+# of batches already running, then new batches
+SINGLE, BULK, BATCH = 0, 1, 2
+PRIORITY_NAMES = {SINGLE: "single", BULK: "bulk", BATCH: "batch"}
+# Starting guesses of how long each kind holds its capacity (Retry-After)
+INITIAL_HOLD_SECONDS = {SINGLE: 2.0, BULK: 2.0, BATCH: 60.0}
+# Weight of the latest hold time in the moving average
+HOLD_SMOOTHING = 0.2
+
+
+class Overloaded(Exception):
+    """No capacity within the bounded wait; retry_after is in seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self, priority, seq, renders, memory_mb, rejectable):
+        self.priority = priority
+        self.seq = seq
+        self.renders = renders
+        self.memory_mb = memory_mb
+        self.rejectable = rejectable
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Ticket:
+    """Capacity granted by AdmissionController.acquire; release() is safe to call more than once"""
+
+    def __init__(self, controller, priority, renders, memory_mb):
+        self.controller = controller
+        self.priority = priority
+        self.renders = renders
+        self.memory_mb = memory_mb
+        self.started = time.monotonic()
+        self._released = False
+
+    def release(self):
+        self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+# ---------------- CONTROLLER ----------------
+class AdmissionController:
+    """
+    Process-wide cap on in-flight renders and on the estimated memory of
+    admitted work. Waiters are served by priority, first come first served
+    within one; capacity a blocked waiter needs is kept from lower
+    priorities, so single certificates overtake bulk rows and bulk rows
+    are never starved by new batches.
+    """
+
+    def __init__(self, max_renders=None, memory_mb=ADMISSION_MEMORY_MB, max_waiting=ADMISSION_MAX_WAITING):
+        if not max_renders:
+            max_renders = ADMISSION_MAX_RENDERS or max(1, default_pool_size() * 2)
+        self.max_renders = max_renders
+        self.memory_budget_mb = memory_mb
+        self.max_waiting = max_waiting
+        self.renders = 0
+        self.memory_mb = 0.0
+        self._cond = threading.Condition()
+        self._waiting = []  # sorted by (priority, arrival)
+        self._seq = itertools.count()
+        self._hold_seconds = dict(INITIAL_HOLD_SECONDS)
+
+    def _idle(self):
+        return self.renders == 0 and self.memory_mb == 0
+
+    def _grantable(self, waiter):
+        renders_free = self.max_renders - self.renders
+        memory_free = self.memory_budget_mb - self.memory_mb
+        blocked = set()
+        for other in self._waiting:
+            if other.priority in blocked:
+                if other is waiter:
+                    return False
+                continue
+            # Work bigger than the whole budget still runs, alone: the first
+            # waiter once nothing is admitted
+            fits = (other.renders <= renders_free and other.memory_mb <= memory_free) or (
+                self._idle() and other is self._waiting[0]
+            )
+            if other is waiter:
+                return fits
+            renders_free -= other.renders
+            memory_free -= other.memory_mb
+            if not fits:
+                blocked.add(other.priority)
+        return False
+
+    def retry_after(self, priority):
+        """Seconds a rejected request should wait: how long capacity of its kind is usually held"""
+        with self._cond:
+            return max(1, min(300, math.ceil(self._hold_seconds[priority])))
+
+    def acquire(self, priority, renders=0, memory_mb=0.0, timeout=None):
+        """
+        Waits for the capacity and returns a Ticket holding it. With a
+        timeout, raises Overloaded when the wait queue is full or the
+        capacity is not free in time; without one it waits as long as it takes.
+        """
+        with self._cond:
+            rejectable = timeout is not None
+            if rejectable and sum(1 for w in self._waiting if w.rejectable) >= self.max_waiting:
+                raise self._rejected(priority, "Too many requests are waiting")
+            waiter = _Waiter(priority, next(self._seq), renders, memory_mb, rejectable)
+            bisect.insort(self._waiting, waiter)
+            deadline = time.monotonic() + timeout if rejectable else None
+            try:
+                while not self._grantable(waiter):
+                    remaining = deadline - time.monotonic() if rejectable else None
+                    if remaining is not None and remaining <= 0:
+                        raise self._rejected(priority, "The server is busy generating certificates")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting.remove(waiter)
+                # Waiters behind this one may fit now
+                self._cond.notify_all()
+            self.renders += renders
+            self.memory_mb += memory_mb
+            return Ticket(self, priority, renders, memory_mb)
+
+    def _rejected(self, priority, message):
+        ADMISSION_REJECTED.inc(priority=PRIORITY_NAMES[priority])
+        retry_after = self.retry_after(priority)
+        logger.warning(
+            f"Admission: rejected a {PRIORITY_NAMES[priority]} request ({message}); "
+            f"{self.renders}/{self.max_renders} renders, {self.memory_mb:.0f}/{self.memory_budget_mb:.0f} MB, "
+            f"{len(self._waiting)} waiting"
+        )
+        return Overloaded(f"{message}, please retry in {retry_after} seconds.", retry_after)
+
+    def _release(self, ticket):
+        with self._cond:
+            if ticket._released:
+                return
+            ticket._released = True
+            self.renders -= ticket.renders
+            self.memory_mb -= ticket.memory_mb
+            held = time.monotonic() - ticket.started
+            average = self._hold_seconds[ticket.priority]
+            self._hold_seconds[ticket.priority] = average + HOLD_SMOOTHING * (held - average)
+            self._cond.notify_all()
+
+    def batch(self, timeout=ADMISSION_MAX_WAIT_SECONDS):
+        """Admits one bulk batch (its memory estimate); timeout None waits as long as it takes"""
+        return self.acquire(BATCH, memory_mb=ADMISSION_BATCH_MB, timeout=timeout)
+
+    def single(self, timeout=ADMISSION_MAX_WAIT_SECONDS):
+        """Admits one interactive render (single certificate, preview), ahead of bulk rows"""
+        return self.acquire(SINGLE, renders=1, memory_mb=ADMISSION_RENDER_MB, timeout=timeout)
+
+    def pool(self, render_pool, priority, timeout=None):
+        """render_pool whose submit() first takes a render slot at priority"""
+        return AdmittedPool(render_pool, self, priority, timeout)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "renders": self.renders,
+                "max_renders": self.max_renders,
+                "memory_mb": round(self.memory_mb, 1),
+                "memory_budget_mb": self.memory_budget_mb,
+                "waiting": {name: sum(1 for w in self._waiting if w.priority == p) for p, name in PRIORITY_NAMES.items()},
+            }
+
+
+class AdmittedPool:
+    """Render pool wrapper: every submit holds a render slot until its future is done"""
+
+    def __init__(self, render_pool, controller, priority, timeout=None):
+        self.render_pool = render_pool
+        self.controller = controller
+        self.priority = priority
+        self.timeout = timeout
+
+    @property
+    def size(self):
+        return self.render_pool.size
+
+    def submit(self, fn, *args, **kwargs):
+        ticket = self.controller.acquire(self.priority, renders=1, memory_mb=ADMISSION_RENDER_MB, timeout=self.timeout)
+        try:
+            future = self.render_pool.submit(fn, *args, **kwargs)
+        except Exception:
+            ticket.release()
+            raise
+        future.add_done_callback(lambda _: ticket.release())
+        return future
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission():
+    """The process-wide controller (created on first use)"""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController()
+            logger.info(
+                f"Admission: {_controller.max_renders} renders in flight, "
+                f"{_controller.memory_budget_mb:.0f} MB of estimated memory"
+            )
+        return _controller
+
+
+def _stat(key):
+    return lambda: get_admission().stats()[key]
+
+
+Gauge("certificate_admission_renders", "Renders admitted and not yet finished", _stat("renders"))
+Gauge("certificate_admission_memory_mb", "Estimated memory of the admitted work", _stat("memory_mb"))
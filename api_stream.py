@@ -0,0 +1,127 @@
+import os
+import json
+import queue
+import logging
+import threading
+
+from ingest import normalize_column
+from sheet_prep import resolve_column_roles, record_context, NAME_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# ---------------- REQUEST ROWS ----------------
+# Rows per batch of a JSON body (NDJSON rows enter the pipeline one by one, as they arrive)
+API_BATCH_ROWS = int(os.getenv("API_BATCH_ROWS", "100"))
+# While no new row has arrived for this long, finished renders are sent on
+API_IDLE_SECONDS = 0.2
+
+
+def iter_ndjson(stream):
+    """
+    (line number, object or its parse error) for every non-blank line of an
+    NDJSON body, read as it arrives (gunicorn hands the body over in 1 KB reads)
+    """
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as e:
+            yield number, ValueError(f"Invalid JSON: {e}")
+
+
+def read_ahead(records, stop):
+    """
+    Reads records in a thread. Yields them, or None every API_IDLE_SECONDS
+    while none is available, until records is exhausted or stop is set.
+    """
+    incoming = queue.Queue(maxsize=API_BATCH_ROWS)
+    done = object()
+
+    def read():
+        try:
+            for record in records:
+                while not stop.is_set():
+                    try:
+                        incoming.put(record, timeout=API_IDLE_SECONDS)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except Exception as e:
+            logger.error(f"Reading the request body failed: {e}")
+        finally:
+            incoming.put(done)
+
+    threading.Thread(target=read, name="api-reader", daemon=True).start()
+    while not stop.is_set():
+        try:
+            record = incoming.get(timeout=API_IDLE_SECONDS)
+        except queue.Empty:
+            yield None
+            continue
+        if record is done:
+            return
+        yield record
+
+
+def records_row_batches(records, row_numbers, failed, batch_rows=1):
+    """
+    Prepared rows of API records, in batches of at most batch_rows (no
+    DataFrame involved). records yields (row number, dict or error), or None
+    while waiting for input: an empty batch is yielded then, so the pipeline
+    can hand on finished renders. The row number of every row handed on is
+    appended to row_numbers; unusable rows go to failed(row number, error).
+    """
+    batch = []
+    roles_by_columns = {}
+    for item in records:
+        if item is None:
+            yield batch
+            batch = []
+            continue
+        number, record = item
+        if not isinstance(record, dict):
+            failed(number, record if isinstance(record, Exception) else ValueError("A row must be a JSON object"))
+            continue
+        record = {normalize_column(key): value for key, value in record.items()}
+        columns = tuple(record)
+        if columns not in roles_by_columns:
+            roles_by_columns[columns] = resolve_column_roles(columns)
+        template_context, fields = record_context(record, roles_by_columns[columns])
+        if not fields["student_name"]:
+            failed(number, ValueError(f"No student name (expected one of: {', '.join(NAME_COLUMNS)})"))
+            continue
+        row_numbers.append(number)
+        batch.append((template_context, fields))
+        if len(batch) >= batch_rows:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ---------------- RESPONSE LINES ----------------
+def iter_result_lines(results, finished, batch_id, stop):
+    """
+    NDJSON lines of the results put on the results queue until finished
+    arrives: row results, {"error"} if the batch failed, then the summary line.
+    stop is set when the client goes away before the end.
+    """
+    counts = {"done": 0, "failed": 0}
+    try:
+        while True:
+            result = results.get()
+            if result is finished:
+                break
+            if "status" in result:
+                counts[result["status"]] += 1
+            yield json.dumps(result) + "\n"
+    finally:
+        # Client gone: stop reading its rows (rows already read still finish)
+        stop.set()
+
+    logger.info(f"Bulk API batch {batch_id} finished: {counts['done']} generated, {counts['failed']} failed")
+    yield json.dumps({"summary": {"batch_id": batch_id, **counts}}) + "\n"
@@ -1,20 +1,45 @@
 import os
-import sqlite3
-import pandas as pd
-import re
+# First: the startup phases are timed from here
+from startup import mark, phase, report, warm_imports, start_warmup, PRELOADED, WARMUP_RENDER, WARMUP_TEMPLATES
+import io
+import json
+import math
+import shutil
 import zipfile
 from datetime import datetime
-from flask import Flask, render_template, request, send_file, jsonify
-from weasyprint import HTML
-from jinja2 import Template
-import cloudinary
-import cloudinary.uploader
+from flask import Flask, Response, redirect, render_template, request, send_file, send_from_directory, jsonify, stream_with_context
 import logging
-import gc
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from itertools import chain
+from contextlib import contextmanager, nullcontext
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FuturesTimeout
 from dotenv import load_dotenv
+from db import migrate, transaction, query, iter_chunks, executemany_chunked, close_connections, DB_WRITE_CHUNK_ROWS
+from jobs import create_job, get_job, requeue_job, queued_job_count, active_jobs, keep_alive, JobWorker, LogProgress, JOB_QUEUE_MAX
+from render_pool import get_render_pool, default_pool_size, write_pdf, write_pdf_batch, merge_pdfs, pdf_to_png, BATCH_CHUNK_SIZE, RENDER_TIMEOUT_SECONDS
+from compiled_cache import get_body_template, split_stylesheet, cache_stats
+from layered import supports_layered, write_layered_pdf
+from zip_stream import ZipStream
+from sheet_prep import get_font_size, resolve_column_roles, iter_row_contexts, certificate_title
+from ingest import SheetReader, iter_sheet_frames, preview_sheet
+from api_stream import iter_ndjson, read_ahead, records_row_batches, iter_result_lines, API_BATCH_ROWS
+from staging import SheetStaging, validate_staged
+from verification import CertificateLookups
+from storage import UploadStage, upload_with_retries, get_storage_backend, LocalBackend
+from pdf_cache import PdfCache, asset_version, certificate_key
+from asset_variants import build_variants, settings_key, ASSET_VARIANTS
+from checkpoints import BatchCheckpoint
+from reissue import IncrementalIssue
+from numbering import init_numbering, reserve_certificate_numbers, peek_certificate_number, claim_certificate_number, reset_numbering
+from dry_run import dry_run
+from metrics import timed, timed_iter, render_metrics, BatchMonitor, profiled, PROFILE_BATCHES
+from admission import get_admission, Overloaded, BULK, BATCH
+from janitor import Janitor, trim_dir, remove_old_files, remove_old_dirs, PDF_DIR_MAX_MB, JOB_OUTPUT_MAX_AGE_HOURS, JOB_LEFTOVER_MAX_AGE_HOURS
 
 load_dotenv()
+mark("imports")
 
 # ---------------- LOGGING CONFIG ----------------
 logging.basicConfig(level=logging.INFO)
@@ -33,46 +58,50 @@ if not all([cloudinary_cloud_name, cloudinary_api_key, cloudinary_api_secret]):
 if cloudinary_cloud_name == "Certificate":
     logger.error("CRITICAL: Your Cloudinary 'cloud_name' is still set to 'Certificate'. Please update your Render environment variables with your actual Cloudinary Cloud Name.")
 
-cloudinary.config(
-    cloud_name=cloudinary_cloud_name,
-    api_key=cloudinary_api_key,
-    api_secret=cloudinary_api_secret
-)
+# cloudinary itself is imported and configured by storage.CloudinaryBackend on first upload
 
 # ---------------- PATHS ----------------
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-DB_PATH = os.path.join(BASE_DIR, "certificates.db")
+# Overridable so tools (benchmark.py) can run against a scratch database
+DB_PATH = os.getenv("DB_PATH", os.path.join(BASE_DIR, "certificates.db"))
 PDF_DIR = os.path.join(BASE_DIR, "generated", "pdfs")
+UPLOAD_DIR = os.path.join(BASE_DIR, "generated", "uploads")
+JOB_DIR = os.path.join(BASE_DIR, "generated", "jobs")
+PROFILE_DIR = os.path.join(BASE_DIR, "generated", "profiles")
+STAGING_DIR = os.path.join(BASE_DIR, "generated", "staging")
+PDF_CACHE_DIR = os.path.join(BASE_DIR, "generated", "pdf_cache")
+PREVIEW_CACHE_DIR = os.path.join(BASE_DIR, "generated", "preview_cache")
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+
+# Keep a copy of every bulk certificate under PDF_DIR (off: they live in the ZIP and on Cloudinary)
+PDF_RETENTION = os.getenv("PDF_RETENTION", "0") == "1"
+
+# First certificate number of an empty database
+START_NUMBER = 411
 
 
 # ---------------- DATABASE INIT ----------------
 def init_db():
     logger.info("Initializing database...")
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS certificates (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            certificate_number TEXT,
-            student_name TEXT,
-            pdf_path TEXT,
-            cloudinary_url TEXT
-        )
-    """)
-    
-    # Migration: Add cloudinary_url if not exists
-    c.execute("PRAGMA table_info(certificates)")
-    columns = [info[1] for info in c.fetchall()]
-    if "cloudinary_url" not in columns:
-        logger.info("Adding cloudinary_url column to certificates table...")
-        c.execute("ALTER TABLE certificates ADD COLUMN cloudinary_url TEXT")
-        
-    conn.commit()
-    conn.close()
-    logger.info("Database initialization complete.")
+    # Versioned schema (certificates, jobs, sequence, indexes), see db.MIGRATIONS
+    version = migrate(DB_PATH)
+    init_numbering(DB_PATH, START_NUMBER)
+    logger.info(f"Database initialization complete (schema version {version}).")
 
 # Initialize the DB immediately on startup
-init_db()
+with phase("init_db"):
+    init_db()
+
+
+# ---------------- ASSET VARIANTS ----------------
+# Print-resolution copies of static/images, served to WeasyPrint instead of
+# the originals (built once per image / setting, before any render worker starts)
+if ASSET_VARIANTS and __name__ != "__mp_main__":
+    try:
+        with phase("asset_variants"):
+            build_variants()
+    except Exception as e:
+        logger.error(f"Building asset variants failed, PDFs embed the original images: {e}", exc_info=True)
 
 
 # ---------------- SAFE VALUE (NaN FIX) ----------------
@@ -82,176 +111,958 @@ def safe_value(value):
     """
     if value is None:
         return ""
-    if isinstance(value, float) and pd.isna(value):
+    if isinstance(value, float) and math.isnan(value):
         return ""
     return str(value).strip()
 
 
 # ---------------- CERTIFICATE NUMBER ----------------
-def get_last_certificate_number_int():
-    """Returns the integer part of the last certificate number"""
-    START_NUMBER = 411
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT certificate_number FROM certificates ORDER BY id DESC LIMIT 1")
-    row = c.fetchone()
-    conn.close()
-
-    if not row:
-        return START_NUMBER - 1
-
-    match = re.search(r"(\d+)$", row[0])
-    db_last_no = int(match.group(1)) if match else 0
-    
-    # Return whichever is higher: the sequence from DB or the START_NUMBER
-    return max(db_last_no, START_NUMBER - 1)
+# A single certificate is rendered again with the next number at most this
+# many times when running batches keep taking the one it was rendered with
+SINGLE_NUMBER_ATTEMPTS = 3
+
 
 def format_certificate_number(number):
     PAD_LENGTH = 3
     return f"ACDT-C-25-{number:0{PAD_LENGTH}d}"
 
-def get_next_certificate_number():
-    last_no = get_last_certificate_number_int()
-    return format_certificate_number(last_no + 1)
-
-
-# ---------------- SEMESTER FORMAT ----------------
-def format_semester(semester):
-    if semester is None or pd.isna(semester):
-        return ""
-
-    semester = str(semester).strip()
-    if not semester:
-        return ""
-
-    match = re.match(r"^(\d+)(st|nd|rd|th)$", semester, re.IGNORECASE)
-    if match:
-        return f"{match.group(1)}<sup>{match.group(2)}</sup>"
+def explicit_start_number(value):
+    """User-given starting number, or None to continue the sequence"""
+    value = str(value or "").strip()
+    return int(value) if value.isdigit() else None
 
-    if semester.isdigit():
-        sem = int(semester)
-        suffix = {1: "st", 2: "nd", 3: "rd"}.get(sem % 10, "th")
-        return f"{sem}{suffix}"
 
-    return semester
-
-def get_font_size(name):
-    """Calculate dynamic font size based on name length.
-    More aggressive scaling to ensure names fit on one line.
+def save_certificate_records(rows):
     """
-    length = len(str(name))
-    if length > 25: return "28px"
-    if length > 20: return "34px"
-    if length > 15: return "40px"
-    return "52px"
-
-
-# ---------------- INTERNSHIP DURATION ----------------
-def format_internship_duration(row):
-    hours = row.get("internship_hours")
-    if not pd.isna(hours) and str(hours).strip():
-        return f"{int(hours)} Hours"
-
-    # Support various date column names
-    start = row.get("start_date") or row.get("joining_date") or row.get("start")
-    end = row.get("end_date") or row.get("ending_date") or row.get("end")
-
-    if not pd.isna(start) and not pd.isna(end):
-        try:
-            start_fmt = pd.to_datetime(start).strftime("%d-%m-%Y")
-            end_fmt = pd.to_datetime(end).strftime("%d-%m-%Y")
-            return f"from {start_fmt} to {end_fmt}"
-        except:
-            pass
+    Stores (certificate_number, student_name, pdf_path, cloudinary_url,
+    render_context) rows with batched writes. Re-issuing an existing number
+    (explicit start number) replaces its record; a row without a render
+    context keeps the stored one.
+    """
+    for chunk in iter_chunks(rows):
+        with timed("db_write"), transaction(DB_PATH) as conn:
+            numbers = [row[0] for row in chunk]
+            existing = {
+                r[0] for r in conn.execute(
+                    f"SELECT certificate_number FROM certificates WHERE certificate_number IN ({','.join('?' * len(numbers))})",
+                    numbers
+                )
+            }
+            conn.executemany(
+                "UPDATE certificates SET student_name = ?, pdf_path = ?, cloudinary_url = ?, "
+                "render_context = COALESCE(?, render_context) WHERE certificate_number = ?",
+                [(name, path, url, stored, no) for no, name, path, url, stored in chunk if no in existing]
+            )
+            conn.executemany(
+                "INSERT INTO certificates (certificate_number, student_name, pdf_path, cloudinary_url, render_context) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [row for row in chunk if row[0] not in existing]
+            )
+
+
+# Rendered certificates by content hash (see pdf_cache.py)
+pdf_cache = PdfCache(PDF_CACHE_DIR)
+
+# Row preview thumbnails: default / largest width in pixels, disk bound of their cache
+PREVIEW_WIDTH = int(os.getenv("PREVIEW_WIDTH", "800"))
+PREVIEW_MAX_WIDTH = 2000
+PREVIEW_CACHE_MAX_MB = float(os.getenv("PREVIEW_CACHE_MAX_MB", "64"))
+preview_cache = PdfCache(PREVIEW_CACHE_DIR, int(PREVIEW_CACHE_MAX_MB * 1024 * 1024), ext="png")
+
+
+# ---------------- SHEET STAGING ----------------
+# Sheets are parsed once and reused by preview, validation and generation
+staging = SheetStaging(STAGING_DIR)
+
+
+def staged_sheet_json(info):
+    # Create mapping of original to normalized
+    column_mapping = [
+        {"original": orig, "normalized": norm}
+        for orig, norm in zip(info["raw_columns"], info["columns"])
+    ]
+    return {
+        "success": True,
+        "token": info["token"],
+        "columns": column_mapping,
+        "row_count": info["row_count"],
+        "expires_in": info["expires_in"]
+    }
+
+
+@app.route("/staging", methods=["POST"])
+def stage_sheet():
+    """
+    Uploads and parses a sheet once; the returned token is used instead of
+    the file for preview, validation and generation
+    """
+    try:
+        excel_file = request.files.get("excel")
+        if not excel_file or not excel_file.filename:
+            return jsonify({"error": "No file uploaded"}), 400
+        return jsonify(staged_sheet_json(staging.stage(excel_file, excel_file.filename)))
+    except Exception as e:
+        logger.error(f"Staging error: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 400
 
-    return ""
 
+@app.route("/staging/<token>")
+def staged_sheet(token):
+    """Columns, row count and the first rows of a staged sheet"""
+    info = staging.get(token)
+    if not info:
+        return jsonify({"error": "Staged sheet not found or expired"}), 404
 
-# ---------------- CLOUDINARY UPLOAD ----------------
-def upload_to_cloudinary(file_path, public_id):
-    try:
-        logger.info(f"Uploading {file_path} to Cloudinary...")
-        response = cloudinary.uploader.upload(file_path, public_id=public_id, resource_type="auto")
-        url = response.get("secure_url")
-        logger.info(f"Upload successful: {url}")
-        return url
-    except Exception as e:
-        logger.error(f"Cloudinary upload failed: {e}", exc_info=True)
-        return None
+    data = staged_sheet_json(info)
+    sample = staging.sample(token, rows=int(request.args.get("rows", 5)))
+    data["rows"] = [] if sample is None else sample.astype(str).to_dict(orient="records")
+    return jsonify(data)
 
 
-# ---------------- SMART HEADER DETECTION ----------------
-def detect_header_row(excel_file):
-    """
-    Scans first 10 rows to find the one with the most non-empty columns.
-    Returns the 0-based index of that row.
-    """
-    try:
-        # Read first 10 rows without header to inspect content
-        df_preview = pd.read_excel(excel_file, header=None, nrows=10)
-        
-        max_cols = 0
-        best_row = 0
-        
-        for idx, row in df_preview.iterrows():
-            # Count values that are not null and not empty strings
-            valid_cols = row.dropna().astype(str).str.strip().ne("").sum()
-            
-            # If this row has more data than previous best, it's likely the header
-            # We use >= to prefer the *first* row if multiple have same count (standard case)
-            if valid_cols > max_cols:
-                max_cols = valid_cols
-                best_row = idx
-                
-        return best_row
-    except Exception:
-        return 0  # Fallback to first row on error
+@app.route("/staging/<token>/validate", methods=["POST"])
+def validate_staged_sheet(token):
+    """Checks a staged sheet (and optionally the certificate content) before generation"""
+    if not staging.get(token):
+        return jsonify({"error": "Staged sheet not found or expired"}), 404
+    content = request.form.get("content") or (request.get_json(silent=True) or {}).get("content", "")
+    result = validate_staged(staging, token, content)
+    return jsonify({"success": not result["errors"], **result})
 
 
 # ---------------- PREVIEW EXCEL COLUMNS ----------------
 @app.route("/preview_columns", methods=["POST"])
 def preview_columns():
     """
-    Returns the column names from uploaded Excel file as JSON
+    Returns the column names from uploaded Excel file as JSON.
+    The sheet is not staged: POST /staging parses it when validation or
+    generation by token is needed.
     """
     try:
         excel_file = request.files.get("excel")
         if not excel_file or not excel_file.filename:
             return jsonify({"error": "No file uploaded"}), 400
-        
-        # Smart detect header row
-        header_row_idx = detect_header_row(excel_file)
-        
-        # Reset file pointer after detection read
-        excel_file.seek(0)
-        
-        df = pd.read_excel(excel_file, header=header_row_idx)
-        
-        # Normalize column names
-        original_columns = df.columns.tolist()
-        normalized_columns = []
-        for col in df.columns:
-            # Handle non-string column names
-            col_str = str(col).strip().lower()
-            norm_col = re.sub(r"\s+", "_", col_str)
-            normalized_columns.append(norm_col)
-        
+
+        # Only the header rows and the sheet dimension are read, not the data
+        original_columns, normalized_columns, row_count = preview_sheet(excel_file, excel_file.filename)
+
         # Create mapping of original to normalized
         column_mapping = [
-            {"original": orig, "normalized": norm} 
+            {"original": orig, "normalized": norm}
             for orig, norm in zip(original_columns, normalized_columns)
         ]
-        
+
         return jsonify({
             "success": True,
             "columns": column_mapping,
-            "row_count": len(df)
+            "row_count": row_count
         })
     except Exception as e:
         logger.error(f"Preview columns error: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 400
 
 
+# ---------------- ROW CONTEXT ----------------
+def build_certificate_context(template_context, fields, template, cert_no, cert_type_preference):
+    """Certificate page context for one prepared sheet row (see sheet_prep)"""
+    rendered_body = template.render(**template_context)
+    cert_title = certificate_title(rendered_body, cert_type_preference, fields["industrial_visit_hint"])
+
+    return {
+        "student_name": fields["student_name"],
+        "student_name_style": fields["student_name_style"],
+        "certificate_body": rendered_body,
+        "certificate_title": cert_title,
+        "certificate_number": cert_no,
+        "place": fields["place"],
+        "issue_date": fields["issue_date"],
+        "base_url": f"file:///{BASE_DIR.replace(os.sep, '/')}"
+    }
+
+
+def render_context_json(template_name, context):
+    """What is stored to render a certificate again: its page template and context (base_url is set when rendering)"""
+    return json.dumps(
+        {"template": template_name, "context": {k: v for k, v in context.items() if k != "base_url"}},
+        default=str
+    )
+
+
+# ---------------- DRY RUN / ROW PREVIEW ----------------
+def request_data():
+    """Form fields, or the JSON body"""
+    return request.form if request.form else (request.get_json(silent=True) or {})
+
+
+def request_sheet_token(data):
+    """Token of the staged sheet of a request (an uploaded sheet is staged first), or None"""
+    token = (data.get("sheet_token") or "").strip()
+    if token:
+        return token if staging.get(token) else None
+    excel_file = request.files.get("excel")
+    if excel_file and excel_file.filename:
+        return staging.stage(excel_file, excel_file.filename)["token"]
+    return None
+
+
+def count_existing_certificates(numbers):
+    """How many of these certificate numbers are already issued"""
+    found = 0
+    for chunk in iter_chunks(numbers):
+        found += query(
+            DB_PATH,
+            f"SELECT COUNT(*) FROM certificates WHERE certificate_number IN ({','.join('?' * len(chunk))})",
+            chunk
+        )[0][0]
+    return found
+
+
+@app.route("/dry_run", methods=["POST"])
+def dry_run_sheet():
+    """
+    Everything a bulk batch does except rendering: column roles, the numbers
+    the rows would get (none is reserved), the content of every row and its
+    title. Returns the warnings per row.
+    """
+    data = request_data()
+    try:
+        token = request_sheet_token(data)
+        if not token:
+            return jsonify({"error": "Upload a sheet or give the sheet_token of a staged one"}), 400
+
+        start_number = explicit_start_number(data.get("start_number"))
+        first_number = peek_certificate_number(DB_PATH, start_number)
+        result = dry_run(
+            staging.iter_frames(token),
+            data.get("content", ""),
+            data.get("cert_type", "auto"),
+            first_number,
+            format_certificate_number
+        )
+        numbers = result.pop("numbers")
+        existing = count_existing_certificates(numbers)
+        if existing:
+            result["warnings"].append(
+                f"{existing} of the certificate numbers are already issued and their records would be replaced."
+            )
+        result["certificate_numbers"] = {
+            "first": numbers[0] if numbers else None,
+            "last": numbers[-1] if numbers else None,
+            "existing": existing,
+            "reserved": False,
+        }
+        return jsonify({"success": not result["errors"], "token": token, **result})
+    except Exception as e:
+        logger.error(f"Dry run error: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route("/preview", methods=["POST"])
+def preview_row():
+    """
+    One row of a sheet rendered with the chosen template and content, as a
+    PNG thumbnail (PDF when pypdfium2 is not installed). Thumbnails are
+    cached by the hash of the rendered page.
+    """
+    data = request_data()
+    try:
+        token = request_sheet_token(data)
+        if not token:
+            return jsonify({"error": "Upload a sheet or give the sheet_token of a staged one"}), 400
+        row = max(1, int(data.get("row") or 1))
+        width = max(100, min(int(data.get("width") or PREVIEW_WIDTH), PREVIEW_MAX_WIDTH))
+        selected_template = data.get("template", "certificate.html")
+
+        # Find the row in the staged chunks
+        roles = None
+        row_offset = 0
+        found = None
+        for df in staging.iter_frames(token):
+            roles = roles or resolve_column_roles(df.columns)
+            if row <= row_offset + len(df):
+                found = next(
+                    (template_context, fields)
+                    for k, template_context, fields in iter_row_contexts(df, roles)
+                    if row_offset + k == row - 1
+                )
+                break
+            row_offset += len(df)
+        if found is None:
+            return jsonify({"error": f"The sheet has no row {row}"}), 404
+
+        # The number this row would get if the batch ran now
+        cert_no = format_certificate_number(
+            peek_certificate_number(DB_PATH, explicit_start_number(data.get("start_number"))) + row - 1
+        )
+        context = build_certificate_context(
+            *found, get_body_template(data.get("content", "")), cert_no, data.get("cert_type", "auto")
+        )
+        html, css_text = split_stylesheet(render_template(selected_template, **context))
+        assets = f"{asset_version(STATIC_DIR)}:{settings_key()}"
+
+        thumbnail_key = certificate_key(html, css_text, f"preview:{width}", assets)
+        hit = preview_cache.get(thumbnail_key)
+        if hit:
+            return Response(hit[0], mimetype="image/png", headers={"X-Preview-Cache": "hit"})
+
+        # Same key as the bulk path: a page rendered before is not rendered again
+        pdf_key = certificate_key(html, css_text, "full", assets)
+        cached_pdf = pdf_cache.get(pdf_key) if pdf_cache.enabled else None
+        render_pool = get_render_pool()
+        with get_admission().single():
+            if cached_pdf:
+                pdf = cached_pdf[0]
+            else:
+                pdf = render_pool.submit(write_pdf, html, BASE_DIR, None, css_text).result(timeout=RENDER_TIMEOUT_SECONDS)
+                pdf_cache.put(pdf_key, pdf)
+
+            try:
+                png = render_pool.submit(pdf_to_png, pdf, width).result(timeout=RENDER_TIMEOUT_SECONDS)
+            except Exception as e:
+                logger.warning(f"PNG preview unavailable ({e}), returning the PDF")
+                return Response(pdf, mimetype="application/pdf", headers={"X-Preview-Cache": "miss"})
+        preview_cache.put(thumbnail_key, png)
+        return Response(png, mimetype="image/png", headers={"X-Preview-Cache": "miss"})
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Preview error: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 400
+
+
+# ---------------- BULK PIPELINE ----------------
+def frame_row_batches(frames):
+    """Prepared rows of DataFrame chunks (iter_sheet_frames / staging): one [(template_context, fields)] per chunk"""
+    # Column roles are resolved once; derived values per chunk of rows
+    roles = None
+    for df in frames:
+        if roles is None:
+            roles = resolve_column_roles(df.columns)
+        yield [(template_context, fields) for _, template_context, fields in iter_row_contexts(df, roles)]
+
+
+def iter_rendered_certificates(batches, options, batch_id, progress, checkpoint=None):
+    """
+    Renders every row of the batches of prepared rows (frame_row_batches,
+    or records_row_batches for the JSON API) in the process pool and yields
+    each finished PDF as soon as it is ready, in row order:
+    {"name": file name, "pdf": bytes, "rows": [(index, cert_no, student_name, render_context)]}.
+    In combined output a part is one chunk of rows.
+    With a checkpoint, every row's number / rendered PDF is recorded, and
+    rows already rendered by an interrupted run are reused instead.
+    With options["incremental"], only rows that are new or changed since
+    an earlier run are yielded (incremental_output "full": every row).
+    """
+    custom_content = options.get("content", "")
+    cert_type_preference = options.get("cert_type", "auto")
+    selected_template = options.get("template", "certificate.html")
+    # Layered mode draws only the per-student text over a cached background page
+    layered = options.get("render_mode") == "layered" and supports_layered(selected_template)
+    # Batch mode lays out BATCH_CHUNK_SIZE rows as one multi-page document,
+    # either split per certificate or kept as one combined PDF
+    batch_mode = options.get("render_mode") == "batch"
+    combined = batch_mode and options.get("output_format") == "combined"
+
+    # PDFs are kept on disk only when retention is on
+    batch_dir = os.path.join(PDF_DIR, batch_id)
+    if PDF_RETENTION and not combined:
+        os.makedirs(batch_dir, exist_ok=True)
+
+    # Starting number given for this batch (otherwise the sequence continues)
+    start_number = explicit_start_number(options.get("start_number"))
+
+    # Compiled once and shared with other batches using the same content;
+    # per row only the context is bound
+    template = get_body_template(custom_content)
+    page_template = app.jinja_env.get_template(selected_template)
+
+    # PDFs are rendered in the process pool; only a bounded number of
+    # documents is queued ahead so memory stays flat on big sheets, and
+    # every render takes a slot shared with the other batches (admission.py)
+    render_pool = get_admission().pool(get_render_pool(), BULK)
+    pending_renders = deque()
+    max_pending = max(1, render_pool.size * 2)
+    chunk = []
+    chunk_css_text = ""
+
+    # Certificates whose final HTML, template styles and assets are unchanged
+    # since an earlier run are taken from the PDF cache (with their URL)
+    assets = f"{asset_version(STATIC_DIR)}:{settings_key()}"
+    # Keyed per render variant: pages laid out with BATCH_PAGE_CSS or over a
+    # layered background are never served as a single full render
+    cache_mode = "layered" if layered else "batch" if batch_mode else "full"
+
+    # Incremental re-issue: rows matching an earlier certificate keep its
+    # number; unchanged ones are skipped, or for the full set taken from
+    # their stored context (PDF cache, else rendered again as issued)
+    reissue = IncrementalIssue(DB_PATH, options) if options.get("incremental") else None
+    full_set = options.get("incremental_output") == "full"
+    issue_keys = set()
+    issue_rows = {}  # row index -> (issue key, cert_no, row hash), recorded once rendered
+
+    def record_issue(i):
+        issue = issue_rows.pop(i, None)
+        if issue:
+            reissue.issued(*issue)
+
+    def submit_chunk():
+        # One multi-page document per chunk: layout setup is paid once for all its rows
+        rows = [(i, cert_no, name, stored) for i, cert_no, name, stored, _, _ in chunk]
+        htmls = [html for _, _, _, _, html, _ in chunk]
+        keys = [key for _, _, _, _, _, key in chunk]
+        future = render_pool.submit(write_pdf_batch, htmls, BASE_DIR, None, chunk_css_text, combined)
+        pending_renders.append((rows, future, keys, None))
+        chunk.clear()
+
+    # Rendered PDFs of an interrupted run, by row (combined chunks are
+    # shared by their rows and are only yielded with the first one)
+    resumed_paths = set()
+
+    def reuse(pdf, url, source):
+        # A PDF that needs no render: same queue as the renders to keep the order
+        if chunk:
+            submit_chunk()
+        future = Future()
+        future.set_result(pdf)
+        return future, {"urls": [url], "source": source}
+
+    def collect_render():
+        rows, future, keys, reused = pending_renders.popleft()
+        try:
+            # Bounded: a render lost with its worker fails its rows instead of hanging the batch
+            pdfs = future.result(timeout=RENDER_TIMEOUT_SECONDS)
+        except Exception as e:
+            if isinstance(e, FuturesTimeout):
+                e = TimeoutError(f"No render result after {RENDER_TIMEOUT_SECONDS:.0f}s")
+            for i, cert_no, _, _ in rows:
+                logger.error(f"Row {i + 1} ({cert_no}) failed: {e}")
+                progress.row_failed(i + 1, e)
+                issue_rows.pop(i, None)
+            return
+
+        if not isinstance(pdfs, list):
+            pdfs = [pdfs]
+        cached = bool(reused) and reused["source"] == "cache"
+        if combined:
+            name = f"chunk_{rows[0][0] + 1:06d}.pdf"
+            if checkpoint and not reused:
+                checkpoint.rendered([i for i, _, _, _ in rows], pdfs[0], name)
+            yield {"name": name, "pdf": pdfs[0], "rows": rows}
+            for i, _, _, _ in rows:
+                record_issue(i)
+                progress.row_done(cached=cached)
+            return
+
+        for n, (row_info, pdf) in enumerate(zip(rows, pdfs)):
+            cert_no = row_info[1]
+            if not reused or reused["source"] == "stored":
+                pdf_cache.put(keys[n], pdf)
+            if checkpoint and not (reused and reused["source"] == "checkpoint"):
+                checkpoint.rendered([row_info[0]], pdf, f"{cert_no}.pdf")
+            if PDF_RETENTION:
+                with open(os.path.join(batch_dir, f"{cert_no}.pdf"), "wb") as f:
+                    f.write(pdf)
+            yield {
+                "name": f"{cert_no}.pdf", "pdf": pdf, "rows": [row_info],
+                "cache_key": keys[n], "url": reused["urls"][n] if reused else None
+            }
+            record_issue(row_info[0])
+            progress.row_done(cached=cached)
+
+    # (a request context is needed for url_for() inside the templates)
+    with app.test_request_context():
+        row_offset = 0
+        for rows in timed_iter("ingest", batches):
+            # Numbers for the rows of this chunk are reserved in one transaction,
+            # so concurrent batches / workers never get the same ones
+            # (rows numbered by an interrupted run of this job keep their number)
+            numbers = {
+                k: checkpoint.rows[row_offset + k]["certificate_number"]
+                for k in range(len(rows)) if checkpoint and row_offset + k in checkpoint.rows
+            }
+            # Rows issued a certificate by an earlier run keep its number
+            row_issues = {}
+            if reissue:
+                hashed = [(reissue.key(tc, f), reissue.row_hash(tc, f)) for tc, f in rows]
+                earlier = reissue.lookup([(key, tc, f) for (key, _), (tc, f) in zip(hashed, rows)])
+                for k, (key, row_hash) in enumerate(hashed):
+                    # The same student twice in a sheet: the second row gets a certificate of its own
+                    if key in issue_keys:
+                        continue
+                    issue_keys.add(key)
+                    previous = earlier.get(key)
+                    if previous and k not in numbers:
+                        numbers[k] = previous["certificate_number"]
+                    row_issues[k] = (key, row_hash, previous)
+            missing = [k for k in range(len(rows)) if k not in numbers]
+            if missing:
+                first_no = reserve_certificate_numbers(
+                    DB_PATH, len(missing), None if start_number is None else start_number + row_offset + missing[0]
+                )
+                for n, k in enumerate(missing):
+                    numbers[k] = format_certificate_number(first_no + n)
+                if checkpoint:
+                    checkpoint.reserved([(row_offset + k, numbers[k]) for k in missing])
+
+            for chunk_index, (template_context, fields) in enumerate(rows):
+                i = row_offset + chunk_index
+                # Incremented number for each row
+                cert_no = numbers[chunk_index]
+                if chunk_index in row_issues:
+                    issue_key, row_hash, previous = row_issues[chunk_index]
+                    if previous and previous["row_hash"] == row_hash:
+                        reissue.counts["unchanged"] += 1
+                        if not full_set:
+                            progress.row_done(cached=True)
+                            continue
+                        if previous["render_context"]:
+                            try:
+                                stored = previous["render_context"]
+                                html, css_text = stored_certificate_html(json.loads(stored))
+                                key = certificate_key(html, css_text, "full", assets)
+                                hit = pdf_cache.get(key)
+                                if hit:
+                                    future, reused = reuse(hit[0], previous["url"], "cache")
+                                else:
+                                    if chunk:
+                                        submit_chunk()
+                                    future = render_pool.submit(write_pdf, html, BASE_DIR, None, css_text)
+                                    reused = {"urls": [previous["url"]], "source": "stored"}
+                            except Exception as e:
+                                logger.error(f"Row {i + 1} ({cert_no}) failed: {e}", exc_info=True)
+                                progress.row_failed(i + 1, e)
+                                continue
+                            pending_renders.append(([(i, cert_no, fields["student_name"], stored)], future, [key], reused))
+                            if len(pending_renders) >= max_pending:
+                                yield from collect_render()
+                            continue
+                    else:
+                        reissue.counts["changed" if previous else "new"] += 1
+                        issue_rows[i] = (issue_key, cert_no, row_hash)
+                resumed = checkpoint.resumable(i) if checkpoint else None
+                if resumed:
+                    path = resumed["pdf_path"]
+                    with open(path, "rb") as f:
+                        pdf = None if path in resumed_paths else f.read()
+                    resumed_paths.add(path)
+                    try:
+                        # Stored again in case the interrupted run never wrote its record
+                        stored = render_context_json(selected_template, build_certificate_context(
+                            template_context, fields, template, cert_no, cert_type_preference
+                        ))
+                    except Exception:
+                        stored = None
+                    future, reused = reuse(pdf, resumed["url"], "checkpoint")
+                    pending_renders.append(([(i, cert_no, fields["student_name"], stored)], future, [None], reused))
+                    if len(pending_renders) >= max_pending:
+                        yield from collect_render()
+                    continue
+
+                try:
+                    with timed("context"):
+                        context = build_certificate_context(template_context, fields, template, cert_no, cert_type_preference)
+                        stored = render_context_json(selected_template, context)
+                    with timed("render_template"):
+                        html, css_text = split_stylesheet(page_template.render(**context))
+                    key = certificate_key(html, css_text, cache_mode, assets) if pdf_cache.enabled else None
+                    hit = pdf_cache.get(key) if key else None
+
+                    # Generate PDF (in a render worker process)
+                    if hit:
+                        # Rendered in an earlier run: no render and no upload
+                        future, reused = reuse(*hit, "cache")
+                    elif batch_mode:
+                        chunk_css_text = css_text
+                        chunk.append((i, cert_no, context["student_name"], stored, html, key))
+                        future = None
+                    elif layered:
+                        future = render_pool.submit(write_layered_pdf, html, BASE_DIR, None, css_text, selected_template, assets)
+                    else:
+                        future = render_pool.submit(write_pdf, html, BASE_DIR, None, css_text)
+                except Exception as e:
+                    logger.error(f"Row {i + 1} ({cert_no}) failed: {e}", exc_info=True)
+                    progress.row_failed(i + 1, e)
+                    continue
+
+                if future is not None:
+                    pending_renders.append((
+                        [(i, cert_no, context["student_name"], stored)], future, [key], reused if hit else None
+                    ))
+                elif len(chunk) >= BATCH_CHUNK_SIZE:
+                    submit_chunk()
+                if len(pending_renders) >= max_pending:
+                    yield from collect_render()
+
+            # Finished renders go out right away (rows may arrive slowly from an API
+            # client; an empty batch means none is waiting, so a partial chunk is sent)
+            if not rows and chunk:
+                submit_chunk()
+            while pending_renders and pending_renders[0][1].done():
+                yield from collect_render()
+            row_offset += len(rows)
+            if reissue:
+                reissue.flush()
+
+        if chunk:
+            submit_chunk()
+        while pending_renders:
+            yield from collect_render()
+        if reissue:
+            reissue.flush()
+            logger.info(f"Incremental re-issue of batch {batch_id}: {reissue.summary()}")
+
+
+class BatchRecords:
+    """
+    DB records of one batch, written while it renders: rows are inserted in
+    chunks as their PDFs are ready and each upload URL is stored as soon as
+    that upload finishes (uploads finishing before their row was inserted
+    are kept until the insert).
+    on_url(cert_no, url) is called once the URL of a certificate is known
+    (url is None when its upload failed or nothing was uploaded).
+    """
+
+    def __init__(self, pdf_path_for, uploads=None, checkpoint=None, on_url=None):
+        self.pdf_path_for = pdf_path_for
+        self.uploads = uploads
+        self.checkpoint = checkpoint
+        self.on_url = on_url
+        self.count = 0
+        self._pending = []
+        self._inserted = set()
+        self._urls = {}
+        self._lock = threading.Lock()
+
+    def add(self, part):
+        """
+        Records a rendered part and (one certificate per part) queues its
+        upload, unless it came from the PDF cache with its URL
+        """
+        url = part.get("url")
+        for _, cert_no, student_name, stored in part["rows"]:
+            self._pending.append((cert_no, student_name, url, stored))
+        self.count += len(part["rows"])
+        if len(self._pending) >= DB_WRITE_CHUNK_ROWS:
+            self.flush()
+        if self.uploads and len(part["rows"]) == 1 and not url:
+            key = part.get("cache_key")
+
+            def uploaded(cert_no, url):
+                self.set_url(cert_no, url)
+                if key:
+                    pdf_cache.set_url(key, url)
+                if self.checkpoint and url:
+                    self.checkpoint.uploaded(cert_no, url)
+                if self.on_url:
+                    self.on_url(cert_no, url)
+            self.uploads.submit(part["pdf"], part["rows"][0][1], uploaded)
+        elif self.on_url:
+            for _, cert_no, _, _ in part["rows"]:
+                self.on_url(cert_no, url)
+
+    def set_url(self, cert_no, url):
+        with self._lock:
+            if cert_no not in self._inserted:
+                self._urls[cert_no] = url
+                return
+            with transaction(DB_PATH) as conn:
+                conn.execute("UPDATE certificates SET cloudinary_url = ? WHERE certificate_number = ?", (url, cert_no))
+
+    def set_url_all(self, url):
+        """Same URL for every certificate of the batch (combined PDF)"""
+        self.flush()
+        with self._lock:
+            rows = [(url, cert_no) for cert_no in self._inserted]
+        executemany_chunked(DB_PATH, "UPDATE certificates SET cloudinary_url = ? WHERE certificate_number = ?", rows)
+
+    def flush(self):
+        with self._lock:
+            rows = [
+                (cert_no, student_name, self.pdf_path_for(cert_no), self._urls.pop(cert_no, url), stored)
+                for cert_no, student_name, url, stored in self._pending
+            ]
+            save_certificate_records(rows)
+            self._inserted.update(cert_no for cert_no, _, _, _ in self._pending)
+            self._pending = []
+
+
+def retained_pdf_path(batch_id):
+    """Where a certificate of this batch is kept, or None without retention"""
+    def pdf_path_for(cert_no):
+        return os.path.join(PDF_DIR, batch_id, f"{cert_no}.pdf") if PDF_RETENTION else None
+    return pdf_path_for
+
+
+# ---------------- BULK GENERATION JOB ----------------
+@contextmanager
+def open_job_sheet(job):
+    """(estimated row count, DataFrame chunks) of a job's sheet: staged or uploaded"""
+    token = job["options"].get("sheet_token")
+    if token:
+        info = staging.get(token)
+        if not info:
+            raise ValueError("The staged sheet has expired. Please upload it again.")
+        yield info["row_count"], staging.iter_frames(token)
+    else:
+        # The sheet is streamed in chunks of rows, it is never fully loaded
+        with SheetReader(job["sheet_path"]) as reader:
+            yield reader.estimated_data_rows, iter_sheet_frames(reader)
+
+
+def profile_path_for(batch_id, options):
+    """Where the cProfile of a batch goes, or None when it was not asked for"""
+    if PROFILE_BATCHES and options.get("profile"):
+        return os.path.join(PROFILE_DIR, f"{batch_id}.prof")
+    return None
+
+
+def run_bulk_job(job, progress):
+    """
+    Runs one bulk generation job in the background worker.
+    Renders every row, uploads to Cloudinary, stores DB records and
+    returns the path of the ZIP with all generated certificates
+    (or of the single combined PDF).
+    """
+    # The heartbeat is kept fresh for the whole run, not only per finished
+    # row: the admission wait, upload retries, the merge and the ZIP can each
+    # outlast JOB_STALE_SECONDS, and another worker would claim the job again
+    with keep_alive(progress):
+        # Jobs are queued already: wait for a batch slot instead of refusing
+        with get_admission().batch(timeout=None), \
+                BatchMonitor("job", job["id"], get_render_pool().worker_pids), \
+                profiled(profile_path_for(job["id"], job["options"])):
+            return generate_job_output(job, progress)
+
+
+def generate_job_output(job, progress):
+    options = job["options"]
+    batch_id = job["id"]
+    combined = options.get("render_mode") == "batch" and options.get("output_format") == "combined"
+
+    os.makedirs(JOB_DIR, exist_ok=True)
+    output_path = os.path.join(JOB_DIR, f"certificates_{batch_id}.{'pdf' if combined else 'zip'}")
+
+    # Rows finished by an earlier, interrupted run of this job are reused
+    checkpoint = BatchCheckpoint(DB_PATH, batch_id, os.path.join(JOB_DIR, batch_id))
+    checkpoint.load()
+
+    # Uploads run alongside rendering (bounded concurrency, retried)
+    with open_job_sheet(job) as (estimated_rows, frames), UploadStage() as uploads:
+        if combined:
+            # Every row points at the combined PDF, uploaded once at the end
+            records = BatchRecords(lambda cert_no: output_path)
+        else:
+            records = BatchRecords(retained_pdf_path(batch_id), uploads, checkpoint)
+        # Estimated from the sheet dimension, corrected once every row was read
+        progress.set_total(estimated_rows or 0)
+        logger.info(f"Bulk generation started. Rows in sheet: {estimated_rows}")
+
+        parts = iter_rendered_certificates(frame_row_batches(frames), options, batch_id, progress, checkpoint)
+        if combined:
+            # Chunks are merged into the single PDF that is downloaded and uploaded
+            chunk_pdfs = []
+            for part in parts:
+                records.add(part)
+                pdf = part.pop("pdf")
+                if pdf is not None:
+                    chunk_pdfs.append(pdf)
+            if chunk_pdfs:
+                with timed("merge"):
+                    merge_pdfs(chunk_pdfs, output_path)
+                uploads.submit(output_path, f"certificates_{batch_id}", lambda _, url: records.set_url_all(url))
+        else:
+            # Each PDF goes into the ZIP as soon as it is rendered (stored:
+            # PDFs are already compressed), so nothing is zipped at the end
+            with zipfile.ZipFile(output_path, "w", compression=zipfile.ZIP_STORED) as zipf:
+                for part in parts:
+                    records.add(part)
+                    with timed("zip"):
+                        zipf.writestr(part["name"], part.pop("pdf"))
+        records.flush()
+
+        progress.set_total(progress.done + progress.failed)
+        logger.info(f"Rows detected after cleanup: {progress.total}")
+
+    logger.info(f"Uploads of batch {batch_id}: {uploads.uploaded} done, {uploads.failed} failed")
+    logger.info(f"Batch {batch_id}: {progress.cached} of {progress.done} certificate(s) served from the PDF cache")
+    # An incremental run whose rows were all unchanged has an empty delta
+    nothing_changed = options.get("incremental") and progress.done and not progress.failed
+    if not records.count:
+        try:
+            os.remove(output_path)
+        except:
+            pass
+        if not progress.total:
+            raise ValueError("No valid data rows found in Excel file. Please check column headings.")
+        if not nothing_changed:
+            raise ValueError("No certificate could be generated from this sheet.")
+        logger.info(f"Batch {batch_id}: nothing changed since the last run, no output")
+
+    logger.info(f"Asset cache after batch {batch_id}: {get_render_pool().asset_cache_stats()}")
+    logger.info(f"Body template cache after batch {batch_id}: {cache_stats()['body_templates']}")
+
+    # Everything is in the output now: the per-row checkpoints can go
+    checkpoint.clear()
+
+    # The uploaded sheet is no longer needed once the batch is done
+    # (staged sheets stay until they expire)
+    if job["sheet_path"]:
+        try:
+            os.remove(job["sheet_path"])
+        except:
+            pass
+
+    return output_path if records.count else None
+
+
+# ---------------- STREAMED BULK GENERATION ----------------
+def stream_bulk_zip(frames, options, total_rows, reader=None):
+    """
+    Generator for a streamed ZIP response: every certificate is written to
+    the client as soon as it is rendered, nothing is buffered on disk.
+    Rows of an uploaded sheet are read from its reader while streaming;
+    the reader is closed at the end.
+    """
+    batch_id = datetime.now().strftime("%Y%m%d%H%M%S_%f")
+    # Combined output needs every chunk before it can be written
+    options = dict(options, output_format="zip")
+    progress = LogProgress(batch_id)
+    progress.set_total(total_rows or 0)
+    zip_stream = ZipStream()
+
+    with BatchMonitor("stream", batch_id, get_render_pool().worker_pids), \
+            profiled(profile_path_for(batch_id, options)), \
+            (reader or nullcontext()), UploadStage() as uploads:
+        records = BatchRecords(retained_pdf_path(batch_id), uploads)
+        for part in iter_rendered_certificates(frame_row_batches(frames), options, batch_id, progress):
+            records.add(part)
+            with timed("zip"):
+                data = zip_stream.add(part.pop("pdf"), part["name"])
+            yield data
+        yield zip_stream.close()
+        records.flush()
+
+    logger.info(
+        f"Streamed batch {batch_id} finished: {progress.done} generated "
+        f"({progress.cached} from the PDF cache), {progress.failed} failed"
+    )
+
+
+# ---------------- JSON / NDJSON API ----------------
+API_OPTIONS = ("template", "cert_type", "content", "start_number", "render_mode")
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+def stream_api_results(records, options, batch_rows):
+    """
+    Generator of the bulk API response (NDJSON): one line per row as soon
+    as its PDF is rendered and uploaded, then a summary line. The rows are
+    rendered in a separate thread while this one writes the results.
+    """
+    batch_id = f"api_{datetime.now().strftime('%Y%m%d%H%M%S_%f')}"
+    results = queue.Queue()
+    stop = threading.Event()
+    finished = object()
+    row_numbers = []  # pipeline row index -> row number of the request
+    pending_rows = {}  # cert_no -> row number, until its URL is known
+
+    def row_failed(number, error):
+        results.put({"row": number, "status": "failed", "error": str(error)})
+
+    def row_done(cert_no, url):
+        results.put({
+            "row": pending_rows.pop(cert_no, None), "status": "done", "certificate_number": cert_no,
+            "url": url, "download_url": f"/certificates/{cert_no}.pdf"
+        })
+
+    def run():
+        progress = LogProgress(batch_id, on_failed=lambda row_index, error: row_failed(row_numbers[row_index - 1], error))
+        batches = records_row_batches(read_ahead(records, stop), row_numbers, row_failed, batch_rows)
+        try:
+            with BatchMonitor("api", batch_id, get_render_pool().worker_pids), UploadStage() as uploads:
+                batch_records = BatchRecords(retained_pdf_path(batch_id), uploads, on_url=row_done)
+                for part in iter_rendered_certificates(batches, options, batch_id, progress):
+                    for i, cert_no, _, _ in part["rows"]:
+                        pending_rows[cert_no] = row_numbers[i]
+                    batch_records.add(part)
+                    part.pop("pdf")
+                    # Stored before its upload finishes: a reported row is downloadable / verifiable
+                    batch_records.flush()
+        except Exception as e:
+            logger.error(f"Bulk API batch {batch_id} failed: {e}", exc_info=True)
+            results.put({"error": str(e)})
+        finally:
+            # A thread per API batch: close the connections it opened
+            close_connections()
+            results.put(finished)
+
+    threading.Thread(target=run, name=f"api-{batch_id}", daemon=True).start()
+    yield from iter_result_lines(results, finished, batch_id, stop)
+
+
+@app.route("/certificates/bulk", methods=["POST"])
+def bulk_api():
+    """
+    Bulk generation from structured rows instead of a sheet.
+    Body: NDJSON (application/x-ndjson), one row object per line, rendered
+    while the body is still arriving; or JSON, a list of rows or
+    {"options": {...}, "rows": [...]}. Row keys are column names as in a sheet.
+    Options (template, cert_type, content, start_number, render_mode) come
+    from the query string, the "options" object or a first NDJSON line
+    {"options": {...}}.
+    The response streams one NDJSON line per row as it finishes:
+    {"row", "status": "done", "certificate_number", "url", "download_url"}
+    or {"row", "status": "failed", "error"}, then {"summary": {...}}.
+    """
+    options = {name: request.args[name] for name in API_OPTIONS if name in request.args}
+    if request.mimetype in NDJSON_MIMETYPES:
+        records = iter_ndjson(request.stream)
+        first = next(records, None)
+        if first and isinstance(first[1], dict) and set(first[1]) == {"options"}:
+            if not isinstance(first[1]["options"], dict):
+                return jsonify({"error": "options must be an object"}), 400
+            options.update(first[1]["options"])
+        elif first:
+            records = chain([first], records)
+        batch_rows = 1
+    elif request.is_json:
+        body = request.get_json(silent=True)
+        rows = body
+        if isinstance(body, dict):
+            if not isinstance(body.get("options") or {}, dict):
+                return jsonify({"error": "options must be an object"}), 400
+            options.update(body.get("options") or {})
+            rows = body.get("rows")
+        if not isinstance(rows, list):
+            return jsonify({"error": "Expected a list of rows (or {\"rows\": [...]})"}), 400
+        records = enumerate(rows, start=1)
+        batch_rows = API_BATCH_ROWS
+    else:
+        return jsonify({"error": "Send the rows as NDJSON (application/x-ndjson) or JSON (application/json)"}), 415
+
+    options = {name: options[name] for name in API_OPTIONS if name in options}
+    try:
+        app.jinja_env.get_template(options.get("template", "certificate.html"))
+    except Exception:
+        return jsonify({"error": f"Unknown template: {options.get('template')}"}), 400
+    # One part per certificate: every row gets its own result
+    options["output_format"] = "zip"
+    # Refused with a 429 when too many batches run (released when the response closes)
+    admitted = get_admission().batch()
+    response = Response(stream_with_context(stream_api_results(records, options, batch_rows)), mimetype="application/x-ndjson")
+    response.call_on_close(admitted.release)
+    return response
+
+
+job_worker = JobWorker(DB_PATH, run_bulk_job)
+
+
+# ---------------- ADMISSION ----------------
+@app.errorhandler(Overloaded)
+def overloaded(e):
+    """No capacity for the request (admission.py): the client retries later instead of the worker running out of memory"""
+    return jsonify({"error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
+
+
 # ---------------- ROUTE ----------------
 @app.route("/", methods=["GET", "POST"])
 def upload():
@@ -262,215 +1073,102 @@ def upload():
         custom_content = request.form.get("content", "").strip()
         single_name = request.form.get("student_name", "").strip()
         cert_type_preference = request.form.get("cert_type", "auto")
+        # A sheet staged before (preview) is used instead of uploading it again
+        sheet_token = request.form.get("sheet_token", "").strip()
+        staged_info = staging.get(sheet_token) if sheet_token else None
+        if sheet_token and not staged_info and not (excel_file and excel_file.filename):
+            return jsonify({"error": "The staged sheet has expired. Please upload it again."}), 400
+        has_sheet = bool(staged_info or (excel_file and excel_file.filename))
 
         # ===================== BULK MODE =====================
-        if excel_file and excel_file.filename:
+        if has_sheet and request.form.get("delivery") == "stream":
+            # Refused with a 429 when too many batches run (released when the response closes)
+            admitted = get_admission().batch()
             try:
-                # Smart detect header row
-                header_row_idx = detect_header_row(excel_file)
-                
-                # Reset file pointer after detection read
-                excel_file.seek(0)
-
-                df = pd.read_excel(excel_file, header=header_row_idx)
-                
-                # Cleanup: remove completely empty rows and convert all headers to string
-                df = df.dropna(how='all')
-                df.columns = [str(c).strip() for c in df.columns]
-
-                # Normalize column names
-                df.columns = (
-                    pd.Series(df.columns)
-                    .str.lower()
-                    .str.replace(r"\s+", "_", regex=True)
-                )
-                
-                # Further cleanup: remove rows where the student name is missing
-                name_cols = ["student_name", "full_name", "name", "full_name_with_initial", "studentname"]
-                actual_name_col = next((c for c in name_cols if c in df.columns), None)
-                if actual_name_col:
-                    df = df[df[actual_name_col].astype(str).str.strip().ne("nan") & df[actual_name_col].astype(str).str.strip().ne("")]
-                
-                df = df.reset_index(drop=True)
-                
-                logger.info(f"Bulk generation started. Rows detected after cleanup: {len(df)}")
-                if len(df) == 0:
-                    return "Error: No valid data rows found in Excel file. Please check column headings."
-
-                # Parse date columns safely (including user-defined ones)
-                date_cols = ["issue_date", "date", "start_date", "end_date", "joining_date", "ending_date"]
-                for col in date_cols:
-                    if col in df.columns:
-                        df[col] = pd.to_datetime(df[col], dayfirst=True, errors="coerce")
-
-                pdf_files = []
-                upload_tasks = []
-                generation_info = []
-
-                # Use a single connection for the whole batch
-                conn = sqlite3.connect(DB_PATH)
-
-                # Use a unique ID for this batch to avoid conflicts in a multi-user environment
-                batch_id = datetime.now().strftime("%Y%m%d%H%M%S")
-                batch_dir = os.path.join(PDF_DIR, batch_id)
-                os.makedirs(batch_dir, exist_ok=True)
-
-                # Get starting number for this batch
-                start_no_input = request.form.get("start_number", "").strip()
-                if start_no_input and start_no_input.isdigit():
-                    current_last_no = int(start_no_input) - 1
+                # ZIP is streamed while the certificates render; the sheet
+                # rows are read while streaming too
+                reader = None
+                if staged_info:
+                    frames = staging.iter_frames(sheet_token)
+                    total_rows = staged_info["row_count"]
                 else:
-                    current_last_no = get_last_certificate_number_int()
-
-                # Reduced workers to 2 to avoid memory crashes on Render 
-                # (WeasyPrint is memory intensive)
-                with ThreadPoolExecutor(max_workers=2) as executor:
-                    for i, (_, row) in enumerate(df.iterrows()):
-                        # Incremented number for each row
-                        cert_no = format_certificate_number(current_last_no + i + 1)
-
-                        # Find issue date in various columns or use today
-                        issue_date_val = row.get("issue_date") or row.get("date")
-                        if not pd.isna(issue_date_val) and hasattr(issue_date_val, "strftime"):
-                            issue_date = issue_date_val.strftime("%d-%m-%Y")
-                        else:
-                            issue_date = datetime.now().strftime("%d-%m-%Y")
-
-                        # Build dynamic context from ALL Excel columns
-                        template_context = {}
-                        for col in df.columns:
-                            value = row.get(col)
-                            if col == "semester":
-                                template_context[col] = format_semester(value)
-                            elif col == "internship_duration":
-                                template_context[col] = format_internship_duration(row)
-                            elif col in ["start_date", "end_date", "joining_date", "ending_date"] and not pd.isna(value):
-                                template_context[col] = pd.to_datetime(value).strftime("%d-%m-%Y")
-                            elif col == "issue_date":
-                                template_context[col] = issue_date
-                            else:
-                                template_context[col] = safe_value(value)
-                        
-                        # Smart Mappings for user template (Support truncated names too)
-                        if "course_name" not in template_context and "subject" in template_context:
-                            template_context["course_name"] = template_context["subject"]
-                        if "internship_program" not in template_context:
-                            template_context["internship_program"] = template_context.get("subject") or template_context.get("department", "")
-                        
-                        # Handle "Register Numbe" or "Register Number" or "Reg ID"
-                        reg_val = None
-                        for key in template_context.keys():
-                            if "register" in key or "reg" in key:
-                                reg_val = template_context[key]
-                                break
-                        if reg_val:
-                            template_context["reg_id"] = reg_val
-                            template_context["register_number"] = reg_val
-                        
-                        if "internship_duration" not in template_context:
-                            template_context["internship_duration"] = format_internship_duration(row)
-
-                        template = Template(custom_content)
-                        rendered_body = template.render(**template_context)
-
-                        # Determine Title
-                        if cert_type_preference == "internship":
-                            cert_title = "INTERNSHIP"
-                        elif cert_type_preference == "industrial_visit":
-                            cert_title = "INDUSTRIAL VISIT"
-                        else:
-                            # Auto-detect logic
-                            subject_val = str(template_context.get("subject", "")).lower()
-                            program_val = str(template_context.get("internship_program", "")).lower()
-                            content_lower = rendered_body.lower()
-                            
-                            if "industrial visit" in subject_val or "industrial visit" in program_val or "industrial visit" in content_lower:
-                                cert_title = "INDUSTRIAL VISIT"
-                            else:
-                                cert_title = "INTERNSHIP"
-
-                        student_name_val = (
-                            row.get("student_name") or 
-                            row.get("full_name") or 
-                            row.get("name") or 
-                            row.get("full_name_with_initial")
-                        )
-
-                        context = {
-                            "student_name": safe_value(student_name_val),
-                            "student_name_style": f"font-size: {get_font_size(student_name_val)};",
-                            "certificate_body": rendered_body,
-                            "certificate_title": cert_title,
-                            "certificate_number": cert_no,
-                            "place": safe_value(row.get("place")),
-                            "issue_date": issue_date,
-                            "base_url": f"file:///{BASE_DIR.replace(os.sep, '/')}"
-                        }
-
-                        selected_template = request.form.get("template", "certificate.html")
-                        html = render_template(selected_template, **context)
-
-                        os.makedirs(batch_dir, exist_ok=True)
-                        pdf_path = os.path.join(batch_dir, f"{cert_no}.pdf")
-
-                        # Generate PDF
-                        HTML(string=html, base_url=BASE_DIR).write_pdf(pdf_path)
-                        pdf_files.append(pdf_path)
-                        
-                        # Queue Cloudinary upload (Parallel)
-                        upload_tasks.append(executor.submit(upload_to_cloudinary, pdf_path, cert_no))
-                        
-                        # Store info for DB insertion later
-                        generation_info.append({
-                            "cert_no": cert_no,
-                            "name": context["student_name"],
-                            "path": pdf_path
-                        })
-                        
-                        # Clean up memory
-                        del html
-                        gc.collect()
-
-                    # Wait for all uploads and update DB
-                    for i, future in enumerate(upload_tasks):
-                        cloudinary_url = future.result()
-                        info = generation_info[i]
-                        
-                        c = conn.cursor()
-                        c.execute(
-                            "INSERT INTO certificates (certificate_number, student_name, pdf_path, cloudinary_url) VALUES (?, ?, ?, ?)",
-                            (info["cert_no"], info["name"], info["path"], cloudinary_url)
-                        )
-                
-                conn.commit()
-                conn.close()
-
-                # ZIP download (Unique name for batch)
-                zip_name = f"certificates_{batch_id}.zip"
-                zip_path = os.path.join(PDF_DIR, zip_name)
-                
-                with zipfile.ZipFile(zip_path, "w") as zipf:
-                    for pdf in pdf_files:
-                        zipf.write(pdf, os.path.basename(pdf))
-
-                # Clean up individual PDFs after zipping (save disk space on Render)
-                for pdf in pdf_files:
-                    try:
-                        os.remove(pdf)
-                    except:
-                        pass
-                try:
-                    os.rmdir(batch_dir)
-                except:
-                    pass
+                    reader = SheetReader(excel_file, excel_file.filename)
+                    frames = iter_sheet_frames(reader)
+                    total_rows = reader.estimated_data_rows
+                first_frame = next(frames, None)
+                if first_frame is None:
+                    admitted.release()
+                    if reader:
+                        reader.close()
+                    return "Error: No valid data rows found in Excel file. Please check column headings."
+                logger.info(f"Streamed bulk generation started. Rows in sheet: {total_rows}")
+
+                options = {
+                    "content": custom_content,
+                    "cert_type": cert_type_preference,
+                    "template": request.form.get("template", "certificate.html"),
+                    "render_mode": request.form.get("render_mode", "standard"),
+                    "start_number": request.form.get("start_number", "").strip(),
+                    "incremental": request.form.get("incremental") == "1",
+                    "incremental_output": request.form.get("incremental_output", "delta"),
+                    "profile": request.form.get("profile") == "1"
+                }
+                response = Response(
+                    # The uploaded file belongs to the request: keep it open while streaming
+                    stream_with_context(stream_bulk_zip(chain([first_frame], frames), options, total_rows, reader)),
+                    mimetype="application/zip",
+                    headers={"Content-Disposition": "attachment; filename=certificates.zip"}
+                )
+                response.call_on_close(admitted.release)
+                return response
+            except Exception as e:
+                admitted.release()
+                logger.error(f"Bulk generation error: {e}", exc_info=True)
+                return jsonify({"error": f"An error occurred during bulk generation: {str(e)}"}), 500
 
-                return send_file(zip_path, as_attachment=True, download_name="certificates.zip")
+        elif has_sheet:
+            if JOB_QUEUE_MAX and queued_job_count(DB_PATH) >= JOB_QUEUE_MAX:
+                raise Overloaded("Too many bulk jobs are queued, please retry later.", get_admission().retry_after(BATCH))
+            try:
+                # Store the sheet (unless staged) and hand the batch over to the background worker
+                sheet_path = None
+                if not staged_info:
+                    os.makedirs(UPLOAD_DIR, exist_ok=True)
+                    ext = os.path.splitext(excel_file.filename)[1].lower() or ".xlsx"
+                    sheet_path = os.path.join(UPLOAD_DIR, f"{datetime.now().strftime('%Y%m%d%H%M%S_%f')}{ext}")
+                    excel_file.save(sheet_path)
+
+                options = {
+                    "content": custom_content,
+                    "cert_type": cert_type_preference,
+                    "template": request.form.get("template", "certificate.html"),
+                    "render_mode": request.form.get("render_mode", "standard"),
+                    "output_format": request.form.get("output_format", "zip"),
+                    "start_number": request.form.get("start_number", "").strip(),
+                    "incremental": request.form.get("incremental") == "1",
+                    "incremental_output": request.form.get("incremental_output", "delta"),
+                    "profile": request.form.get("profile") == "1"
+                }
+                if staged_info:
+                    options["sheet_token"] = sheet_token
+                job_id = create_job(DB_PATH, sheet_path, options)
+                job_worker.notify()
+                logger.info(f"Bulk job {job_id} queued")
+
+                return jsonify({
+                    "success": True,
+                    "job_id": job_id,
+                    "status_url": f"/jobs/{job_id}",
+                    "download_url": f"/jobs/{job_id}/download"
+                }), 202
             except Exception as e:
                 logger.error(f"Bulk generation error: {e}", exc_info=True)
                 return jsonify({"error": f"An error occurred during bulk generation: {str(e)}"}), 500
 
         # ===================== SINGLE MODE =====================
         elif single_name and custom_content:
+            # A render slot first: a refused request does not use up a number
+            admitted = get_admission().single()
             try:
                 raw_date = request.form.get("single_date", "")
                 single_place = request.form.get("single_place", "")
@@ -479,90 +1177,293 @@ def upload():
                 if raw_date:
                     single_date = datetime.strptime(raw_date, "%Y-%m-%d").strftime("%d-%m-%Y")
 
-                # Get starting number
-                start_no_input = request.form.get("start_number", "").strip()
-                if start_no_input and start_no_input.isdigit():
-                    cert_no = format_certificate_number(int(start_no_input))
-                else:
-                    cert_no = get_next_certificate_number()
-
-                template = Template(custom_content)
+                template = get_body_template(custom_content)
                 rendered_body = template.render()
 
                 # Determine Certificate Title
-                if cert_type_preference == "internship":
-                    cert_title = "INTERNSHIP"
-                elif cert_type_preference == "industrial_visit":
-                    cert_title = "INDUSTRIAL VISIT"
-                else:
-                    content_lower = rendered_body.lower()
-                    if "industrial visit" in content_lower:
-                        cert_title = "INDUSTRIAL VISIT"
-                    else:
-                        cert_title = "INTERNSHIP"
-
-                context = {
-                    "student_name": safe_value(single_name),
-                    "student_name_style": f"font-size: {get_font_size(single_name)};",
-                    "certificate_body": rendered_body,
-                    "certificate_title": cert_title,
-                    "certificate_number": cert_no,
-                    "single_place": safe_value(single_place),
-                    "single_issue_date": single_date,
-                    "base_url": f"file:///{BASE_DIR.replace(os.sep, '/')}"
-                }
+                cert_title = certificate_title(rendered_body, cert_type_preference)
 
                 # Get selected template (default to certificate.html)
                 selected_template = request.form.get("template", "certificate.html")
-                html = render_template(selected_template, **context)
-
-                os.makedirs(PDF_DIR, exist_ok=True)
-                # Use a unique filename for the single PDF as well to avoid conflicts
-                single_id = datetime.now().strftime("%Y%m%d%H%M%S_%f")
-                pdf_path = os.path.join(PDF_DIR, f"{cert_no}_{single_id}.pdf")
-
-                HTML(string=html, base_url=BASE_DIR).write_pdf(pdf_path)
-                
-                # Upload to Cloudinary
-                cloudinary_url = upload_to_cloudinary(pdf_path, cert_no)
-                
+                start_number = explicit_start_number(request.form.get("start_number"))
+
+                # The next number is only reserved once its PDF has rendered, so a
+                # failed render leaves no gap; when a batch took it meanwhile the
+                # certificate is rendered again with the following one
+                for attempt in range(SINGLE_NUMBER_ATTEMPTS):
+                    number = peek_certificate_number(DB_PATH, start_number)
+                    cert_no = format_certificate_number(number)
+                    context = {
+                        "student_name": safe_value(single_name),
+                        "student_name_style": f"font-size: {get_font_size(single_name)};",
+                        "certificate_body": rendered_body,
+                        "certificate_title": cert_title,
+                        "certificate_number": cert_no,
+                        "single_place": safe_value(single_place),
+                        "single_issue_date": single_date,
+                        "base_url": f"file:///{BASE_DIR.replace(os.sep, '/')}"
+                    }
+                    with timed("render_template"):
+                        html, css_text = split_stylesheet(render_template(selected_template, **context))
+
+                    pdf = get_render_pool().submit(write_pdf, html, BASE_DIR, None, css_text).result(timeout=RENDER_TIMEOUT_SECONDS)
+                    if start_number is not None:
+                        reserve_certificate_numbers(DB_PATH, 1, start_number)
+                        break
+                    if claim_certificate_number(DB_PATH, number):
+                        break
+                    logger.info(f"Certificate number {cert_no} was taken while rendering, rendering again")
+                else:
+                    raise RuntimeError("Could not reserve a certificate number, please retry")
+                admitted.release()
+                # Kept in the PDF cache for /certificates/<number>.pdf; a file
+                # under PDF_DIR only with retention (bounded by the janitor)
+                key = certificate_key(html, css_text, "full", f"{asset_version(STATIC_DIR)}:{settings_key()}")
+                pdf_cache.put(key, pdf)
+                pdf_path = None
+                if PDF_RETENTION:
+                    os.makedirs(PDF_DIR, exist_ok=True)
+                    # Use a unique filename for the single PDF as well to avoid conflicts
+                    single_id = datetime.now().strftime("%Y%m%d%H%M%S_%f")
+                    pdf_path = os.path.join(PDF_DIR, f"{cert_no}_{single_id}.pdf")
+                    with open(pdf_path, "wb") as f:
+                        f.write(pdf)
+
+                # Upload to Cloudinary (or the configured storage backend)
+                cloudinary_url = upload_with_retries(pdf, cert_no)
+                pdf_cache.set_url(key, cloudinary_url)
+
                 # Save DB record
-                conn = sqlite3.connect(DB_PATH)
-                c = conn.cursor()
-                c.execute(
-                    "INSERT INTO certificates (certificate_number, student_name, pdf_path, cloudinary_url) VALUES (?, ?, ?, ?)",
-                    (cert_no, context["student_name"], pdf_path, cloudinary_url)
-                )
-                conn.commit()
-                conn.close()
+                save_certificate_records([(
+                    cert_no, context["student_name"], pdf_path, cloudinary_url,
+                    render_context_json(selected_template, context)
+                )])
 
-                return send_file(pdf_path, as_attachment=True)
+                return send_file(io.BytesIO(pdf), mimetype="application/pdf", as_attachment=True, download_name=f"{cert_no}.pdf")
             except Exception as e:
                 logger.error(f"Single generation error: {e}", exc_info=True)
                 return jsonify({"error": f"An error occurred during certificate generation: {str(e)}"}), 500
+            finally:
+                admitted.release()
 
         return "Error: Upload Excel or enter Student Name"
 
     return render_template("upload.html")
 
 
+# ---------------- JOB STATUS / DOWNLOAD ----------------
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = get_job(DB_PATH, job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify({
+        "job_id": job["id"],
+        "status": job["status"],
+        "total_rows": job["total_rows"],
+        "done_rows": job["done_rows"],
+        "failed_rows": job["failed_rows"],
+        "cached_rows": job["cached_rows"],
+        "errors": job["errors"],
+        "eta_seconds": job["eta_seconds"],
+        "error": job["error"],
+        "download_url": f"/jobs/{job_id}/download" if job["status"] == "done" and job["zip_path"] else None,
+        # Incremental run without new or changed rows: done, nothing to download
+        "nothing_changed": job["status"] == "done" and not job["zip_path"],
+        "resume_url": f"/jobs/{job_id}/resume" if job["status"] == "failed" else None,
+        "profile_url": f"/profiles/{job_id}.prof"
+        if job["status"] in ("done", "failed") and profile_path_for(job_id, job["options"]) else None
+    })
+
+
+@app.route("/jobs/<job_id>/resume", methods=["POST"])
+def job_resume(job_id):
+    """Runs a failed job again, reusing the rows it had already finished"""
+    job = get_job(DB_PATH, job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] == "failed" and job["sheet_path"] and not os.path.exists(job["sheet_path"]):
+        # Removed by the janitor after JOB_LEFTOVER_MAX_AGE_HOURS
+        return jsonify({"error": "The sheet of this job has expired. Please upload it again."}), 410
+    if not requeue_job(DB_PATH, job_id):
+        return jsonify({"error": "Only failed jobs can be resumed"}), 409
+    job_worker.notify()
+    logger.info(f"Bulk job {job_id} queued for resume")
+    return jsonify({"success": True, "job_id": job_id, "status_url": f"/jobs/{job_id}"}), 202
+
+
+@app.route("/jobs/<job_id>/download", methods=["GET"])
+def job_download(job_id):
+    job = get_job(DB_PATH, job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] != "done":
+        return jsonify({"error": f"Job is not finished (status: {job['status']})"}), 409
+    if not job["zip_path"]:
+        return jsonify({"error": "Nothing changed since the last run, there is nothing to download"}), 404
+    if not os.path.exists(job["zip_path"]):
+        # Removed by the janitor after JOB_OUTPUT_MAX_AGE_HOURS
+        return jsonify({"error": "The output of this job has expired, single certificates stay available under /certificates/<number>.pdf"}), 410
+
+    download_name = "certificates.pdf" if job["zip_path"].endswith(".pdf") else "certificates.zip"
+    return send_file(job["zip_path"], as_attachment=True, download_name=download_name)
+
+
+# ---------------- VERIFICATION / SEARCH ----------------
+lookups = CertificateLookups(DB_PATH)
+
+
+def int_arg(name, default):
+    try:
+        return int(request.args.get(name, default))
+    except ValueError:
+        return default
+
+
+@app.route("/verify/<certificate_number>", methods=["GET"])
+def verify_certificate(certificate_number):
+    """Is this certificate number real? Returns the certificate if it is"""
+    certificate = lookups.lookup(certificate_number)
+    if not certificate:
+        return jsonify({"valid": False, "error": "Certificate not found"}), 404
+    return jsonify({"valid": True, "certificate": certificate})
+
+
+@app.route("/certificates/search", methods=["GET"])
+def search_certificates():
+    text = request.args.get("q", "").strip()
+    if not text:
+        return jsonify({"error": "Missing search text (q)"}), 400
+    return jsonify(lookups.search(text, limit=int_arg("limit", 20), offset=int_arg("offset", 0)))
+
+
+@app.route("/certificates", methods=["GET"])
+def list_certificates():
+    return jsonify(lookups.page(page=int_arg("page", 1), per_page=int_arg("per_page", 50)))
+
+
+@app.route("/certificates/export.csv", methods=["GET"])
+def export_certificates():
+    return Response(
+        lookups.iter_csv(),
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment; filename=certificates.csv"}
+    )
+
+
+@app.route("/certificates/<certificate_number>.pdf", methods=["GET"])
+def certificate_pdf(certificate_number):
+    """
+    PDF of an issued certificate: from the PDF cache, or rendered again
+    from its stored context. Records from before contexts were stored fall
+    back to the local file, then to the uploaded copy.
+    """
+    rows = query(
+        DB_PATH,
+        "SELECT pdf_path, cloudinary_url, render_context FROM certificates WHERE certificate_number = ?",
+        (certificate_number,)
+    )
+    if not rows:
+        return jsonify({"error": "Certificate not found"}), 404
+    pdf_path, url, stored = rows[0]
+    try:
+        if stored:
+            pdf, cache_status = render_stored_certificate(json.loads(stored))
+            return send_file(
+                io.BytesIO(pdf), mimetype="application/pdf", download_name=f"{certificate_number}.pdf",
+                max_age=0
+            ), 200, {"X-PDF-Cache": cache_status}
+    except Overloaded:
+        # Busy: the uploaded copy still serves (otherwise a 429)
+        if not url:
+            raise
+    except Exception as e:
+        logger.error(f"Rendering certificate {certificate_number} again failed: {e}", exc_info=True)
+        if not url:
+            return jsonify({"error": f"The certificate could not be rendered: {e}"}), 500
+    if pdf_path and os.path.isfile(pdf_path) and pdf_path.startswith(PDF_DIR):
+        return send_file(pdf_path, mimetype="application/pdf", download_name=f"{certificate_number}.pdf")
+    if url:
+        return redirect(url)
+    return jsonify({"error": "No stored copy or render context for this certificate"}), 404
+
+
+def stored_certificate_html(stored):
+    """(html, css_text) of a stored render context (needs a request context)"""
+    context = dict(stored["context"], base_url=f"file:///{BASE_DIR.replace(os.sep, '/')}")
+    return split_stylesheet(render_template(stored["template"], **context))
+
+
+def render_stored_certificate(stored):
+    """(PDF bytes, "hit" | "miss") of a stored render context; misses are rendered and cached"""
+    with app.test_request_context():
+        html, css_text = stored_certificate_html(stored)
+    # Same key as the bulk and single paths, so their PDFs are found here
+    key = certificate_key(html, css_text, "full", f"{asset_version(STATIC_DIR)}:{settings_key()}")
+    hit = pdf_cache.get(key)
+    if hit:
+        return hit[0], "hit"
+    with get_admission().single():
+        pdf = get_render_pool().submit(write_pdf, html, BASE_DIR, None, css_text).result(timeout=RENDER_TIMEOUT_SECONDS)
+    pdf_cache.put(key, pdf)
+    return pdf, "miss"
+
+
+@app.route("/certificates/cache/stats", methods=["GET"])
+def lookup_cache_stats():
+    return jsonify(lookups.stats())
+
+
+# ---------------- LOCAL STORAGE ----------------
+@app.route("/storage/<path:name>", methods=["GET"])
+def stored_file(name):
+    """Files uploaded to the local storage backend (offline runs)"""
+    backend = get_storage_backend()
+    if not isinstance(backend, LocalBackend):
+        return jsonify({"error": "Not found"}), 404
+    return send_from_directory(backend.root, name)
+
+
+# ---------------- METRICS / PROFILES ----------------
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus text format; counters are per process (scrape every worker)"""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/profiles/<path:name>", methods=["GET"])
+def batch_profile(name):
+    """cProfile dump of a batch run with profile=1 (open with pstats / snakeviz)"""
+    if not PROFILE_BATCHES:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    return send_from_directory(PROFILE_DIR, name, as_attachment=True)
+
+
+# ---------------- ASSET CACHE STATS ----------------
+@app.route("/asset_cache/stats", methods=["GET"])
+def asset_cache_stats():
+    return jsonify(get_render_pool().asset_cache_stats())
+
+
 @app.route("/clear_db", methods=["POST"])
 def clear_db():
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("DELETE FROM certificates")
-        # Reset autoincrement
-        c.execute("DELETE FROM sqlite_sequence WHERE name='certificates'")
-        conn.commit()
-        conn.close()
+        with transaction(DB_PATH) as conn:
+            conn.execute("DELETE FROM certificates")
+            conn.execute("DELETE FROM certificate_issues")
+            # Reset autoincrement
+            conn.execute("DELETE FROM sqlite_sequence WHERE name='certificates'")
+        reset_numbering(DB_PATH, START_NUMBER)
         
-        # Also clean up local PDFs
+        # Also clean up local PDFs (retained batches are in subdirectories)
         if os.path.exists(PDF_DIR):
             for f in os.listdir(PDF_DIR):
                 file_path = os.path.join(PDF_DIR, f)
                 try:
-                    if os.path.isfile(file_path):
+                    if os.path.isdir(file_path):
+                        shutil.rmtree(file_path)
+                    else:
                         os.unlink(file_path)
                 except Exception as e:
                     logger.error(f"Error deleting file {file_path}: {e}")
@@ -573,6 +1474,82 @@ def clear_db():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+# ---------------- STARTUP ----------------
+WARMUP_CONTEXT = {
+    "student_name": "Warm Up",
+    "student_name_style": "",
+    "certificate_body": "Warm-up render",
+    "certificate_title": "INTERNSHIP",
+    "certificate_number": format_certificate_number(0),
+    "place": "",
+    "issue_date": datetime.now().strftime("%d-%m-%Y"),
+    "base_url": f"file:///{BASE_DIR.replace(os.sep, '/')}"
+}
+
+
+def warmup_render(template_name):
+    """One throwaway render of a page template (WeasyPrint import, fonts, stylesheet and asset caches)"""
+    # The page templates use url_for()
+    with app.test_request_context():
+        html, css_text = split_stylesheet(render_template(template_name, **WARMUP_CONTEXT))
+    get_render_pool().submit(write_pdf, html, BASE_DIR, None, css_text).result(timeout=RENDER_TIMEOUT_SECONDS)
+
+
+def preload_caches():
+    """
+    Work done once in the gunicorn master (preload_app) so that every forked
+    worker shares it copy-on-write: lazily imported modules and the compiled
+    page templates. No threads or processes are started here.
+    """
+    warm_imports(with_weasyprint=default_pool_size() == 0)
+    with phase("page_templates"):
+        for name in WARMUP_TEMPLATES + ["upload.html"]:
+            try:
+                app.jinja_env.get_template(name)
+            except Exception as e:
+                logger.warning(f"Could not preload template {name}: {e}")
+
+
+def sweep_job_leftovers():
+    """
+    Checkpoint artifacts (generated/jobs/<id>/) and uploaded sheets left by
+    failed or orphaned jobs; those of queued and running jobs are kept
+    """
+    active = active_jobs(DB_PATH)
+    max_age_seconds = JOB_LEFTOVER_MAX_AGE_HOURS * 3600
+    remove_old_dirs(JOB_DIR, max_age_seconds, keep={job["id"] for job in active})
+    remove_old_files(UPLOAD_DIR, max_age_seconds, keep=[job["sheet_path"] for job in active if job["sheet_path"]])
+
+
+# Keeps local disk flat: retained PDFs, the PDF / preview caches (shared
+# with other processes), old job outputs and what failed jobs left behind
+janitor = Janitor([
+    ("retained PDFs", lambda: trim_dir(PDF_DIR, int(PDF_DIR_MAX_MB * 1024 * 1024))),
+    ("PDF cache", pdf_cache.enforce),
+    ("preview cache", preview_cache.enforce),
+    ("job outputs", lambda: remove_old_files(JOB_DIR, JOB_OUTPUT_MAX_AGE_HOURS * 3600, prefix="certificates_")),
+    ("job leftovers", sweep_job_leftovers),
+])
+
+
+def start_background_threads():
+    """Job worker, janitor and optional warm-up of this process (called by gunicorn.conf.py after the fork when preloaded)"""
+    job_worker.start()
+    janitor.start()
+    if WARMUP_RENDER:
+        start_warmup(warmup_render)
+
+
+mark("app")
+# Render worker processes are spawned and re-import the main module as
+# __mp_main__ when running `python app.py`; they must not run jobs themselves
+if PRELOADED:
+    preload_caches()
+elif __name__ != "__mp_main__":
+    start_background_threads()
+report()
+
+
 # ---------------- MAIN ----------------
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 10000))
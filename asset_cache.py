@@ -0,0 +1,143 @@
+import os
+import mimetypes
+import threading
+import logging
+from collections import OrderedDict
+from urllib.parse import urlsplit, unquote
+from urllib.request import url2pathname
+
+from asset_variants import VariantIndex, ASSET_VARIANTS
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+
+# Upper bound for the raw bytes kept in memory (all of static/ is ~4 MB today)
+ASSET_CACHE_MAX_MB = int(os.getenv("ASSET_CACHE_MAX_MB", "32"))
+
+
+class AssetCache:
+    """
+    Process-wide cache of static/ files for WeasyPrint.
+    Entries are evicted least-recently-used once max_bytes is reached and
+    re-read when the file's mtime or size changes.
+    Images are served from their print-resolution variants when built
+    (see asset_variants.py).
+    """
+
+    def __init__(self, static_dir=STATIC_DIR, max_bytes=ASSET_CACHE_MAX_MB * 1024 * 1024, variants=ASSET_VARIANTS):
+        self.static_dir = os.path.abspath(static_dir)
+        self.max_bytes = max_bytes
+        self.variants = VariantIndex(self.static_dir) if variants else None
+        self._served = {}  # static path -> file last served for it (original or variant)
+        self._entries = OrderedDict()  # path -> (mtime_ns, size, data, mime_type)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # Shared with write_pdf(cache=...) so WeasyPrint also keeps decoded
+        # images between documents; cleared whenever a file changes on disk
+        self.image_cache = {}
+
+    def _static_path(self, url):
+        """Local path for a file:// URL inside static/, otherwise None"""
+        parts = urlsplit(url)
+        if parts.scheme != "file":
+            return None
+        path = url2pathname(unquote(parts.path))
+        if os.name != "nt":
+            # base_url is built as file:///<abs path>, which leaves a doubled slash
+            path = "/" + path.lstrip("/")
+        path = os.path.abspath(path)
+        try:
+            if os.path.commonpath([path, self.static_dir]) != self.static_dir:
+                return None
+        except ValueError:
+            return None
+        return path
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            _, (_, size, _, _) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def get(self, path):
+        """Returns (data, mime_type) for a file, reading it only when needed"""
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[2], entry[3]
+            if entry:
+                # File changed on disk: drop it and any decoded images
+                self._entries.pop(path)
+                self._bytes -= entry[1]
+                self.invalidations += 1
+                self.image_cache.clear()
+            self.misses += 1
+
+        with open(path, "rb") as f:
+            data = f.read()
+        mime_type = mimetypes.guess_type(path)[0]
+
+        with self._lock:
+            if len(data) <= self.max_bytes and path not in self._entries:
+                self._entries[path] = (stat.st_mtime_ns, len(data), data, mime_type)
+                self._bytes += len(data)
+                self._evict()
+        return data, mime_type
+
+    def url_fetcher(self, url, *args, **kwargs):
+        """WeasyPrint url_fetcher: static/ assets from memory, the rest as usual"""
+        path = self._static_path(url)
+        if path is None or not os.path.isfile(path):
+            from weasyprint import default_url_fetcher
+            return default_url_fetcher(url, *args, **kwargs)
+
+        if self.variants:
+            served = self.variants.lookup(path)
+            if self._served.get(path, served) != served:
+                # Variant rebuilt / dropped: WeasyPrint must decode the image again
+                with self._lock:
+                    self.image_cache.clear()
+            self._served[path] = served
+            path = served
+
+        data, mime_type = self.get(path)
+        return {
+            "string": data,
+            "mime_type": mime_type,
+            "redirected_url": url,
+            "filename": os.path.basename(path),
+            "path": path,
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_asset_cache():
+    """The cache of the current process, created on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AssetCache()
+        return _cache
@@ -0,0 +1,325 @@
+"""
+Print-resolution variants of static/images for PDF rendering.
+
+The source images are far larger than they appear on a certificate page
+(an 8000 px wide logo printed 350 px wide). At startup every image gets
+a variant that is downsampled to ASSET_PRINT_DPI at the largest size
+any template displays it, then recompressed. Variants are stored under
+generated/assets by source hash, so they are only rebuilt when an image
+or a setting changes. The asset cache serves the variant in place of
+the original whenever WeasyPrint fetches the image.
+
+    python asset_variants.py            # build, list size per image
+    python asset_variants.py --report   # also render each template with and without variants
+"""
+import io
+import os
+import re
+import sys
+import json
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+VARIANT_DIR = os.path.join(BASE_DIR, "generated", "assets")
+IMAGE_SUBDIR = "images"
+MANIFEST = "manifest.json"
+
+# Serve downsampled variants to WeasyPrint (0 = always the original files)
+ASSET_VARIANTS = os.getenv("ASSET_VARIANTS", "1") == "1"
+# Resolution the images are resampled to, at their printed size
+ASSET_PRINT_DPI = int(os.getenv("ASSET_PRINT_DPI", "300"))
+# PNGs are quantized to this many colors (0 keeps them true color)
+ASSET_PNG_COLORS = int(os.getenv("ASSET_PNG_COLORS", "256"))
+ASSET_JPEG_QUALITY = int(os.getenv("ASSET_JPEG_QUALITY", "85"))
+
+CSS_PX_PER_INCH = 96
+UNIT_PX = {"px": 1, "in": 96, "cm": 96 / 2.54, "mm": 96 / 25.4}
+# Longest side of an A4 page in CSS px: the cap for images sized in %
+PAGE_LONG_SIDE_PX = 297 * UNIT_PX["mm"]
+
+IMG_RE = re.compile(r"<img\b[^>]*>", re.IGNORECASE)
+IMG_SRC_RE = re.compile(r"""src\s*=\s*["'][^"']*/static/images/([^"'?#]+)""", re.IGNORECASE)
+CLASS_RE = re.compile(r"""class\s*=\s*["']([^"']+)["']""", re.IGNORECASE)
+STYLE_ATTR_RE = re.compile(r"""style\s*=\s*["']([^"']*)["']""", re.IGNORECASE)
+STYLE_BLOCK_RE = re.compile(r"<style[^>]*>(.*?)</style>", re.IGNORECASE | re.DOTALL)
+CSS_RULE_RE = re.compile(r"([^{}]+)\{([^{}]*)\}")
+CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.DOTALL)
+SIZE_RE = re.compile(r"(?<![-\w])(width|height)\s*:\s*([\d.]+)\s*(px|mm|cm|in|%)", re.IGNORECASE)
+
+
+def settings_key():
+    """Changes whenever the variant settings do (part of the PDF cache key)"""
+    if not ASSET_VARIANTS:
+        return "originals"
+    return f"variants:{ASSET_PRINT_DPI}:{ASSET_PNG_COLORS}:{ASSET_JPEG_QUALITY}"
+
+
+# ---------------- DISPLAY SIZES ----------------
+def _declared_size(declarations):
+    """{"width": css px, "height": css px, "relative": bool} from CSS declarations"""
+    size = {"width": None, "height": None, "relative": False}
+    for prop, value, unit in SIZE_RE.findall(declarations):
+        prop, unit = prop.lower(), unit.lower()
+        if unit == "%":
+            size["relative"] = True
+        else:
+            px = float(value) * UNIT_PX[unit]
+            size[prop] = max(size[prop] or 0, px)
+    return size
+
+
+def _class_sizes(html):
+    """Sizes declared by CSS rules per class name, largest wins"""
+    sizes = {}
+    for block in STYLE_BLOCK_RE.findall(html):
+        for selector, declarations in CSS_RULE_RE.findall(CSS_COMMENT_RE.sub("", block)):
+            size = _declared_size(declarations)
+            if not (size["width"] or size["height"] or size["relative"]):
+                continue
+            for name in re.findall(r"\.([\w-]+)", selector):
+                sizes.setdefault(name, []).append(size)
+    return sizes
+
+
+def template_display_sizes(template_dir=TEMPLATE_DIR):
+    """
+    How each image under static/images is sized by the templates:
+    {file name: [size of every <img> showing it]}. An <img> without any
+    width / height is shown at its pixel size and must not be resampled.
+    """
+    usages = {}
+    for name in sorted(os.listdir(template_dir)):
+        if not name.endswith(".html"):
+            continue
+        with open(os.path.join(template_dir, name), encoding="utf-8") as f:
+            html = f.read()
+        class_sizes = _class_sizes(html)
+        for tag in IMG_RE.findall(html):
+            src = IMG_SRC_RE.search(tag)
+            if not src:
+                continue
+            size = {"width": None, "height": None, "relative": False}
+            declared = []
+            style = STYLE_ATTR_RE.search(tag)
+            if style:
+                declared.append(_declared_size(style.group(1)))
+            for class_name in (CLASS_RE.search(tag).group(1).split() if CLASS_RE.search(tag) else []):
+                declared.extend(class_sizes.get(class_name, []))
+            for d in declared:
+                for prop in ("width", "height"):
+                    if d[prop]:
+                        size[prop] = max(size[prop] or 0, d[prop])
+                size["relative"] |= d["relative"]
+            usages.setdefault(src.group(1), []).append(size)
+    return usages
+
+
+def target_scale(pixel_size, usages, dpi=ASSET_PRINT_DPI):
+    """Downsampling factor (<= 1) that keeps dpi at the largest printed size"""
+    if not usages:
+        # Not used by a page template (custom content may still show it as is)
+        return 1.0
+    width, height = pixel_size
+    scale = 0.0
+    for size in usages:
+        if size["relative"]:
+            wanted = PAGE_LONG_SIDE_PX * dpi / CSS_PX_PER_INCH / max(width, height)
+        elif size["width"] or size["height"]:
+            wanted = max(
+                (size["width"] or 0) * dpi / CSS_PX_PER_INCH / width,
+                (size["height"] or 0) * dpi / CSS_PX_PER_INCH / height,
+            )
+        else:
+            return 1.0
+        scale = max(scale, wanted)
+    return min(1.0, scale)
+
+
+# ---------------- VARIANTS ----------------
+def optimize_image(data, usages):
+    """(variant bytes, (width, height)) for an image file's bytes"""
+    from PIL import Image
+    image = Image.open(io.BytesIO(data))
+    image_format = image.format
+    scale = target_scale(image.size, usages)
+    if scale < 1:
+        new_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        if image.mode == "P":
+            image = image.convert("RGBA")
+        image = image.resize(new_size, Image.LANCZOS)
+
+    out = io.BytesIO()
+    if image_format == "JPEG":
+        image.convert("RGB").save(out, "JPEG", quality=ASSET_JPEG_QUALITY, optimize=True, progressive=True)
+    elif image_format == "PNG":
+        if ASSET_PNG_COLORS and image.mode in ("RGB", "RGBA"):
+            method = Image.Quantize.FASTOCTREE if image.mode == "RGBA" else Image.Quantize.MEDIANCUT
+            image = image.quantize(ASSET_PNG_COLORS, method=method)
+        image.save(out, "PNG", optimize=True)
+    else:
+        return data, image.size
+    return out.getvalue(), image.size
+
+
+def build_variants(static_dir=STATIC_DIR, template_dir=TEMPLATE_DIR, variant_dir=VARIANT_DIR):
+    """
+    Creates the missing variants of static/images and writes the manifest
+    read by the asset cache. Returns the manifest.
+    """
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        logger.warning("Pillow is not installed: PDFs embed the original images")
+        return None
+
+    usages = template_display_sizes(template_dir)
+    image_dir = os.path.join(static_dir, IMAGE_SUBDIR)
+    os.makedirs(variant_dir, exist_ok=True)
+    images = {}
+    for name in sorted(os.listdir(image_dir)):
+        path = os.path.join(image_dir, name)
+        if not os.path.isfile(path):
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        stat = os.stat(path)
+        image_usages = usages.get(name, [])
+        digest = hashlib.sha256(data)
+        digest.update(json.dumps([settings_key(), image_usages], sort_keys=True).encode())
+        variant_name = f"{digest.hexdigest()[:24]}{os.path.splitext(name)[1].lower()}"
+        variant_path = os.path.join(variant_dir, variant_name)
+
+        entry = {"mtime_ns": stat.st_mtime_ns, "bytes": len(data), "variant": None, "variant_bytes": len(data)}
+        if os.path.exists(variant_path):
+            entry.update(variant=variant_name, variant_bytes=os.path.getsize(variant_path))
+        else:
+            try:
+                variant, _ = optimize_image(data, image_usages)
+            except Exception as e:
+                logger.warning(f"Asset variant of {name} failed, the original is used: {e}")
+                variant = data
+            # Only worth serving when it is actually smaller
+            if len(variant) < len(data):
+                tmp_path = f"{variant_path}.{os.getpid()}.{threading.get_ident()}"
+                with open(tmp_path, "wb") as f:
+                    f.write(variant)
+                os.replace(tmp_path, variant_path)
+                entry.update(variant=variant_name, variant_bytes=len(variant))
+        images[f"{IMAGE_SUBDIR}/{name}"] = entry
+
+    manifest = {"settings": settings_key(), "images": images}
+    tmp_path = os.path.join(variant_dir, f"{MANIFEST}.{os.getpid()}")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, os.path.join(variant_dir, MANIFEST))
+
+    before = sum(entry["bytes"] for entry in images.values())
+    after = sum(entry["variant_bytes"] for entry in images.values())
+    logger.info(
+        f"Asset variants: {sum(1 for e in images.values() if e['variant'])} of {len(images)} image(s) "
+        f"optimized, {before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB"
+    )
+    return manifest
+
+
+class VariantIndex:
+    """Maps a file under static/ to its variant, per the manifest (re-read when it changes)"""
+
+    def __init__(self, static_dir=STATIC_DIR, variant_dir=VARIANT_DIR):
+        self.static_dir = os.path.abspath(static_dir)
+        self.variant_dir = variant_dir
+        self._manifest_mtime = None
+        self._images = {}
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        path = os.path.join(self.variant_dir, MANIFEST)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            self._images = {}
+            return
+        if mtime == self._manifest_mtime:
+            return
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Asset variant manifest unreadable: {e}")
+            return
+        self._manifest_mtime = mtime
+        self._images = manifest.get("images", {}) if manifest.get("settings") == settings_key() else {}
+
+    def lookup(self, path):
+        """Variant path for a static file, or path itself"""
+        if not ASSET_VARIANTS:
+            return path
+        with self._lock:
+            self._reload()
+            entry = self._images.get(os.path.relpath(path, self.static_dir).replace(os.sep, "/"))
+        if not entry or not entry["variant"]:
+            return path
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return path
+        if stat.st_mtime_ns != entry["mtime_ns"] or stat.st_size != entry["bytes"]:
+            # Changed since the variants were built: the original is the truth
+            return path
+        variant_path = os.path.join(self.variant_dir, entry["variant"])
+        return variant_path if os.path.exists(variant_path) else path
+
+
+# ---------------- REPORT ----------------
+def render_sample(template_name, use_variants):
+    """PDF bytes of a sample certificate from a page template"""
+    from flask import Flask
+    from weasyprint import HTML
+    from asset_cache import AssetCache
+
+    # Templates only need url_for('static'); the app itself is not imported
+    # (it would start the job worker)
+    report_app = Flask(__name__, template_folder=TEMPLATE_DIR, static_folder=STATIC_DIR)
+    context = {
+        "student_name": "Sreelakshmi Thekkumpurathu",
+        "student_name_style": "font-size: 34px;",
+        "certificate_body": "has successfully completed the internship from 06-01-2025 to 05-02-2025.",
+        "certificate_title": "INTERNSHIP",
+        "certificate_number": "ACDT-C-25-001",
+        "place": "Kozhikode",
+        "issue_date": "06-02-2025",
+        "base_url": f"file:///{BASE_DIR.replace(os.sep, '/')}",
+    }
+    with report_app.test_request_context():
+        html = report_app.jinja_env.get_template(template_name).render(**context)
+    assets = AssetCache(variants=use_variants)
+    return HTML(string=html, base_url=BASE_DIR, url_fetcher=assets.url_fetcher).write_pdf()
+
+
+def print_report(manifest, templates):
+    print(f"{'image':<32} {'original':>10} {'variant':>10} {'saved':>7}")
+    for name, entry in sorted(manifest["images"].items()):
+        saved = 1 - entry["variant_bytes"] / entry["bytes"] if entry["bytes"] else 0
+        print(f"{name:<32} {entry['bytes'] / 1024:>8.0f}KB {entry['variant_bytes'] / 1024:>8.0f}KB {saved:>6.0%}")
+
+    if not templates:
+        return
+    print(f"\n{'template':<32} {'PDF original':>13} {'PDF variants':>13} {'saved':>7}")
+    for template_name in templates:
+        original = len(render_sample(template_name, False))
+        optimized = len(render_sample(template_name, True))
+        print(f"{template_name:<32} {original / 1024:>11.0f}KB {optimized / 1024:>11.0f}KB {1 - optimized / original:>6.0%}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    manifest = build_variants()
+    if manifest:
+        report = "--report" in sys.argv[1:]
+        print_report(manifest, ["certificate.html", "Certificate_Acadeno.html"] if report else [])
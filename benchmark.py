@@ -0,0 +1,401 @@
+"""
+Benchmark of the bulk certificate pipeline on synthetic workbooks.
+
+Runs every stage of a bulk batch in turn (ingest, context build, Jinja
+render, write_pdf, upload, DB write, zip) for each page template, with
+uploads going to an in-memory storage backend and the DB writes to a
+scratch database. Reports the time and peak RSS of every stage and
+compares them with a stored baseline.
+
+    python benchmark.py --rows 500 --shape internship
+    python benchmark.py --rows 500 --save-baseline
+    python benchmark.py --rows 500 --threshold 0.2   # exit code 1 on a regression
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import zipfile
+import argparse
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from storage import MemoryBackend
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+DEFAULT_BASELINE = os.path.join(BASE_DIR, "benchmark_baseline.json")
+TEMPLATES = ["certificate.html", "Certificate_Acadeno.html"]
+STAGES = ["ingest", "context", "jinja", "write_pdf", "upload", "db_write", "zip"]
+
+DEFAULT_CONTENT = (
+    "This is to certify that <b>{{ student_name }}</b> (Reg. No. {{ register_number }}), "
+    "{{ semester }} semester student of {{ department }}, has successfully completed "
+    "the {{ internship_program }} internship {{ internship_duration }}."
+)
+
+# ---------------- SYNTHETIC WORKBOOKS ----------------
+FIRST_NAMES = ["Anu", "Rahul", "Fathima", "Sreelakshmi", "Mohammed", "Arjun", "Devika", "Krishnapriya"]
+LAST_NAMES = ["K", "Nair", "P S", "Abdul Rahiman", "Varghese", "Thekkumpurathu Valappil", "Menon"]
+SUBJECTS = ["Python Full Stack", "Data Science", "Industrial Visit", "Flutter", "MERN Stack"]
+DEPARTMENTS = ["Computer Science", "BCA", "MCA", "Electronics"]
+
+# Columns of each shape, as they appear in the header row
+SHAPES = {
+    "minimal": ["Name", "Register Number"],
+    "internship": [
+        "Name", "Register Number", "Subject", "Department", "Semester",
+        "Start Date", "End Date", "Internship Hours", "Place", "Issue Date",
+    ],
+    # Real sheets often carry columns the certificate does not use
+    "wide": [
+        "Name", "Register Number", "Subject", "Department", "Semester",
+        "Start Date", "End Date", "Internship Hours", "Place", "Issue Date",
+    ] + [f"Note {n}" for n in range(1, 21)],
+}
+
+
+def synthetic_value(column, rng, row):
+    start = date(2025, 1, 6) + timedelta(days=rng.randrange(120))
+    values = {
+        "Name": lambda: f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        "Register Number": lambda: f"REG{row + 1:06d}",
+        "Subject": lambda: rng.choice(SUBJECTS),
+        "Department": lambda: rng.choice(DEPARTMENTS),
+        "Semester": lambda: rng.randrange(1, 9),
+        "Start Date": lambda: start,
+        "End Date": lambda: start + timedelta(days=rng.choice([15, 30, 45, 90])),
+        "Internship Hours": lambda: rng.choice([None, 40, 60, 120]),
+        "Place": lambda: rng.choice(["Kozhikode", "Kochi", "Kannur"]),
+        "Issue Date": lambda: start + timedelta(days=100),
+    }
+    return values.get(column, lambda: f"value {rng.randrange(1000)}")()
+
+
+def make_workbook(path, rows, shape="internship", title_rows=2, blank_every=0, seed=1):
+    """
+    Writes a workbook of rows students with the columns of shape.
+    Title rows above the header (detect_header_row must skip them) and
+    optionally a blank row every blank_every rows (dropped by clean_frame).
+    """
+    from openpyxl import Workbook
+    rng = random.Random(seed)
+    columns = SHAPES[shape]
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for n in range(title_rows):
+        sheet.append(["Acadeno Technologies - Internship Certificates" if n == 0 else None])
+    sheet.append(columns)
+    for row in range(rows):
+        if blank_every and row and row % blank_every == 0:
+            sheet.append([])
+        sheet.append([synthetic_value(column, rng, row) for column in columns])
+    workbook.save(path)
+    return path
+
+
+# ---------------- MEASUREMENT ----------------
+def process_rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return 0.0
+
+
+class RssSampler:
+    """Peak RSS of this process plus its render workers, sampled in the background"""
+
+    def __init__(self, worker_pids, interval=0.02):
+        from render_pool import current_rss_mb
+        self._current_rss_mb = current_rss_mb
+        self.worker_pids = worker_pids
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        rss = self._current_rss_mb() + sum(process_rss_mb(pid) for pid in self.worker_pids())
+        self.peak = max(self.peak, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.peak = 0.0
+        self._stop.clear()
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+class StageTimer:
+    def __init__(self, worker_pids):
+        self.worker_pids = worker_pids
+        self.results = {}
+
+    @contextmanager
+    def stage(self, name):
+        with RssSampler(self.worker_pids) as sampler:
+            started = time.perf_counter()
+            yield
+            seconds = time.perf_counter() - started
+        self.results[name] = {"seconds": round(seconds, 4), "peak_rss_mb": round(sampler.peak, 1)}
+
+
+# ---------------- PIPELINE STAGES ----------------
+def run_pipeline(app, sheet_path, template_name, content, render_mode, upload_latency, work_dir):
+    """Runs the stages of one bulk batch; returns {stage: {"seconds", "peak_rss_mb"}} and the row count"""
+    from ingest import SheetReader, iter_sheet_frames
+    from sheet_prep import resolve_column_roles, iter_row_contexts
+    from compiled_cache import get_body_template, split_stylesheet
+    from render_pool import get_render_pool, write_pdf, write_pdf_batch, BATCH_CHUNK_SIZE
+    from layered import supports_layered, write_layered_pdf
+    from numbering import reserve_certificate_numbers
+    from storage import UploadStage
+
+    pool = get_render_pool()
+    timer = StageTimer(pool.worker_pids)
+
+    with timer.stage("ingest"):
+        with SheetReader(sheet_path) as reader:
+            frames = list(iter_sheet_frames(reader))
+
+    with timer.stage("context"), app.app.test_request_context():
+        body_template = get_body_template(content)
+        contexts = []
+        roles = None
+        for df in frames:
+            roles = roles or resolve_column_roles(df.columns)
+            first_no = reserve_certificate_numbers(app.DB_PATH, len(df))
+            for k, template_context, fields in iter_row_contexts(df, roles):
+                cert_no = app.format_certificate_number(first_no + k)
+                contexts.append(app.build_certificate_context(template_context, fields, body_template, cert_no, "auto"))
+
+    with timer.stage("jinja"), app.app.test_request_context():
+        page_template = app.app.jinja_env.get_template(template_name)
+        documents = [split_stylesheet(page_template.render(**context)) for context in contexts]
+
+    with timer.stage("write_pdf"):
+        # Bounded queue ahead of the workers, as in the bulk pipeline
+        max_pending = max(1, pool.size * 2)
+        pending = deque()
+        pdfs = []
+        if render_mode == "batch":
+            for start in range(0, len(documents), BATCH_CHUNK_SIZE):
+                chunk = documents[start:start + BATCH_CHUNK_SIZE]
+                pending.append(pool.submit(write_pdf_batch, [html for html, _ in chunk], BASE_DIR, None, chunk[0][1]))
+                if len(pending) >= max_pending:
+                    pdfs.extend(pending.popleft().result())
+            while pending:
+                pdfs.extend(pending.popleft().result())
+        else:
+            layered = render_mode == "layered" and supports_layered(template_name)
+            for html, css_text in documents:
+                if layered:
+                    pending.append(pool.submit(write_layered_pdf, html, BASE_DIR, None, css_text, template_name))
+                else:
+                    pending.append(pool.submit(write_pdf, html, BASE_DIR, None, css_text))
+                if len(pending) >= max_pending:
+                    pdfs.append(pending.popleft().result())
+            while pending:
+                pdfs.append(pending.popleft().result())
+
+    numbers = [context["certificate_number"] for context in contexts]
+    urls = {}
+
+    with timer.stage("upload"):
+        with UploadStage(SlowMemoryBackend(upload_latency)) as uploads:
+            for cert_no, pdf in zip(numbers, pdfs):
+                uploads.submit(pdf, cert_no, urls.__setitem__)
+
+    with timer.stage("db_write"):
+        app.save_certificate_records([
+            (cert_no, context["student_name"], None, urls.get(cert_no), app.render_context_json(template_name, context))
+            for cert_no, context in zip(numbers, contexts)
+        ])
+
+    with timer.stage("zip"):
+        with zipfile.ZipFile(os.path.join(work_dir, "certificates.zip"), "w", compression=zipfile.ZIP_STORED) as zipf:
+            for cert_no, pdf in zip(numbers, pdfs):
+                zipf.writestr(f"{cert_no}.pdf", pdf)
+
+    return timer.results, len(contexts)
+
+
+class SlowMemoryBackend(MemoryBackend):
+    """In-memory uploads (no Cloudinary) with an optional simulated round trip"""
+
+    name = "benchmark"
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+
+    def upload(self, data, public_id):
+        if self.latency:
+            time.sleep(self.latency)
+        return super().upload(data, public_id)
+
+
+# ---------------- BASELINE ----------------
+def scenario_key(template, shape, rows, render_mode):
+    return f"{template}|{shape}|{rows}|{render_mode}"
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def compare(results, baseline, threshold, rss_threshold, min_seconds):
+    """
+    Regressions against the baseline: a stage slower by more than threshold
+    (and by more than min_seconds, below that it is noise) or using more
+    than rss_threshold more peak memory
+    """
+    regressions = []
+    for scenario, stages in results.items():
+        base_stages = (baseline or {}).get("scenarios", {}).get(scenario)
+        if not base_stages:
+            continue
+        for stage, measured in stages.items():
+            base = base_stages.get(stage)
+            if not base:
+                continue
+            slower = measured["seconds"] - base["seconds"]
+            if measured["seconds"] > base["seconds"] * (1 + threshold) and slower > min_seconds:
+                regressions.append(f"{scenario} {stage}: {base['seconds']:.3f}s -> {measured['seconds']:.3f}s")
+            if base["peak_rss_mb"] and measured["peak_rss_mb"] > base["peak_rss_mb"] * (1 + rss_threshold):
+                regressions.append(f"{scenario} {stage}: peak RSS {base['peak_rss_mb']:.0f} MB -> {measured['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+def print_report(scenario, stages, rows, base_stages):
+    print(f"\n{scenario}  ({rows} rows)")
+    print(f"  {'stage':<10} {'seconds':>9} {'ms/row':>8} {'peak RSS':>10} {'vs baseline':>12}")
+    for stage in STAGES:
+        measured = stages[stage]
+        delta = ""
+        base = (base_stages or {}).get(stage)
+        if base and base["seconds"]:
+            delta = f"{(measured['seconds'] / base['seconds'] - 1) * 100:+.0f}%"
+        per_row = measured["seconds"] * 1000 / rows if rows else 0
+        print(f"  {stage:<10} {measured['seconds']:>9.3f} {per_row:>8.2f} {measured['peak_rss_mb']:>7.0f} MB {delta:>12}")
+    total = sum(stages[stage]["seconds"] for stage in STAGES)
+    print(f"  {'total':<10} {total:>9.3f} {total * 1000 / rows if rows else 0:>8.2f}")
+
+
+# ---------------- MAIN ----------------
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the bulk certificate pipeline")
+    parser.add_argument("--rows", type=int, default=200, help="students in the synthetic workbook")
+    parser.add_argument("--shape", choices=sorted(SHAPES), default="internship", help="columns of the workbook")
+    parser.add_argument("--title-rows", type=int, default=2, help="rows above the header row")
+    parser.add_argument("--blank-every", type=int, default=0, help="insert a blank row every N rows")
+    parser.add_argument("--sheet", help="benchmark this workbook instead of a synthetic one")
+    parser.add_argument("--templates", default=",".join(TEMPLATES), help="comma separated page templates")
+    parser.add_argument("--render-mode", choices=["standard", "batch", "layered"], default="standard")
+    parser.add_argument("--content", default=DEFAULT_CONTENT, help="certificate body template")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per template; the fastest is kept")
+    parser.add_argument("--upload-latency-ms", type=float, default=0, help="simulated upload round trip")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown per stage (0.25 = 25%%)")
+    parser.add_argument("--rss-threshold", type=float, default=0.25, help="allowed peak RSS growth per stage")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="slowdowns below this are ignored")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's INFO logging")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    work_dir = tempfile.mkdtemp(prefix="certificate-benchmark-")
+
+    # Scratch database (uploads go to SlowMemoryBackend): set before the app is imported
+    os.environ["DB_PATH"] = os.path.join(work_dir, "benchmark.db")
+    os.environ.setdefault("PDF_CACHE_MAX_MB", "0")
+    import app
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    sheet_path = args.sheet or make_workbook(
+        os.path.join(work_dir, "students.xlsx"), args.rows, args.shape, args.title_rows, args.blank_every
+    )
+    shape = "custom" if args.sheet else args.shape
+
+    # Worker start-up and the first pandas / WeasyPrint imports are not part of any stage
+    from startup import warm_imports
+    from render_pool import get_render_pool, write_pdf
+    warm_imports()
+    get_render_pool().submit(write_pdf, "<html><body></body></html>", BASE_DIR, None).result()
+
+    results = {}
+    rows_by_scenario = {}
+    for template in [t.strip() for t in args.templates.split(",") if t.strip()]:
+        key = scenario_key(template, shape, args.rows, args.render_mode)
+        best = None
+        for _ in range(max(1, args.repeat)):
+            stages, rows = run_pipeline(
+                app, sheet_path, template, args.content, args.render_mode,
+                args.upload_latency_ms / 1000, work_dir
+            )
+            if best is None:
+                best = stages
+            else:
+                best = {
+                    stage: {name: min(best[stage][name], stages[stage][name]) for name in stages[stage]}
+                    for stage in stages
+                }
+        results[key] = best
+        rows_by_scenario[key] = rows
+
+    baseline = load_baseline(args.baseline)
+    for key, stages in results.items():
+        print_report(key, stages, rows_by_scenario[key], (baseline or {}).get("scenarios", {}).get(key))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"scenarios": results}, f, indent=2)
+
+    if args.save_baseline:
+        merged = baseline or {"scenarios": {}}
+        merged["scenarios"].update(results)
+        merged["saved_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        with open(args.baseline, "w") as f:
+            json.dump(merged, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if baseline is None:
+        print(f"\nNo baseline at {args.baseline} (run with --save-baseline to create one)")
+        return 0
+    regressions = compare(results, baseline, args.threshold, args.rss_threshold, args.min_seconds)
+    if regressions:
+        print("\nRegressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print("\nNo regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+import os
+import shutil
+import logging
+
+from db import transaction, query, executemany_chunked
+
+logger = logging.getLogger(__name__)
+
+
+class BatchCheckpoint:
+    """
+    Per-row progress of a bulk job, kept in job_rows so that a job picked up
+    again after a crash / timeout continues where it stopped:
+    reserved certificate number -> rendered PDF (file under artifact_dir) -> upload URL.
+    """
+
+    def __init__(self, db_path, job_id, artifact_dir):
+        self.db_path = db_path
+        self.job_id = job_id
+        self.artifact_dir = artifact_dir
+        self.rows = {}
+
+    def load(self):
+        """Checkpointed rows of an earlier run: {row_index: {"certificate_number", "pdf_path", "url"}}"""
+        self.rows = {
+            row["row_index"]: dict(row)
+            for row in query(
+                self.db_path,
+                "SELECT row_index, certificate_number, pdf_path, url FROM job_rows WHERE job_id = ?",
+                (self.job_id,)
+            )
+        }
+        if self.rows:
+            rendered = sum(1 for row in self.rows.values() if row["pdf_path"])
+            logger.info(f"Job {self.job_id}: resuming, {rendered} of {len(self.rows)} checkpointed row(s) already rendered")
+        return self.rows
+
+    def reserved(self, numbers):
+        """Stores the certificate numbers reserved for [(row_index, certificate_number)]"""
+        executemany_chunked(
+            self.db_path,
+            "INSERT OR REPLACE INTO job_rows (job_id, row_index, certificate_number) VALUES (?, ?, ?)",
+            [(self.job_id, row_index, cert_no) for row_index, cert_no in numbers]
+        )
+
+    def rendered(self, row_indexes, pdf, name):
+        """Keeps a rendered PDF (one certificate, or a combined chunk) and marks its rows"""
+        os.makedirs(self.artifact_dir, exist_ok=True)
+        path = os.path.join(self.artifact_dir, name)
+        with open(path, "wb") as f:
+            f.write(pdf)
+        with transaction(self.db_path) as conn:
+            conn.executemany(
+                "UPDATE job_rows SET pdf_path = ? WHERE job_id = ? AND row_index = ?",
+                [(path, self.job_id, row_index) for row_index in row_indexes]
+            )
+        return path
+
+    def uploaded(self, cert_no, url):
+        with transaction(self.db_path) as conn:
+            conn.execute(
+                "UPDATE job_rows SET url = ? WHERE job_id = ? AND certificate_number = ?",
+                (url, self.job_id, cert_no)
+            )
+
+    def resumable(self, row_index):
+        """Checkpoint of a row whose PDF is still on disk, or None"""
+        row = self.rows.get(row_index)
+        if row and row["pdf_path"] and os.path.exists(row["pdf_path"]):
+            return row
+        return None
+
+    def clear(self):
+        """Drops the checkpoints and artifacts once the job has finished"""
+        with transaction(self.db_path) as conn:
+            conn.execute("DELETE FROM job_rows WHERE job_id = ?", (self.job_id,))
+        shutil.rmtree(self.artifact_dir, ignore_errors=True)
+        self.rows = {}
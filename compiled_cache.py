@@ -0,0 +1,93 @@
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from jinja2 import Template
+
+# How many compiled body templates / parsed stylesheets to keep
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", "64"))
+STYLESHEET_CACHE_SIZE = int(os.getenv("STYLESHEET_CACHE_SIZE", "8"))
+
+STYLE_BLOCK_RE = re.compile(r"<style[^>]*>(.*?)</style>", re.IGNORECASE | re.DOTALL)
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """Small thread-safe LRU mapping with hit/miss counters"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_create(self, key, factory):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        value = factory()
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+_body_templates = LRUCache(TEMPLATE_CACHE_SIZE)
+_stylesheets = LRUCache(STYLESHEET_CACHE_SIZE)
+
+
+# ---------------- JINJA BODY TEMPLATES ----------------
+def get_body_template(source):
+    """Compiled Jinja template for the user's certificate content, shared across rows and requests"""
+    return _body_templates.get_or_create(content_hash(source), lambda: Template(source))
+
+
+# ---------------- WEASYPRINT STYLESHEETS ----------------
+def split_stylesheet(html):
+    """
+    Moves the inline <style> blocks out of a rendered certificate page.
+    Returns (html_without_styles, css_text); css_text is "" when there is none.
+    """
+    css_parts = STYLE_BLOCK_RE.findall(html)
+    if not css_parts:
+        return html, ""
+    return STYLE_BLOCK_RE.sub("", html), "\n".join(css_parts)
+
+
+def get_stylesheet(css_text, base_url, url_fetcher=None):
+    """
+    Parsed WeasyPrint stylesheet plus the FontConfiguration its @font-face
+    rules were loaded into. Runs inside render workers (objects are not picklable).
+    """
+    def parse():
+        from weasyprint import CSS
+        from weasyprint.text.fonts import FontConfiguration
+        font_config = FontConfiguration()
+        css = CSS(string=css_text, base_url=base_url, url_fetcher=url_fetcher, font_config=font_config)
+        return css, font_config
+
+    return _stylesheets.get_or_create(content_hash(f"{base_url}\n{css_text}"), parse)
+
+
+def cache_stats():
+    return {"body_templates": _body_templates.stats(), "stylesheets": _stylesheets.stats()}
@@ -0,0 +1,292 @@
+import os
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# How long a writer waits for the database lock before failing
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "30000"))
+# Rows per executemany() / commit in batch writes
+DB_WRITE_CHUNK_ROWS = int(os.getenv("DB_WRITE_CHUNK_ROWS", "500"))
+
+_local = threading.local()
+
+
+# ---------------- CONNECTIONS ----------------
+def _open(db_path):
+    conn = sqlite3.connect(db_path, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    # WAL: readers never block the writer (and the other way round)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def get_connection(db_path):
+    """
+    Connection of the calling thread for this database, opened once and
+    reused. Do not close it; commit / roll back through transaction().
+    """
+    pid = os.getpid()
+    if getattr(_local, "pid", None) != pid:
+        # New thread, or a process forked from one that had connections
+        _local.pid = pid
+        _local.connections = {}
+    conn = _local.connections.get(db_path)
+    if conn is None:
+        conn = _local.connections[db_path] = _open(db_path)
+    return conn
+
+
+def close_connections():
+    """Closes the connections of the calling thread (call it before a short-lived thread ends)"""
+    for conn in getattr(_local, "connections", {}).values():
+        conn.close()
+    _local.connections = {}
+
+
+@contextmanager
+def transaction(db_path, immediate=False):
+    """
+    Yields the pooled connection inside a transaction: committed on success,
+    rolled back on error. immediate=True takes the write lock up front
+    (read-then-write sections such as reservations and job claims).
+    """
+    conn = get_connection(db_path)
+    if conn.in_transaction:
+        # Left open by an earlier caller of this thread
+        conn.rollback()
+    if immediate:
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def query(db_path, sql, params=()):
+    """All rows of a read query"""
+    return get_connection(db_path).execute(sql, params).fetchall()
+
+
+def iter_chunks(rows, size=DB_WRITE_CHUNK_ROWS):
+    rows = list(rows)
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def executemany_chunked(db_path, sql, rows, size=DB_WRITE_CHUNK_ROWS):
+    """executemany() in chunks, each committed on its own; returns the row count"""
+    count = 0
+    for chunk in iter_chunks(rows, size):
+        with transaction(db_path) as conn:
+            conn.executemany(sql, chunk)
+        count += len(chunk)
+    return count
+
+
+# ---------------- MIGRATIONS ----------------
+def _create_certificates(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS certificates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            certificate_number TEXT,
+            student_name TEXT,
+            pdf_path TEXT,
+            cloudinary_url TEXT
+        )
+    """)
+    # Databases from before Cloudinary uploads lack this column
+    columns = [info[1] for info in conn.execute("PRAGMA table_info(certificates)")]
+    if "cloudinary_url" not in columns:
+        logger.info("Adding cloudinary_url column to certificates table...")
+        conn.execute("ALTER TABLE certificates ADD COLUMN cloudinary_url TEXT")
+
+
+def _create_jobs(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            sheet_path TEXT,
+            options TEXT,
+            total_rows INTEGER DEFAULT 0,
+            done_rows INTEGER DEFAULT 0,
+            failed_rows INTEGER DEFAULT 0,
+            errors TEXT,
+            zip_path TEXT,
+            error TEXT,
+            owner TEXT,
+            created_at REAL,
+            started_at REAL,
+            heartbeat_at REAL,
+            finished_at REAL
+        )
+    """)
+
+
+def _create_certificate_sequence(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS certificate_sequence (
+            name TEXT PRIMARY KEY,
+            last_number INTEGER NOT NULL
+        )
+    """)
+
+
+def _create_indexes(conn):
+    try:
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_certificates_number ON certificates (certificate_number)")
+    except sqlite3.IntegrityError:
+        # Older databases may hold duplicates: index them anyway, without the constraint
+        logger.error("Duplicate certificate numbers in the certificates table: index created without UNIQUE")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_certificates_number ON certificates (certificate_number)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_certificates_student_name ON certificates (student_name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+
+
+def _create_table_versions(conn):
+    # Bumped by triggers on every write, so caches in any process can tell
+    # that the certificates changed (see verification.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES ('certificates', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS certificates_version_{event.lower()} AFTER {event} ON certificates
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = 'certificates';
+            END
+        """)
+
+
+def _create_certificates_fts(conn):
+    """Full-text index over student names / numbers, kept in sync by triggers"""
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS certificates_fts USING fts5(
+                student_name, certificate_number,
+                content='certificates', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        # SQLite built without FTS5: name search falls back to LIKE
+        logger.error(f"FTS5 not available, student name search will not be indexed: {e}")
+        return
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS certificates_fts_insert AFTER INSERT ON certificates
+        BEGIN
+            INSERT INTO certificates_fts (rowid, student_name, certificate_number)
+            VALUES (new.id, new.student_name, new.certificate_number);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS certificates_fts_delete AFTER DELETE ON certificates
+        BEGIN
+            INSERT INTO certificates_fts (certificates_fts, rowid, student_name, certificate_number)
+            VALUES ('delete', old.id, old.student_name, old.certificate_number);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS certificates_fts_update AFTER UPDATE ON certificates
+        BEGIN
+            INSERT INTO certificates_fts (certificates_fts, rowid, student_name, certificate_number)
+            VALUES ('delete', old.id, old.student_name, old.certificate_number);
+            INSERT INTO certificates_fts (rowid, student_name, certificate_number)
+            VALUES (new.id, new.student_name, new.certificate_number);
+        END
+    """)
+    # Index the rows that existed before
+    conn.execute("INSERT INTO certificates_fts (certificates_fts) VALUES ('rebuild')")
+
+
+def _narrow_certificates_version_update(conn):
+    # Upload URLs are written after every row of a bulk run: they no longer
+    # bump the version (verification.py reads missing URLs on its own),
+    # only changes of what identifies a certificate do
+    conn.execute("DROP TRIGGER IF EXISTS certificates_version_update")
+    conn.execute("""
+        CREATE TRIGGER certificates_version_update AFTER UPDATE OF certificate_number, student_name ON certificates
+        BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'certificates';
+        END
+    """)
+
+
+def _add_jobs_cached_rows(conn):
+    conn.execute("ALTER TABLE jobs ADD COLUMN cached_rows INTEGER DEFAULT 0")
+
+
+def _create_job_rows(conn):
+    # Per-row checkpoints of running jobs (see checkpoints.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS job_rows (
+            job_id TEXT NOT NULL,
+            row_index INTEGER NOT NULL,
+            certificate_number TEXT,
+            pdf_path TEXT,
+            url TEXT,
+            PRIMARY KEY (job_id, row_index)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_job_rows_number ON job_rows (job_id, certificate_number)")
+
+
+def _add_certificates_render_context(conn):
+    # Template and page context of each certificate (JSON), so its PDF can be
+    # rendered again on demand instead of being kept on disk
+    columns = [info[1] for info in conn.execute("PRAGMA table_info(certificates)")]
+    if "render_context" not in columns:
+        conn.execute("ALTER TABLE certificates ADD COLUMN render_context TEXT")
+
+
+def _create_certificate_issues(conn):
+    # Which certificate each student of a sheet got (incremental re-issue):
+    # issue key (template + register number, or name + date) -> number and
+    # a hash of the row it was rendered from
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS certificate_issues (
+            issue_key TEXT PRIMARY KEY,
+            certificate_number TEXT NOT NULL,
+            row_hash TEXT NOT NULL
+        )
+    """)
+
+
+# Applied in order; the index of the last applied one is kept in PRAGMA user_version.
+# Steps must also work on databases created before versioning (IF NOT EXISTS).
+MIGRATIONS = [
+    _create_certificates,
+    _create_jobs,
+    _create_certificate_sequence,
+    _create_indexes,
+    _create_table_versions,
+    _create_certificates_fts,
+    _add_jobs_cached_rows,
+    _create_job_rows,
+    _add_certificates_render_context,
+    _create_certificate_issues,
+    _narrow_certificates_version_update,
+]
+
+
+def migrate(db_path, migrations=MIGRATIONS):
+    """Brings the schema up to date; returns the resulting version"""
+    with transaction(db_path, immediate=True) as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, step in enumerate(migrations[version:], start=version + 1):
+            logger.info(f"Applying migration {number}: {step.__name__}")
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+    return len(migrations) if version < len(migrations) else version
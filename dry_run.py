@@ -0,0 +1,108 @@
+import os
+import logging
+
+from jinja2 import Environment, meta
+
+from compiled_cache import get_body_template
+from sheet_prep import resolve_column_roles, iter_row_contexts, certificate_title, NAME_FIT_MAX_CHARS
+
+logger = logging.getLogger(__name__)
+
+# Rows listed with their warnings in a dry run (the counts cover every row)
+DRY_RUN_MAX_ROWS = int(os.getenv("DRY_RUN_MAX_ROWS", "500"))
+
+ROLE_WARNINGS = {
+    "reg": "No register number column found.",
+    "issue_date": "No issue date column found: every certificate gets today's date.",
+}
+
+
+def content_placeholders(content):
+    """Variables used by the certificate content, or raises on a template syntax error"""
+    return meta.find_undeclared_variables(Environment().parse(content or ""))
+
+
+def dry_run(frames, content, cert_type_preference, first_number, format_number):
+    """
+    Runs the bulk path over every row without rendering PDFs: column roles,
+    the numbers the rows would get, the body of every row and its title.
+    Returns a summary with the warnings of each row (at most DRY_RUN_MAX_ROWS
+    rows are listed).
+    """
+    result = {
+        "errors": [],
+        "warnings": [],
+        "roles": None,
+        "row_count": 0,
+        "titles": {},
+        "rows_with_warnings": 0,
+        "rows": [],
+        "truncated": False,
+        "numbers": [],
+    }
+    try:
+        placeholders = content_placeholders(content)
+        template = get_body_template(content or "")
+    except Exception as e:
+        result["errors"].append(f"Certificate content is not a valid template: {e}")
+        return result
+
+    roles = None
+    row_offset = 0
+    numbers = result["numbers"]
+    for df in frames:
+        if roles is None:
+            roles = resolve_column_roles(df.columns)
+            result["roles"] = roles
+            if not roles["name"]:
+                result["errors"].append("No student name column found (expected one of: Name, Student Name, Full Name).")
+            result["warnings"].extend(message for role, message in ROLE_WARNINGS.items() if not roles[role])
+
+        unparsed_dates = {}
+        for column, cells in df.attrs.get("unparsed_dates", {}).items():
+            for position, raw in cells:
+                unparsed_dates.setdefault(position, []).append(f"{column} '{raw}' is not a valid date and will be empty.")
+
+        for k, template_context, fields in iter_row_contexts(df, roles):
+            i = row_offset + k
+            cert_no = format_number(first_number + i)
+            numbers.append(cert_no)
+            if i == 0:
+                # Placeholders no column (or derived value) provides
+                for name in sorted(placeholders - set(template_context)):
+                    result["warnings"].append(f"Placeholder {{{{ {name} }}}} has no matching column and will be empty.")
+
+            row_warnings = list(unparsed_dates.get(k, []))
+            title = None
+            try:
+                rendered_body = template.render(**template_context)
+                title = certificate_title(rendered_body, cert_type_preference, fields["industrial_visit_hint"])
+                result["titles"][title] = result["titles"].get(title, 0) + 1
+            except Exception as e:
+                row_warnings.append(f"Certificate content failed for this row: {e}")
+
+            name = fields["student_name"]
+            if len(name) > NAME_FIT_MAX_CHARS:
+                row_warnings.append(f"Name is {len(name)} characters long and may not fit on one line.")
+            for placeholder in sorted(placeholders & set(template_context)):
+                if template_context[placeholder] == "":
+                    row_warnings.append(f"{{{{ {placeholder} }}}} is empty.")
+
+            if row_warnings:
+                result["rows_with_warnings"] += 1
+                if len(result["rows"]) < DRY_RUN_MAX_ROWS:
+                    result["rows"].append({
+                        "row": i + 1,
+                        "certificate_number": cert_no,
+                        "student_name": name,
+                        "certificate_title": title,
+                        "warnings": row_warnings,
+                    })
+                else:
+                    result["truncated"] = True
+        row_offset += len(df)
+
+    result["row_count"] = row_offset
+    if not row_offset:
+        result["errors"].append("No valid data rows found. Please check column headings.")
+    return result
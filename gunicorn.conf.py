@@ -0,0 +1,26 @@
+"""
+gunicorn settings (read automatically from the working directory).
+
+With preload the app is imported once in the master: the database
+migration, the asset variants and the warm caches (see app.preload_caches)
+are done before forking and shared copy-on-write by the workers. Threads do
+not survive a fork, so each worker starts its job worker (and the optional
+warm-up render) in post_fork.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "900"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+if preload_app:
+    # Read by startup.PRELOADED when the master imports the app
+    os.environ["GUNICORN_PRELOADED"] = "1"
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from app import start_background_threads
+        start_background_threads()
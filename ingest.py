@@ -0,0 +1,203 @@
+import os
+import re
+import csv
+import codecs
+
+from sheet_prep import NAME_COLUMNS
+from metrics import timed
+
+# Rows inspected when looking for the header row
+HEADER_SCAN_ROWS = 10
+# Data rows per DataFrame handed to the pipeline (bounds ingestion memory)
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "1000"))
+
+DATE_COLUMNS = ["issue_date", "date", "start_date", "end_date", "joining_date", "ending_date"]
+
+
+# ---------------- SMART HEADER DETECTION ----------------
+def detect_header_row(rows):
+    """
+    Finds the row with the most non-empty cells among the first rows.
+    Returns the 0-based index of that row (the first one wins on ties).
+    """
+    max_cols = 0
+    best_row = 0
+    for idx, row in enumerate(rows):
+        valid_cols = sum(1 for v in row if v is not None and str(v).strip() not in ("", "nan"))
+        if valid_cols > max_cols:
+            max_cols = valid_cols
+            best_row = idx
+    return best_row
+
+
+def normalize_column(name):
+    col_str = str(name).strip().lower()
+    return re.sub(r"\s+", "_", col_str)
+
+
+def _header_names(header):
+    """Header cells as column names, with pandas' names for blank / repeated cells"""
+    names = []
+    seen = {}
+    for i, cell in enumerate(header):
+        name = str(cell).strip() if cell is not None and str(cell).strip() else f"Unnamed: {i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+# ---------------- ROW SOURCES ----------------
+def _is_csv(filename):
+    return os.path.splitext(filename or "")[1].lower() == ".csv"
+
+
+def _is_legacy_xls(filename):
+    return os.path.splitext(filename or "")[1].lower() == ".xls"
+
+
+class SheetReader:
+    """
+    Single pass over an uploaded sheet: the first rows are buffered to find the
+    header, then data rows are streamed straight from the file.
+    Use as a context manager; rows come from iter_rows().
+    """
+
+    def __init__(self, source, filename=None):
+        self.source = source
+        self.filename = filename or (source if isinstance(source, str) else getattr(source, "filename", ""))
+        self._workbook = None
+        self._file = None
+        self.total_rows = None  # rows in the sheet incl. header, from metadata when known
+        self._rows = self._open()
+
+        self._buffer = []
+        with timed("header_detection"):
+            for row in self._rows:
+                self._buffer.append(row)
+                if len(self._buffer) >= HEADER_SCAN_ROWS:
+                    break
+            self.header_index = detect_header_row(self._buffer)
+        header = self._buffer[self.header_index] if self._buffer else ()
+        self.raw_columns = _header_names(header)
+        self.columns = [normalize_column(c) for c in self.raw_columns]
+
+    def _open(self):
+        stream = self.source
+        if hasattr(stream, "seek"):
+            stream.seek(0)
+        if hasattr(stream, "stream"):
+            # werkzeug FileStorage
+            stream = stream.stream
+
+        if _is_csv(self.filename):
+            if isinstance(stream, str):
+                stream = self._file = open(stream, "rb")
+            return csv.reader(codecs.getreader("utf-8-sig")(stream, errors="replace"))
+
+        if _is_legacy_xls(self.filename):
+            # openpyxl cannot read .xls: fall back to pandas (xlrd) for this format
+            import pandas as pd
+            df = pd.read_excel(stream, header=None, dtype=object)
+            self.total_rows = len(df)
+            return (tuple(None if pd.isna(v) else v for v in row) for row in df.itertuples(index=False))
+
+        from openpyxl import load_workbook
+        self._workbook = load_workbook(stream, read_only=True, data_only=True)
+        sheet = self._workbook.active
+        self.total_rows = sheet.max_row
+        return sheet.iter_rows(values_only=True)
+
+    @property
+    def estimated_data_rows(self):
+        """Data rows below the header according to the sheet dimension (may include blank rows)"""
+        if self.total_rows is None:
+            return None
+        return max(0, self.total_rows - self.header_index - 1)
+
+    def iter_rows(self):
+        """Data rows after the header, padded / cut to the header width"""
+        width = len(self.columns)
+        for row in self._buffer[self.header_index + 1:]:
+            yield _fit(row, width)
+        self._buffer = []
+        for row in self._rows:
+            yield _fit(row, width)
+
+    def close(self):
+        if self._workbook is not None:
+            self._workbook.close()
+            self._workbook = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _fit(row, width):
+    row = tuple(None if (v is None or (isinstance(v, str) and not v.strip())) else v for v in row)
+    if len(row) < width:
+        return row + (None,) * (width - len(row))
+    return row[:width]
+
+
+# ---------------- CLEANED DATAFRAME CHUNKS ----------------
+def clean_frame(df):
+    """Same cleanup as before for a block of rows: blank rows / rows without name removed, dates parsed"""
+    import pandas as pd
+    df = df.dropna(how="all")
+
+    # Further cleanup: remove rows where the student name is missing
+    actual_name_col = next((c for c in NAME_COLUMNS if c in df.columns), None)
+    if actual_name_col:
+        names = df[actual_name_col].astype(str).str.strip()
+        df = df[names.ne("nan") & names.ne("") & names.ne("None")]
+
+    # Parse date columns safely (including user-defined ones)
+    unparsed = {}
+    for col in DATE_COLUMNS:
+        if col in df.columns:
+            parsed = pd.to_datetime(df[col], dayfirst=True, errors="coerce")
+            failed = df[col].notna() & parsed.isna()
+            if failed.any():
+                # Kept for the dry run: {column: [(row position, raw value)]}
+                unparsed[col] = [(int(pos), str(df[col].iloc[pos])) for pos in failed.to_numpy().nonzero()[0]]
+            df[col] = parsed
+    df.attrs["unparsed_dates"] = unparsed
+    return df
+
+
+def iter_sheet_frames(reader, chunk_rows=INGEST_CHUNK_ROWS):
+    """Cleaned DataFrames of at most chunk_rows rows, streamed from a SheetReader"""
+    import pandas as pd
+    block = []
+    for row in reader.iter_rows():
+        block.append(row)
+        if len(block) >= chunk_rows:
+            df = clean_frame(pd.DataFrame.from_records(block, columns=reader.columns))
+            block = []
+            if len(df):
+                yield df.reset_index(drop=True)
+    if block:
+        df = clean_frame(pd.DataFrame.from_records(block, columns=reader.columns))
+        if len(df):
+            yield df.reset_index(drop=True)
+
+
+def preview_sheet(source, filename=None):
+    """Header columns and row count without parsing the data rows of a workbook"""
+    with SheetReader(source, filename) as reader:
+        row_count = reader.estimated_data_rows
+        if row_count is None or _is_csv(reader.filename):
+            # CSV has no dimension metadata: count the remaining lines (streamed)
+            row_count = sum(1 for row in reader.iter_rows() if any(v is not None for v in row))
+        return reader.raw_columns, reader.columns, row_count
+
@@ -0,0 +1,154 @@
+import os
+import time
+import shutil
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Seconds between janitor passes (0 disables the janitor)
+JANITOR_INTERVAL_SECONDS = float(os.getenv("JANITOR_INTERVAL_SECONDS", "600"))
+# Disk bound of the certificates kept under generated/pdfs (0 = no bound);
+# a removed one is rendered again from its stored context when downloaded
+PDF_DIR_MAX_MB = float(os.getenv("PDF_DIR_MAX_MB", "256"))
+# Finished job outputs (ZIP / combined PDF) are removed after this many hours
+JOB_OUTPUT_MAX_AGE_HOURS = float(os.getenv("JOB_OUTPUT_MAX_AGE_HOURS", "24"))
+# Checkpointed PDFs and uploaded sheets of jobs that are not queued or
+# running (failed, orphaned) are removed this many hours after their last
+# write; a failed job can be resumed until then
+JOB_LEFTOVER_MAX_AGE_HOURS = float(os.getenv("JOB_LEFTOVER_MAX_AGE_HOURS", "72"))
+
+
+# ---------------- SWEEPS ----------------
+def _files(root):
+    """[(mtime, size, path)] of every file under root, at any depth"""
+    entries = []
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def _remove_empty_dirs(root):
+    for dirpath, _, _ in sorted(os.walk(root), key=lambda entry: -len(entry[0])):
+        if dirpath != root:
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass
+
+
+def trim_dir(root, max_bytes):
+    """
+    Removes the least recently modified files under root (subdirectories
+    included) until at most max_bytes are left. Returns the files removed.
+    """
+    if max_bytes <= 0 or not os.path.isdir(root):
+        return 0
+    entries = sorted(_files(root))
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    if removed:
+        _remove_empty_dirs(root)
+        logger.info(f"Janitor: removed {removed} file(s) from {root}, {total / 1024 / 1024:.1f} MB kept")
+    return removed
+
+
+def remove_old_files(root, max_age_seconds, prefix="", keep=()):
+    """
+    Removes the files directly in root whose name starts with prefix and
+    that are older than max_age_seconds; paths in keep are left alone
+    """
+    if max_age_seconds <= 0 or not os.path.isdir(root):
+        return 0
+    cutoff = time.time() - max_age_seconds
+    keep = {os.path.abspath(path) for path in keep}
+    removed = 0
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if os.path.abspath(path) in keep:
+            continue
+        try:
+            if name.startswith(prefix) and os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    if removed:
+        logger.info(f"Janitor: removed {removed} expired file(s) from {root}")
+    return removed
+
+
+def remove_old_dirs(root, max_age_seconds, keep=()):
+    """
+    Removes the directories directly in root whose newest file is older
+    than max_age_seconds; directory names in keep are left alone
+    """
+    if max_age_seconds <= 0 or not os.path.isdir(root):
+        return 0
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name in keep or not os.path.isdir(path):
+            continue
+        try:
+            newest = max([mtime for mtime, _, _ in _files(path)], default=os.path.getmtime(path))
+        except OSError:
+            continue
+        if newest < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    if removed:
+        logger.info(f"Janitor: removed {removed} expired dir(s) from {root}")
+    return removed
+
+
+# ---------------- JANITOR ----------------
+class Janitor(threading.Thread):
+    """
+    Background thread keeping local disk use flat: runs every task once at
+    start and then every interval seconds. tasks is [(name, callable)].
+    """
+
+    def __init__(self, tasks, interval=JANITOR_INTERVAL_SECONDS):
+        super().__init__(name="janitor", daemon=True)
+        self.tasks = list(tasks)
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run_once(self):
+        for name, task in self.tasks:
+            try:
+                task()
+            except Exception as e:
+                logger.error(f"Janitor task '{name}' failed: {e}", exc_info=True)
+
+    def run(self):
+        while True:
+            self.run_once()
+            if self._stopped.wait(self.interval):
+                return
+
+    def start(self):
+        if self.interval <= 0:
+            logger.info("Janitor disabled (JANITOR_INTERVAL_SECONDS=0)")
+            return
+        super().start()
+
+    def stop(self):
+        self._stopped.set()
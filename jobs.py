@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+import logging
+from contextlib import contextmanager
+
+from db import transaction, query, close_connections
+from metrics import ROWS
+
+logger = logging.getLogger(__name__)
+
+# Seconds between polls of the jobs table when nothing was submitted locally
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "5"))
+# A running job whose heartbeat is older than this is considered orphaned
+# (worker killed / restarted) and is picked up again
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "120"))
+# Keep at most this many per-row error messages on a job
+MAX_JOB_ERRORS = 50
+# Queued jobs accepted at once; further submissions get a 429 (0 = no limit)
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "20"))
+
+
+# ---------------- JOBS TABLE ----------------
+def create_job(db_path, sheet_path, options):
+    """Stores a queued job and returns its id"""
+    job_id = uuid.uuid4().hex
+    with transaction(db_path) as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, status, sheet_path, options, errors, created_at) VALUES (?, 'queued', ?, ?, '[]', ?)",
+            (job_id, sheet_path, json.dumps(options), time.time())
+        )
+    return job_id
+
+
+def get_job(db_path, job_id):
+    """Returns the job as a dict (with progress and ETA) or None"""
+    rows = query(db_path, "SELECT * FROM jobs WHERE id = ?", (job_id,))
+    if not rows:
+        return None
+
+    job = dict(rows[0])
+    job["options"] = json.loads(job["options"] or "{}")
+    job["errors"] = json.loads(job["errors"] or "[]")
+
+    # ETA from the average time per processed row so far
+    eta = None
+    processed = job["done_rows"] + job["failed_rows"]
+    if job["status"] == "running" and job["started_at"] and processed and job["total_rows"]:
+        per_row = (time.time() - job["started_at"]) / processed
+        eta = round(per_row * (job["total_rows"] - processed), 1)
+    job["eta_seconds"] = eta
+    return job
+
+
+def queued_job_count(db_path):
+    return query(db_path, "SELECT COUNT(*) FROM jobs WHERE status = 'queued'")[0][0]
+
+
+def active_jobs(db_path):
+    """[{"id", "sheet_path"}] of the queued and running jobs, whose files must stay"""
+    return [dict(row) for row in query(db_path, "SELECT id, sheet_path FROM jobs WHERE status IN ('queued', 'running')")]
+
+
+def requeue_job(db_path, job_id):
+    """Queues a failed job again; it resumes from its checkpointed rows. Returns False if it was not failed"""
+    with transaction(db_path) as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'queued', error = NULL, finished_at = NULL WHERE id = ? AND status = 'failed'",
+            (job_id,)
+        )
+        return cursor.rowcount > 0
+
+
+class JobProgress:
+    """Handed to the job runner to report per-row progress"""
+
+    def __init__(self, db_path, job_id):
+        self.db_path = db_path
+        self.job_id = job_id
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.cached = 0
+        self.errors = []
+
+    def _save(self):
+        with transaction(self.db_path) as conn:
+            conn.execute(
+                "UPDATE jobs SET total_rows = ?, done_rows = ?, failed_rows = ?, cached_rows = ?, errors = ?, heartbeat_at = ? WHERE id = ?",
+                (self.total, self.done, self.failed, self.cached, json.dumps(self.errors), time.time(), self.job_id)
+            )
+
+    def heartbeat(self):
+        """Marks the job as alive while it runs without progress (only heartbeat_at is written)"""
+        with transaction(self.db_path) as conn:
+            conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time(), self.job_id))
+
+    def set_total(self, total):
+        self.total = total
+        self._save()
+
+    def row_done(self, cached=False):
+        """cached: the PDF came from the PDF cache instead of being rendered"""
+        self.done += 1
+        if cached:
+            self.cached += 1
+        ROWS.inc(result="cached" if cached else "rendered")
+        self._save()
+
+    def row_failed(self, row_index, error):
+        self.failed += 1
+        ROWS.inc(result="failed")
+        if len(self.errors) < MAX_JOB_ERRORS:
+            self.errors.append({"row": row_index, "error": str(error)})
+        self._save()
+
+
+@contextmanager
+def keep_alive(progress, interval=JOB_STALE_SECONDS / 4):
+    """
+    Refreshes the job heartbeat every interval seconds while the body runs,
+    also while it blocks without reporting progress, so no other worker
+    claims the job
+    """
+    stopped = threading.Event()
+
+    def beat():
+        try:
+            while not stopped.wait(interval):
+                try:
+                    progress.heartbeat()
+                except Exception as e:
+                    logger.warning(f"Heartbeat of job {progress.job_id} failed: {e}")
+        finally:
+            # One ticker thread per job: its connection goes with it
+            close_connections()
+
+    thread = threading.Thread(target=beat, name=f"heartbeat-{progress.job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+class LogProgress(JobProgress):
+    """
+    Same interface as JobProgress for batches that are not stored as jobs.
+    on_failed(row_index, error) is called for every failed row.
+    """
+
+    def __init__(self, batch_id, on_failed=None):
+        super().__init__(None, batch_id)
+        self.on_failed = on_failed
+
+    def _save(self):
+        pass
+
+    def heartbeat(self):
+        pass
+
+    def row_failed(self, row_index, error):
+        super().row_failed(row_index, error)
+        logger.warning(f"Batch {self.job_id}: row {row_index} failed: {error}")
+        if self.on_failed:
+            self.on_failed(row_index, error)
+
+
+# ---------------- WORKER ----------------
+class JobWorker(threading.Thread):
+    """
+    Background thread that claims queued jobs from the jobs table and runs them.
+    runner(job, progress) must return the path of the finished ZIP
+    (None when the job finished with nothing to download).
+    """
+
+    def __init__(self, db_path, runner):
+        super().__init__(name="job-worker", daemon=True)
+        self.db_path = db_path
+        self.runner = runner
+        self.owner = None
+        self._wakeup = threading.Event()
+
+    def notify(self):
+        """Wakes the worker up right after a job is submitted"""
+        self._wakeup.set()
+
+    def _claim_next(self):
+        with transaction(self.db_path, immediate=True) as conn:
+            stale_before = time.time() - JOB_STALE_SECONDS
+            row = conn.execute(
+                """SELECT id FROM jobs
+                   WHERE status = 'queued' OR (status = 'running' AND heartbeat_at < ?)
+                   ORDER BY created_at LIMIT 1""",
+                (stale_before,)
+            ).fetchone()
+            if not row:
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, started_at = ?, heartbeat_at = ?, done_rows = 0, failed_rows = 0, cached_rows = 0, errors = '[]' WHERE id = ?",
+                (self.owner, now, now, row[0])
+            )
+            return row[0]
+
+    def _finish(self, job_id, status, zip_path=None, error=None):
+        with transaction(self.db_path) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, zip_path = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, zip_path, error, time.time(), job_id)
+            )
+
+    def run(self):
+        # Set here, not in __init__: with gunicorn preload the worker is
+        # created in the master and started in each forked process
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        logger.info(f"Job worker {self.owner} started")
+        while True:
+            try:
+                job_id = self._claim_next()
+            except Exception as e:
+                logger.error(f"Job claim failed: {e}", exc_info=True)
+                job_id = None
+
+            if not job_id:
+                self._wakeup.wait(JOB_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+
+            job = get_job(self.db_path, job_id)
+            logger.info(f"Job {job_id} started")
+            try:
+                zip_path = self.runner(job, JobProgress(self.db_path, job_id))
+                self._finish(job_id, "done", zip_path=zip_path)
+                logger.info(f"Job {job_id} finished")
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}", exc_info=True)
+                self._finish(job_id, "failed", error=str(e))
@@ -0,0 +1,115 @@
+import io
+import threading
+import logging
+from collections import OrderedDict
+
+from asset_cache import get_asset_cache
+from compiled_cache import content_hash, get_stylesheet
+
+logger = logging.getLogger(__name__)
+
+# Templates that mark their per-student parts with the "layer-dynamic" class
+LAYERED_TEMPLATES = {"certificate.html", "Certificate_Acadeno.html"}
+
+# Both layers: the bottom section (signature, certificate number, date) is
+# pinned where it falls after a typical body instead of following the body
+# text, so the signature is drawn once in the background and every row's
+# number and date line up with it
+LAYER_LAYOUT_CSS = """
+.bottom-section { position: absolute; left: 25mm; right: 25mm; top: 190mm; margin-top: 0; }
+"""
+
+# Static layer: everything except the per-student parts (kept in layout, not drawn)
+BACKGROUND_LAYER_CSS = LAYER_LAYOUT_CSS + """
+.layer-dynamic, .layer-dynamic * { visibility: hidden !important; }
+"""
+
+# Text layer: only the per-student parts, on a transparent page
+TEXT_LAYER_CSS = LAYER_LAYOUT_CSS + """
+@page { background: transparent; }
+html, body { background: transparent !important; }
+body * { visibility: hidden; }
+.layer-dynamic, .layer-dynamic * { visibility: visible; }
+"""
+
+# Background pages kept per worker (one per template / stylesheet)
+MAX_BACKGROUNDS = 8
+
+_backgrounds = OrderedDict()
+_layer_css = {}
+_lock = threading.Lock()
+
+
+def supports_layered(template_name):
+    return template_name in LAYERED_TEMPLATES
+
+
+def _layer_stylesheet(name, css_text):
+    from weasyprint import CSS
+    with _lock:
+        if name not in _layer_css:
+            _layer_css[name] = CSS(string=css_text)
+        return _layer_css[name]
+
+
+def _render_layer(html, base_url, css_text, layer_css):
+    from weasyprint import HTML
+    assets = get_asset_cache()
+    stylesheets = []
+    options = {"cache": assets.image_cache}
+    if css_text:
+        css, font_config = get_stylesheet(css_text, base_url, assets.url_fetcher)
+        stylesheets.append(css)
+        options["font_config"] = font_config
+    stylesheets.append(layer_css)
+    return HTML(string=html, base_url=base_url, url_fetcher=assets.url_fetcher).write_pdf(
+        stylesheets=stylesheets, **options
+    )
+
+
+def _background_page(key, html, base_url, css_text):
+    """Static layer for this template, rendered on the first row and reused after"""
+    from pypdf import PdfReader
+    with _lock:
+        if key in _backgrounds:
+            _backgrounds.move_to_end(key)
+            return _backgrounds[key]
+
+    pdf = _render_layer(html, base_url, css_text, _layer_stylesheet("background", BACKGROUND_LAYER_CSS))
+    page = PdfReader(io.BytesIO(pdf)).pages[0]
+    logger.info(f"Rendered static background layer {key[:12]}")
+
+    with _lock:
+        _backgrounds[key] = page
+        while len(_backgrounds) > MAX_BACKGROUNDS:
+            _backgrounds.popitem(last=False)
+    return page
+
+
+# ---------------- RENDER TASK (runs inside workers) ----------------
+def write_layered_pdf(html, base_url, pdf_path, css_text, template_name, assets=""):
+    """
+    Renders only the per-student text layer and merges it onto the cached
+    static background page of the template. Returns the PDF bytes when
+    pdf_path is None. assets is the asset version the PDF cache keys on:
+    a background drawn from older images or fonts is not reused.
+    """
+    from pypdf import PdfReader, PdfWriter
+
+    key = content_hash(f"{template_name}\n{base_url}\n{css_text}\n{assets}")
+    background = _background_page(key, html, base_url, css_text)
+
+    text_pdf = _render_layer(html, base_url, css_text, _layer_stylesheet("text", TEXT_LAYER_CSS))
+    text_page = PdfReader(io.BytesIO(text_pdf)).pages[0]
+
+    writer = PdfWriter()
+    page = writer.add_page(background)
+    page.merge_page(text_page)
+    writer.compress_identical_objects()
+    if pdf_path is None:
+        output = io.BytesIO()
+        writer.write(output)
+        return output.getvalue()
+    with open(pdf_path, "wb") as f:
+        writer.write(f)
+    return pdf_path
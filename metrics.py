@@ -0,0 +1,268 @@
+import os
+import time
+import cProfile
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BATCH_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+RSS_BUCKETS = tuple(mb * 1024 * 1024 for mb in (64, 128, 256, 384, 512, 768, 1024, 2048))
+# How often the RSS of a running batch is sampled
+RSS_SAMPLE_SECONDS = float(os.getenv("RSS_SAMPLE_SECONDS", "0.5"))
+# Batches may be profiled on request (profile=1) only when this is on
+PROFILE_BATCHES = os.getenv("PROFILE_BATCHES", "0") == "1"
+
+
+# ---------------- METRIC TYPES ----------------
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self):
+        """[(suffix, label names, label values, value)]"""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_label_text(names, values)} {_number(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [("", self.labels, key, value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """Value read from fn() at scrape time, or set() per label values when there is no fn"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, fn=None, labels=()):
+        super().__init__(name, help, labels)
+        self.fn = fn
+        self._values = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.fn is None:
+            with self._lock:
+                return [("", self.labels, key, value) for key, value in sorted(self._values.items())]
+        try:
+            return [("", (), (), self.fn())]
+        except Exception as e:
+            logger.warning(f"Metric {self.name} unavailable: {e}")
+            return []
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., count, sum]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for n, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[n] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def samples(self):
+        samples = []
+        names = self.labels + ("le",)
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    samples.append(("_bucket", names, key + (f"{bound:g}",), count))
+                samples.append(("_bucket", names, key + ("+Inf",), series[-2]))
+                samples.append(("_count", self.labels, key, series[-2]))
+                samples.append(("_sum", self.labels, key, series[-1]))
+        return samples
+
+
+REGISTRY = []
+
+
+def render_metrics():
+    """All metrics of this process in the Prometheus text format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------- PIPELINE METRICS ----------------
+STAGE_SECONDS = Histogram(
+    "certificate_stage_seconds",
+    "Time spent in each step of certificate generation",
+    ["stage"]
+)
+ROWS = Counter("certificate_rows_total", "Sheet rows processed, by result", ["result"])
+UPLOADS = Counter("certificate_uploads_total", "Storage uploads, by result", ["backend", "result"])
+BATCHES = Counter("certificate_batches_total", "Bulk batches finished, by kind and status", ["kind", "status"])
+ADMISSION_REJECTED = Counter("certificate_admission_rejected_total", "Requests refused with a 429, by priority", ["priority"])
+BATCH_SECONDS = Histogram("certificate_batch_seconds", "Duration of bulk batches", ["kind"], BATCH_BUCKETS)
+BATCH_PEAK_RSS = Histogram(
+    "certificate_batch_peak_rss_bytes",
+    "Peak resident memory of the app process plus its render workers during a batch",
+    ["kind"],
+    RSS_BUCKETS
+)
+STARTUP_SECONDS = Gauge(
+    "certificate_startup_seconds",
+    "Time spent in each startup phase of this process (see startup.py)",
+    labels=["phase"]
+)
+
+
+def _rss_bytes(pid="self"):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+Gauge("process_resident_memory_bytes", "Resident memory of the app process", _rss_bytes)
+
+
+@contextmanager
+def timed(stage):
+    """Adds the time spent in the block to the stage histogram"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+
+def timed_iter(stage, iterable):
+    """Yields from iterable, timing every step as stage (streamed producers such as sheet chunks)"""
+    iterator = iter(iterable)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+        yield item
+
+
+class BatchMonitor:
+    """
+    Times one bulk batch and samples its peak RSS in the background (this
+    process plus the render workers listed by worker_pids()). Recorded in
+    the batch histograms when the block exits.
+    """
+
+    def __init__(self, kind, batch_id, worker_pids=None):
+        self.kind = kind
+        self.batch_id = batch_id
+        self.worker_pids = worker_pids or (lambda: [])
+        self.peak_rss = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        rss = _rss_bytes() + sum(_rss_bytes(pid) for pid in self.worker_pids())
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_SECONDS):
+            self._sample()
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        self._sample()
+        self._thread = threading.Thread(target=self._run, name=f"rss-{self.batch_id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        seconds = time.perf_counter() - self._started
+        BATCH_SECONDS.observe(seconds, kind=self.kind)
+        BATCH_PEAK_RSS.observe(self.peak_rss, kind=self.kind)
+        BATCHES.inc(kind=self.kind, status="failed" if exc_type else "done")
+        logger.info(
+            f"Batch {self.batch_id}: {seconds:.1f}s, peak RSS {self.peak_rss / 1024 / 1024:.0f} MB (incl. render workers)"
+        )
+
+
+# ---------------- PROFILING ----------------
+@contextmanager
+def profiled(path):
+    """
+    cProfile of the block written to path (nothing when path is None).
+    Only the calling thread is profiled; render workers and upload threads
+    show up as the time spent waiting for them.
+    """
+    if not path:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        profile.dump_stats(path)
+        logger.info(f"Profile written to {path}")
@@ -0,0 +1,71 @@
+import re
+import logging
+
+from db import transaction
+
+logger = logging.getLogger(__name__)
+
+SEQUENCE_NAME = "certificates"
+
+
+# ---------------- SEQUENCE TABLE ----------------
+def init_numbering(db_path, start_number):
+    """Seeds the sequence once from the highest existing certificate number"""
+    with transaction(db_path, immediate=True) as conn:
+        if conn.execute("SELECT 1 FROM certificate_sequence WHERE name = ?", (SEQUENCE_NAME,)).fetchone():
+            return
+        last_no = start_number - 1
+        for (cert_no,) in conn.execute("SELECT certificate_number FROM certificates"):
+            match = re.search(r"(\d+)$", cert_no or "")
+            if match:
+                last_no = max(last_no, int(match.group(1)))
+        conn.execute("INSERT INTO certificate_sequence (name, last_number) VALUES (?, ?)", (SEQUENCE_NAME, last_no))
+        logger.info(f"Certificate sequence seeded at {last_no}")
+
+
+def reserve_certificate_numbers(db_path, count, start=None):
+    """
+    Claims a block of count consecutive numbers and returns the first one.
+    With an explicit start the block begins there and the sequence only
+    moves forward past it, so later reservations never reuse those numbers.
+    """
+    with transaction(db_path, immediate=True) as conn:
+        last_no = conn.execute(
+            "SELECT last_number FROM certificate_sequence WHERE name = ?", (SEQUENCE_NAME,)
+        ).fetchone()[0]
+        first_no = start if start is not None else last_no + 1
+        conn.execute(
+            "UPDATE certificate_sequence SET last_number = ? WHERE name = ?",
+            (max(last_no, first_no + count - 1), SEQUENCE_NAME)
+        )
+    return first_no
+
+
+def peek_certificate_number(db_path, start=None):
+    """First number the next reservation would return (nothing is reserved)"""
+    if start is not None:
+        return start
+    with transaction(db_path) as conn:
+        return conn.execute(
+            "SELECT last_number FROM certificate_sequence WHERE name = ?", (SEQUENCE_NAME,)
+        ).fetchone()[0] + 1
+
+
+def claim_certificate_number(db_path, number):
+    """
+    Reserves number if it is still the next one of the sequence (taken
+    from peek_certificate_number); False when another reservation got it first
+    """
+    with transaction(db_path, immediate=True) as conn:
+        cursor = conn.execute(
+            "UPDATE certificate_sequence SET last_number = ? WHERE name = ? AND last_number = ?",
+            (number, SEQUENCE_NAME, number - 1)
+        )
+        return cursor.rowcount > 0
+
+
+def reset_numbering(db_path, start_number):
+    with transaction(db_path) as conn:
+        conn.execute(
+            "UPDATE certificate_sequence SET last_number = ? WHERE name = ?", (start_number - 1, SEQUENCE_NAME)
+        )
@@ -0,0 +1,173 @@
+import os
+import hashlib
+import logging
+import threading
+from importlib import metadata
+
+logger = logging.getLogger(__name__)
+
+# Disk bound of the rendered PDF cache (0 disables it)
+PDF_CACHE_MAX_MB = float(os.getenv("PDF_CACHE_MAX_MB", "256"))
+# Evict down to this share of the bound, so eviction scans stay rare
+EVICT_TO_RATIO = 0.9
+
+
+def _renderer_version():
+    try:
+        return metadata.version("weasyprint")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def asset_version(static_dir):
+    """Changes whenever a file under static/ (images, fonts) is added, removed or modified"""
+    digest = hashlib.sha256(_renderer_version().encode())
+    for root, dirs, files in os.walk(static_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            digest.update(f"{os.path.relpath(path, static_dir)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def certificate_key(html, css_text, render_mode, assets):
+    """Hash of everything that decides the rendered PDF of one certificate"""
+    digest = hashlib.sha256()
+    for part in (render_mode, assets, css_text or "", html):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class PdfCache:
+    """
+    Rendered certificates on disk by content key, with the URL each was
+    uploaded to. Least recently used files are evicted above max_bytes.
+    ext names the cached files (preview thumbnails are kept as png).
+    """
+
+    def __init__(self, root, max_bytes=int(PDF_CACHE_MAX_MB * 1024 * 1024), ext="pdf"):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ext = ext
+        self._lock = threading.Lock()
+        self._size = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, key, ext):
+        return os.path.join(self.root, key[:2], f"{key}.{ext}")
+
+    def get(self, key):
+        """(pdf bytes, url or None) for a cached certificate, or None"""
+        if not self.enabled:
+            return None
+        path = self._path(key, self.ext)
+        try:
+            with open(path, "rb") as f:
+                pdf = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            with open(self._path(key, "url")) as f:
+                url = f.read().strip() or None
+        except OSError:
+            url = None
+        with self._lock:
+            self.hits += 1
+        return pdf, url
+
+    def put(self, key, pdf):
+        if not self.enabled:
+            return
+        path = self._path(key, self.ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "wb") as f:
+            f.write(pdf)
+        # Overwriting a key (a race between two renders) replaces its bytes
+        try:
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._size is not None:
+                self._size += len(pdf) - replaced
+        if self._current_size() > self.max_bytes:
+            self.evict()
+
+    def set_url(self, key, url):
+        """Remembers where the PDF of key was uploaded (kept while the PDF is cached)"""
+        if not self.enabled or not url or not os.path.exists(self._path(key, self.ext)):
+            return
+        with open(self._path(key, "url"), "w") as f:
+            f.write(url)
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith(f".{self.ext}"):
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        return entries
+
+    def _current_size(self):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            return self._size
+
+    def evict(self):
+        """Removes least recently used PDFs (and their URLs) down to the bound"""
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * EVICT_TO_RATIO
+            removed = 0
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                for victim in (path, path[:-len(self.ext)] + "url"):
+                    try:
+                        os.remove(victim)
+                    except OSError:
+                        pass
+                total -= size
+                removed += 1
+            self._size = total
+        if removed:
+            logger.info(f"PDF cache: evicted {removed} file(s), {total / 1024 / 1024:.1f} MB kept")
+
+    def enforce(self):
+        """
+        Re-reads the size on disk (other processes write to the same
+        directory) and evicts when it is over the bound
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._size = None
+        if self._current_size() > self.max_bytes:
+            self.evict()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "bytes": self._size, "max_bytes": self.max_bytes}
@@ -0,0 +1,142 @@
+import json
+import hashlib
+import logging
+
+from db import query, iter_chunks, executemany_chunked, DB_WRITE_CHUNK_ROWS
+
+logger = logging.getLogger(__name__)
+
+# Options that change what a row's certificate says
+HASHED_OPTIONS = ("content", "cert_type", "template")
+
+
+def _normalize(value):
+    return " ".join(str(value or "").split()).casefold()
+
+
+class IncrementalIssue:
+    """
+    Incremental re-issue of a growing roster: every row is matched to the
+    certificate it got in an earlier run (by register number, else by name
+    and issue date, per page template) through certificate_issues.
+    A matched row keeps its number; it is rendered again only when its
+    values changed since. Rows without an issue record fall back to a
+    certificate issued before with the same name, issue date and template.
+    """
+
+    def __init__(self, db_path, options):
+        self.db_path = db_path
+        self.template = options.get("template", "certificate.html")
+        self.options = {name: options.get(name) or "" for name in HASHED_OPTIONS}
+        self.counts = {"new": 0, "changed": 0, "unchanged": 0}
+        self._pending = []
+        self._seeded = set()
+
+    @staticmethod
+    def issue_date(template_context, fields):
+        """
+        The row's issue_date column as given in the sheet: "" when the sheet
+        has none or the cell is blank (never the today fallback, which would
+        change the key and hash every day)
+        """
+        return fields["sheet_issue_date"] if "issue_date" in template_context else ""
+
+    def key(self, template_context, fields):
+        reg = _normalize(template_context.get("reg_id"))
+        if reg:
+            return f"{self.template}|reg:{reg}"
+        return f"{self.template}|name:{_normalize(fields['student_name'])}|{_normalize(self.issue_date(template_context, fields))}"
+
+    def row_hash(self, template_context, fields):
+        """Hash of the row's values (and of the options shaping its certificate)"""
+        if "issue_date" in template_context:
+            template_context = dict(template_context, issue_date=self.issue_date(template_context, fields))
+        values = {
+            "context": template_context,
+            "student_name": fields["student_name"],
+            "place": fields["place"],
+            "options": self.options,
+        }
+        return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def lookup(self, rows):
+        """
+        Earlier certificates of [(key, template_context, fields)] rows that
+        still exist: {key: {"certificate_number", "row_hash", "url", "render_context"}}
+        """
+        rows_by_key = {key: (template_context, fields) for key, template_context, fields in rows}
+        found = {}
+        for part in iter_chunks(list(rows_by_key)):
+            for row in query(
+                self.db_path,
+                f"""SELECT i.issue_key, i.certificate_number, i.row_hash, c.cloudinary_url, c.render_context
+                    FROM certificate_issues i JOIN certificates c ON c.certificate_number = i.certificate_number
+                    WHERE i.issue_key IN ({','.join('?' * len(part))})""",
+                part
+            ):
+                found[row[0]] = {
+                    "certificate_number": row[1], "row_hash": row[2], "url": row[3], "render_context": row[4]
+                }
+        missing = [(key, *row) for key, row in rows_by_key.items() if key not in found]
+        if missing:
+            found.update(self._seed(missing))
+        return found
+
+    def _seed(self, rows):
+        """
+        Certificates issued without an issue record (before incremental
+        re-issue, or by a run without it), matched by student name, issue
+        date (name alone for rows without one in the sheet) and page
+        template from their stored render context; the newest one wins.
+        Their row_hash is None, so the row is rendered again with the old
+        number. Register numbers are not stored with certificates, and ones
+        stored without a render context cannot be matched.
+        """
+        wanted = {}
+        for key, template_context, fields in rows:
+            wanted.setdefault((fields["student_name"], self.issue_date(template_context, fields)), key)
+        found = {}
+        for part in iter_chunks(list(dict.fromkeys(name for name, _ in wanted))):
+            for cert_no, name, url, stored in query(
+                self.db_path,
+                f"""SELECT certificate_number, student_name, cloudinary_url, render_context FROM certificates
+                    WHERE student_name IN ({','.join('?' * len(part))}) AND render_context IS NOT NULL
+                    AND certificate_number NOT IN (SELECT certificate_number FROM certificate_issues)
+                    ORDER BY id DESC""",
+                part
+            ):
+                try:
+                    issued = json.loads(stored)
+                except ValueError:
+                    continue
+                if issued.get("template") != self.template:
+                    continue
+                # One certificate per row, and one row per certificate
+                issue_date = issued.get("context", {}).get("issue_date")
+                keys = [wanted.get((name, issue_date)), wanted.get((name, ""))]
+                key = next((key for key in keys if key is not None and key not in found), None)
+                if key is None or cert_no in self._seeded:
+                    continue
+                self._seeded.add(cert_no)
+                found[key] = {"certificate_number": cert_no, "row_hash": None, "url": url, "render_context": stored}
+        if found:
+            logger.info(f"Incremental re-issue: {len(found)} row(s) matched to certificates issued before")
+        return found
+
+    def issued(self, key, cert_no, row_hash):
+        """Remembers the certificate a row got (written in chunks, see flush)"""
+        self._pending.append((key, cert_no, row_hash))
+        if len(self._pending) >= DB_WRITE_CHUNK_ROWS:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            executemany_chunked(
+                self.db_path,
+                "INSERT OR REPLACE INTO certificate_issues (issue_key, certificate_number, row_hash) VALUES (?, ?, ?)",
+                self._pending
+            )
+            self._pending = []
+
+    def summary(self):
+        return f"{self.counts['new']} new, {self.counts['changed']} changed, {self.counts['unchanged']} unchanged"
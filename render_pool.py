@@ -0,0 +1,404 @@
+import os
+import re
+import time
+import atexit
+import queue
+import pickle
+import itertools
+import threading
+import traceback
+import logging
+import multiprocessing
+from concurrent.futures import Future
+from asset_cache import get_asset_cache
+from compiled_cache import get_stylesheet
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# ---------------- POOL CONFIG ----------------
+# Explicit worker count (0 = render inline in the calling thread)
+RENDER_WORKERS = os.getenv("RENDER_WORKERS")
+# Total memory the render workers may use together
+RENDER_MEMORY_BUDGET_MB = int(os.getenv("RENDER_MEMORY_BUDGET_MB", "400"))
+# A worker is recycled once its RSS passes this ceiling ...
+RENDER_WORKER_RSS_MB = int(os.getenv("RENDER_WORKER_RSS_MB", "200"))
+# ... or after it has rendered this many documents
+RENDER_WORKER_MAX_DOCS = int(os.getenv("RENDER_WORKER_MAX_DOCS", "50"))
+# Import WeasyPrint as soon as a worker starts instead of on its first
+# document (new and recycled workers are warm before work reaches them)
+RENDER_WORKER_PRELOAD = os.getenv("RENDER_WORKER_PRELOAD", "1") == "1"
+# Rows laid out together as one multi-page document in batch render mode
+BATCH_CHUNK_SIZE = max(1, int(os.getenv("BATCH_CHUNK_SIZE", "20")))
+# Longest wait for one render result; a task lost with its worker fails
+# instead of hanging the batch or request waiting for it
+RENDER_TIMEOUT_SECONDS = float(os.getenv("RENDER_TIMEOUT_SECONDS", "300"))
+
+BODY_RE = re.compile(r"<body[^>]*>(.*?)</body>", re.IGNORECASE | re.DOTALL)
+
+# Each certificate on its own page; the templates center a single page with flex
+BATCH_PAGE_CSS = """
+body { display: block !important; }
+.certificate-page { break-after: page; }
+.certificate-page:last-child { break-after: auto; }
+"""
+
+
+def current_rss_mb():
+    """Resident memory of the current process in MB"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        # Non-Linux fallback: peak RSS is the best we have
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if os.uname().sysname == "Darwin" else peak / 1024
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def default_pool_size():
+    """Cores available, capped by how many workers fit in the memory budget"""
+    if RENDER_WORKERS is not None and RENDER_WORKERS.strip() != "":
+        return max(0, int(RENDER_WORKERS))
+    by_memory = max(1, RENDER_MEMORY_BUDGET_MB // max(1, RENDER_WORKER_RSS_MB))
+    return max(1, min(available_cores(), by_memory))
+
+
+# ---------------- RENDER TASKS (run inside workers) ----------------
+def write_pdf(html, base_url, pdf_path, css_text=None):
+    """
+    Renders one HTML document to pdf_path (or returns the PDF bytes when
+    pdf_path is None), with static assets from the cache.
+    css_text is the page stylesheet split out of the HTML; it is parsed once
+    per worker and reused for every following document.
+    """
+    from weasyprint import HTML
+    assets = get_asset_cache()
+    options = {"cache": assets.image_cache}
+    if css_text:
+        css, font_config = get_stylesheet(css_text, base_url, assets.url_fetcher)
+        options.update(stylesheets=[css], font_config=font_config)
+    pdf = HTML(string=html, base_url=base_url, url_fetcher=assets.url_fetcher).write_pdf(pdf_path, **options)
+    return pdf_path if pdf_path else pdf
+
+
+def combine_pages(htmls):
+    """One HTML document with the body of every certificate as a separate page"""
+    first = htmls[0]
+    match = BODY_RE.search(first)
+    if not match:
+        raise ValueError("Certificate HTML has no <body>")
+    pages = []
+    for html in htmls:
+        body = BODY_RE.search(html)
+        pages.append(f'<div class="certificate-page">{body.group(1) if body else html}</div>')
+    return first[:match.start(1)] + "\n".join(pages) + first[match.end(1):]
+
+
+_batch_css = None
+
+
+def write_pdf_batch(htmls, base_url, pdf_paths, css_text=None, combined=False):
+    """
+    Lays out several certificates in a single WeasyPrint document.
+    combined: the whole document goes to pdf_paths[0];
+    otherwise every page is written to its own file in pdf_paths.
+    Without pdf_paths the PDF bytes are returned in the same layout.
+    """
+    global _batch_css
+    from weasyprint import HTML, CSS
+    assets = get_asset_cache()
+    if _batch_css is None:
+        _batch_css = CSS(string=BATCH_PAGE_CSS)
+
+    options = {"cache": assets.image_cache}
+    stylesheets = []
+    if css_text:
+        css, font_config = get_stylesheet(css_text, base_url, assets.url_fetcher)
+        stylesheets.append(css)
+        options["font_config"] = font_config
+    stylesheets.append(_batch_css)
+
+    document = HTML(string=combine_pages(htmls), base_url=base_url, url_fetcher=assets.url_fetcher).render(
+        stylesheets=stylesheets, **options
+    )
+    if combined:
+        if pdf_paths:
+            document.write_pdf(pdf_paths[0])
+            return pdf_paths
+        return [document.write_pdf()]
+
+    targets = pdf_paths or [None] * len(htmls)
+    if len(document.pages) != len(htmls):
+        # A certificate overflowed onto a second page: pages no longer map to rows
+        logger.warning(f"Batch of {len(htmls)} rendered {len(document.pages)} pages, rendering rows one by one")
+        return [write_pdf(html, base_url, target, css_text) for html, target in zip(htmls, targets)]
+
+    pdfs = [document.copy([page]).write_pdf(target) for page, target in zip(document.pages, targets)]
+    return pdf_paths or pdfs
+
+
+def merge_pdfs(pdfs, output_path):
+    """Concatenates PDFs (bytes) into output_path"""
+    import io
+    from pypdf import PdfWriter
+    writer = PdfWriter()
+    for pdf in pdfs:
+        writer.append(io.BytesIO(pdf))
+    with open(output_path, "wb") as f:
+        writer.write(f)
+    return output_path
+
+
+_pdfium_lock = threading.Lock()
+
+
+def pdf_to_png(pdf, width):
+    """First page of a PDF as a PNG thumbnail width pixels wide (needs pypdfium2)"""
+    import io
+    import pypdfium2
+    # PDFium is not thread-safe (the pool renders inline with RENDER_WORKERS=0)
+    with _pdfium_lock:
+        document = pypdfium2.PdfDocument(pdf)
+        try:
+            page = document[0]
+            image = page.render(scale=width / page.get_width()).to_pil()
+        finally:
+            document.close()
+    out = io.BytesIO()
+    image.save(out, "PNG", optimize=True)
+    return out.getvalue()
+
+
+def _worker_main(task_queue, result_queue, current, max_docs, rss_limit_mb):
+    pid = os.getpid()
+    if RENDER_WORKER_PRELOAD:
+        try:
+            import weasyprint  # noqa: F401
+        except Exception as e:
+            logger.warning(f"Render worker {pid} could not preload WeasyPrint: {e}")
+    rendered = 0
+    reason = "shutdown"
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, payload = task
+        # Shared memory, written at once: the parent knows the task even if
+        # this worker dies before "start" is through the result queue
+        current.value = task_id
+        result_queue.put(("start", task_id, pid))
+        try:
+            fn, args, kwargs = pickle.loads(payload)
+            started = time.perf_counter()
+            result = fn(*args, **kwargs)
+            # Render time without the queue wait, recorded by the parent
+            result_queue.put(("done", task_id, (result, fn.__name__, time.perf_counter() - started)))
+        except Exception:
+            result_queue.put(("error", task_id, traceback.format_exc()))
+        current.value = -1
+        rendered += 1
+        result_queue.put(("stats", pid, get_asset_cache().stats()))
+
+        # Recycle instead of letting WeasyPrint memory pile up
+        if rendered >= max_docs:
+            reason = f"rendered {rendered} documents"
+            break
+        rss = current_rss_mb()
+        if rss > rss_limit_mb:
+            reason = f"RSS {rss:.0f} MB over {rss_limit_mb} MB"
+            break
+    result_queue.put(("exit", pid, reason))
+
+
+# ---------------- POOL ----------------
+class RenderPool:
+    """
+    Spreads render tasks across worker processes.
+    Workers are recycled after max_docs documents or past an RSS ceiling and
+    replaced automatically; a task lost with a crashed worker fails its future
+    (also when the worker died before reporting that it took the task).
+    """
+
+    def __init__(self, workers=None, max_docs=RENDER_WORKER_MAX_DOCS, rss_limit_mb=RENDER_WORKER_RSS_MB):
+        self.size = default_pool_size() if workers is None else workers
+        self.max_docs = max_docs
+        self.rss_limit_mb = rss_limit_mb
+        self._ctx = multiprocessing.get_context("spawn")
+        self._task_queue = self._ctx.Queue()
+        self._result_queue = self._ctx.Queue()
+        self._futures = {}
+        self._in_flight = {}  # pid -> task_id
+        self._processes = {}
+        self._current = {}  # pid -> shared task id the worker is on (-1 = none)
+        self._crashed = {}  # pid -> exit code of workers that died
+        self._asset_stats = {}  # pid -> latest asset cache counters of that worker
+        self._retired_asset_stats = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+
+        if self.size > 0:
+            for _ in range(self.size):
+                self._spawn()
+            threading.Thread(target=self._collect_results, name="render-results", daemon=True).start()
+            threading.Thread(target=self._monitor, name="render-monitor", daemon=True).start()
+        logger.info(f"Render pool started with {self.size} worker process(es)")
+
+    def _spawn(self):
+        current = self._ctx.Value("q", -1, lock=False)
+        p = self._ctx.Process(
+            target=_worker_main,
+            args=(self._task_queue, self._result_queue, current, self.max_docs, self.rss_limit_mb),
+            daemon=True
+        )
+        p.start()
+        self._processes[p.pid] = p
+        self._current[p.pid] = current
+
+    def submit(self, fn, *args, **kwargs):
+        """Queues fn(*args, **kwargs) on a worker and returns a Future"""
+        future = Future()
+        if self.size == 0:
+            try:
+                started = time.perf_counter()
+                result = fn(*args, **kwargs)
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage=fn.__name__)
+                future.set_result(result)
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        task_id = next(self._ids)
+        with self._lock:
+            self._futures[task_id] = future
+        # Pickled here so a worker can always read the task id, even when
+        # the task itself cannot be loaded there (reported as its error)
+        self._task_queue.put((task_id, pickle.dumps((fn, args, kwargs))))
+        return future
+
+    def _collect_results(self):
+        while not self._closed:
+            try:
+                kind, key, payload = self._result_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+
+            with self._lock:
+                if kind == "start":
+                    if payload in self._crashed:
+                        self._fail_crashed(key, payload)
+                    else:
+                        self._in_flight[payload] = key
+                    continue
+                if kind == "stats":
+                    self._asset_stats[key] = payload
+                    continue
+                if kind == "exit":
+                    logger.info(f"Render worker {key} recycled: {payload}")
+                    self._retire_stats(key)
+                    continue
+                future = self._futures.pop(key, None)
+                for pid, task_id in list(self._in_flight.items()):
+                    if task_id == key:
+                        del self._in_flight[pid]
+
+            if future is None:
+                continue
+            if kind == "done":
+                result, task_name, seconds = payload
+                STAGE_SECONDS.observe(seconds, stage=task_name)
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(f"Render failed in worker:\n{payload}"))
+
+    def _retire_stats(self, pid):
+        stats = self._asset_stats.pop(pid, None) or {}
+        for name in ("hits", "misses", "evictions", "invalidations"):
+            self._retired_asset_stats[name] = self._retired_asset_stats.get(name, 0) + stats.get(name, 0)
+
+    def worker_pids(self):
+        """PIDs of the live worker processes"""
+        with self._lock:
+            return list(self._processes)
+
+    def asset_cache_stats(self):
+        """Asset cache hit/miss counters summed over all workers, past and present"""
+        with self._lock:
+            totals = {name: self._retired_asset_stats.get(name, 0)
+                      for name in ("hits", "misses", "evictions", "invalidations")}
+            worker_stats = list(self._asset_stats.values())
+        if self.size == 0:
+            worker_stats = [get_asset_cache().stats()]
+        for stats in worker_stats:
+            for name in totals:
+                totals[name] += stats.get(name, 0)
+        lookups = totals["hits"] + totals["misses"]
+        totals["hit_rate"] = round(totals["hits"] / lookups, 3) if lookups else None
+        return totals
+
+    def _fail_crashed(self, task_id, pid):
+        future = self._futures.pop(task_id, None)
+        if future is not None:
+            exitcode = self._crashed[pid]
+            logger.error(f"Render worker {pid} died (exit code {exitcode}) during task {task_id}")
+            future.set_exception(RuntimeError(f"Render worker died with exit code {exitcode}"))
+
+    def _monitor(self):
+        while not self._closed:
+            time.sleep(0.5)
+            with self._lock:
+                for pid, p in list(self._processes.items()):
+                    if p.is_alive():
+                        continue
+                    p.join()
+                    del self._processes[pid]
+                    current = self._current.pop(pid)
+                    # A worker that died mid-task (e.g. OOM killed) takes its task with it.
+                    # After a clean exit the last result is still on its way through the queue.
+                    if p.exitcode != 0:
+                        self._retire_stats(pid)
+                        self._crashed[pid] = p.exitcode
+                        task_id = self._in_flight.pop(pid, None)
+                        if task_id is None and current.value >= 0:
+                            task_id = current.value
+                        if task_id is not None:
+                            self._fail_crashed(task_id, pid)
+                if not self._closed:
+                    while len(self._processes) < self.size:
+                        self._spawn()
+
+    def shutdown(self):
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._processes:
+            self._task_queue.put(None)
+        for p in list(self._processes.values()):
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    """Process-wide render pool, created on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RenderPool()
+            atexit.register(_pool.shutdown)
+        return _pool
@@ -0,0 +1,348 @@
+import re
+from datetime import datetime
+
+# pandas is imported inside the functions that use it: importing the app
+# stays fast and the first sheet pays for it instead (see startup.py)
+
+# ---------------- COLUMN ROLES ----------------
+NAME_COLUMNS = ["student_name", "full_name", "name", "full_name_with_initial", "studentname"]
+ISSUE_DATE_COLUMNS = ["issue_date", "date"]
+RANGE_DATE_COLUMNS = ["start_date", "end_date", "joining_date", "ending_date"]
+START_COLUMNS = ["start_date", "joining_date", "start"]
+END_COLUMNS = ["end_date", "ending_date", "end"]
+
+# Name length -> font size, longest first (names must fit on one line)
+NAME_FONT_SIZES = [(25, "28px"), (20, "34px"), (15, "40px")]
+DEFAULT_NAME_FONT_SIZE = "52px"
+# Names longer than this may not fit on one line even at the smallest size
+NAME_FIT_MAX_CHARS = 32
+
+
+def get_font_size(name):
+    """Calculate dynamic font size based on name length.
+    More aggressive scaling to ensure names fit on one line.
+    """
+    length = len(str(name))
+    for min_length, size in NAME_FONT_SIZES:
+        if length > min_length:
+            return size
+    return DEFAULT_NAME_FONT_SIZE
+
+
+def certificate_title(rendered_body, cert_type_preference, industrial_visit_hint=False):
+    """INTERNSHIP or INDUSTRIAL VISIT: as chosen, otherwise detected from the row / rendered body"""
+    if cert_type_preference == "internship":
+        return "INTERNSHIP"
+    if cert_type_preference == "industrial_visit":
+        return "INDUSTRIAL VISIT"
+    # Auto-detect logic (subject / program were checked per column)
+    if industrial_visit_hint or "industrial visit" in rendered_body.lower():
+        return "INDUSTRIAL VISIT"
+    return "INTERNSHIP"
+
+
+def format_semester(semester):
+    import pandas as pd
+    if semester is None or pd.isna(semester):
+        return ""
+
+    semester = str(semester).strip()
+    if not semester:
+        return ""
+
+    match = re.match(r"^(\d+)(st|nd|rd|th)$", semester, re.IGNORECASE)
+    if match:
+        return f"{match.group(1)}<sup>{match.group(2)}</sup>"
+
+    if semester.isdigit():
+        sem = int(semester)
+        suffix = {1: "st", 2: "nd", 3: "rd"}.get(sem % 10, "th")
+        return f"{sem}{suffix}"
+
+    return semester
+
+
+def _first_column(columns, candidates):
+    return next((c for c in candidates if c in columns), None)
+
+
+def resolve_column_roles(columns):
+    """Which sheet column plays which role; resolved once per sheet"""
+    columns = list(columns)
+    return {
+        "name": _first_column(columns, NAME_COLUMNS),
+        # Handle "Register Numbe" or "Register Number" or "Reg ID"
+        "reg": next((c for c in columns if "register" in c or "reg" in c), None),
+        "issue_date": _first_column(columns, ISSUE_DATE_COLUMNS),
+        "start": _first_column(columns, START_COLUMNS),
+        "end": _first_column(columns, END_COLUMNS),
+        "hours": "internship_hours" if "internship_hours" in columns else None,
+        "semester": "semester" if "semester" in columns else None,
+        "subject": "subject" if "subject" in columns else None,
+        "department": "department" if "department" in columns else None,
+        "place": "place" if "place" in columns else None,
+    }
+
+
+# ---------------- VECTORIZED FORMATTING ----------------
+def _text(series):
+    """
+    Column as stripped strings, NaN / None as empty string. Timestamps
+    read as str() gives them (2024-01-31 00:00:00), as the row-wise path
+    did; only the date columns are formatted as dates.
+    """
+    import pandas as pd
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.map(lambda value: "" if pd.isna(value) else str(value)).astype(object)
+    return series.where(series.notna(), "").astype(str).str.strip()
+
+
+def _date_text(series):
+    import pandas as pd
+    dates = pd.to_datetime(series, errors="coerce")
+    return dates.dt.strftime("%d-%m-%Y").fillna("")
+
+
+def _internship_duration(df, roles):
+    import pandas as pd
+    duration = pd.Series("", index=df.index, dtype=object)
+
+    if roles["start"] and roles["end"]:
+        start = _date_text(df[roles["start"]])
+        end = _date_text(df[roles["end"]])
+        both = start.ne("") & end.ne("")
+        duration = duration.mask(both, "from " + start + " to " + end)
+
+    if roles["hours"]:
+        hours = pd.to_numeric(df[roles["hours"]], errors="coerce")
+        has_hours = hours.notna()
+        hours_text = hours.where(has_hours, 0).astype(int).astype(str) + " Hours"
+        duration = duration.mask(has_hours, hours_text)
+
+    return duration
+
+
+def _semester(series):
+    # Few distinct values per sheet: format each once
+    mapping = {value: format_semester(value) for value in series.dropna().unique()}
+    return series.map(mapping).fillna("")
+
+
+def _mentions_industrial_visit(series):
+    return series.astype(str).str.lower().str.contains("industrial visit", regex=False)
+
+
+def _row_names(df):
+    """
+    Name of every row as the row-wise path picked it: the first name
+    column whose cell is set, per row (a blank string or 0 falls through
+    to the next column, an empty cell does not). None without a name column.
+    """
+    names = None
+    for col in NAME_COLUMNS:
+        # A missing column is skipped, like row.get() returning None
+        if col in df.columns:
+            names = df[col] if names is None else names.where(names.map(bool), df[col])
+    return names
+
+
+def build_context_columns(df, roles=None):
+    """
+    All per-row template values of a sheet, computed column-wise.
+    Returns (context, fields), both {name: Series}: template variables for
+    the user's content and the fixed fields of the certificate page.
+    """
+    import numpy as np
+    import pandas as pd
+    roles = roles or resolve_column_roles(df.columns)
+    context = {}
+    today = datetime.now().strftime("%d-%m-%Y")
+
+    if roles["issue_date"]:
+        sheet_issue_date = _date_text(df[roles["issue_date"]])
+    else:
+        sheet_issue_date = pd.Series("", index=df.index, dtype=object)
+    issue_date = sheet_issue_date.replace("", today)
+
+    # Build dynamic context from ALL Excel columns
+    duration = _internship_duration(df, roles)
+    for col in df.columns:
+        if col == "semester":
+            context[col] = _semester(df[col])
+        elif col == "internship_duration":
+            context[col] = duration
+        elif col in RANGE_DATE_COLUMNS:
+            context[col] = _date_text(df[col])
+        elif col == "issue_date":
+            context[col] = issue_date
+        else:
+            context[col] = _text(df[col])
+
+    # Smart Mappings for user template (Support truncated names too)
+    if "course_name" not in context and "subject" in context:
+        context["course_name"] = context["subject"]
+    if "internship_program" not in context:
+        if "subject" in context:
+            program = context["subject"]
+            if "department" in context:
+                program = program.mask(program.eq(""), context["department"])
+            context["internship_program"] = program
+        else:
+            context["internship_program"] = context.get("department", pd.Series("", index=df.index, dtype=object))
+
+    if roles["reg"]:
+        reg = context[roles["reg"]]
+        context["reg_id"] = reg
+        context["register_number"] = reg
+
+    if "internship_duration" not in context:
+        context["internship_duration"] = duration
+
+    raw_names = _row_names(df)
+    if raw_names is None:
+        raw_names = pd.Series("", index=df.index, dtype=object)
+    names = _text(raw_names)
+    # Sized on the raw cell, like get_font_size() on the row value
+    lengths = raw_names.astype(str).str.len().to_numpy()
+    font_size = np.select(
+        [lengths > min_length for min_length, _ in NAME_FONT_SIZES],
+        [size for _, size in NAME_FONT_SIZES],
+        DEFAULT_NAME_FONT_SIZE
+    )
+
+    # Title hint for auto-detection; the rendered body is checked per row
+    industrial_visit = _mentions_industrial_visit(context["internship_program"])
+    if "subject" in context:
+        industrial_visit |= _mentions_industrial_visit(context["subject"])
+
+    fields = {
+        "student_name": names,
+        "student_name_style": "font-size: " + pd.Series(font_size, index=df.index) + ";",
+        "place": _text(df[roles["place"]]) if roles["place"] else pd.Series("", index=df.index, dtype=object),
+        "issue_date": issue_date,
+        # Without today's fallback: "" when the sheet gives no date
+        "sheet_issue_date": sheet_issue_date,
+        "industrial_visit_hint": industrial_visit,
+    }
+    return context, fields
+
+
+def iter_row_contexts(df, roles=None):
+    """
+    Yields (row_index, template_context, fields) for every row.
+    Only plain Python lists are walked here, no per-row pandas access.
+    """
+    roles = roles or resolve_column_roles(df.columns)
+    context, fields = build_context_columns(df, roles)
+    # reg_id / register_number are only set for rows that have a register number
+    reg_aliases = [c for c in ("reg_id", "register_number") if c not in df.columns] if roles["reg"] else []
+    context_cols = list(context)
+    field_cols = list(fields)
+    context_values = [context[c].tolist() for c in context_cols]
+    field_values = [fields[c].tolist() for c in field_cols]
+
+    for i, (ctx_row, field_row) in enumerate(zip(zip(*context_values), zip(*field_values))):
+        template_context = dict(zip(context_cols, ctx_row))
+        if reg_aliases and not template_context[roles["reg"]]:
+            for alias in reg_aliases:
+                del template_context[alias]
+        yield i, template_context, dict(zip(field_cols, field_row))
+
+
+# ---------------- SINGLE RECORDS ----------------
+# Accepted spellings of dates in records that do not come from a sheet (ISO first, then day first)
+RECORD_DATE_FORMATS = ["%Y-%m-%d", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y"]
+
+
+def _text_value(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    return str(value).strip()
+
+
+def _parse_date(value):
+    """datetime of a date given as datetime or text, None when it does not parse"""
+    if isinstance(value, datetime):
+        return value
+    text = _text_value(value)
+    for fmt in RECORD_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _date_value(value):
+    """dd-mm-YYYY of a date given as datetime or text, empty when it does not parse"""
+    parsed = _parse_date(value)
+    return parsed.strftime("%d-%m-%Y") if parsed else ""
+
+
+def record_context(record, roles=None):
+    """
+    (template_context, fields) of one row given as a dict of normalized
+    column names, without pandas: the same values build_context_columns
+    computes for a sheet row.
+    """
+    roles = roles or resolve_column_roles(record)
+    context = {}
+    today = datetime.now().strftime("%d-%m-%Y")
+    sheet_issue_date = _date_value(record[roles["issue_date"]]) if roles["issue_date"] else ""
+    issue_date = sheet_issue_date or today
+
+    duration = ""
+    if roles["start"] and roles["end"]:
+        start = _date_value(record[roles["start"]])
+        end = _date_value(record[roles["end"]])
+        if start and end:
+            duration = f"from {start} to {end}"
+    if roles["hours"]:
+        try:
+            duration = f"{int(float(record[roles['hours']]))} Hours"
+        except (TypeError, ValueError):
+            pass
+
+    for col, value in record.items():
+        if col == "semester":
+            context[col] = format_semester(value)
+        elif col == "internship_duration":
+            context[col] = duration
+        elif col in RANGE_DATE_COLUMNS:
+            context[col] = _date_value(value)
+        elif col == "date":
+            # A parsed date column that is not a range date: str() of the timestamp, as in a sheet
+            parsed = _parse_date(value)
+            context[col] = str(parsed) if parsed else ""
+        elif col == "issue_date":
+            context[col] = issue_date
+        else:
+            context[col] = _text_value(value)
+
+    if "course_name" not in context and "subject" in context:
+        context["course_name"] = context["subject"]
+    if "internship_program" not in context:
+        context["internship_program"] = context.get("subject") or context.get("department", "")
+    if roles["reg"] and context[roles["reg"]]:
+        context["reg_id"] = context[roles["reg"]]
+        context["register_number"] = context[roles["reg"]]
+    if "internship_duration" not in context:
+        context["internship_duration"] = duration
+
+    raw_name = None
+    for col in NAME_COLUMNS:
+        raw_name = record.get(col)
+        if raw_name:
+            break
+    name = _text_value(raw_name)
+    industrial_visit = "industrial visit" in context["internship_program"].lower() or \
+        "industrial visit" in context.get("subject", "").lower()
+    fields = {
+        "student_name": name,
+        "student_name_style": f"font-size: {get_font_size(raw_name)};",
+        "place": _text_value(record[roles["place"]]) if roles["place"] else "",
+        "issue_date": issue_date,
+        "sheet_issue_date": sheet_issue_date,
+        "industrial_visit_hint": industrial_visit,
+    }
+    return context, fields
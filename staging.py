@@ -0,0 +1,226 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+
+from jinja2 import Environment, meta
+
+from ingest import SheetReader, iter_sheet_frames
+from sheet_prep import resolve_column_roles, build_context_columns
+
+logger = logging.getLogger(__name__)
+
+# Staged sheets not used for this long are removed
+STAGING_TTL_SECONDS = float(os.getenv("STAGING_TTL_SECONDS", "3600"))
+# Disk bound for all staged sheets; least recently used ones are evicted first
+STAGING_MAX_MB = float(os.getenv("STAGING_MAX_MB", "200"))
+
+META_FILE = "meta.json"
+TOKEN_RE = re.compile(r"^[0-9a-f]{64}$")
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def _sheet_hash(stream, filename):
+    """Content hash of an upload (the extension decides how it is parsed)"""
+    digest = hashlib.sha256(os.path.splitext(filename or "")[1].lower().encode())
+    stream.seek(0)
+    for block in iter(lambda: stream.read(HASH_BLOCK_SIZE), b""):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def _dir_size(path):
+    total = 0
+    for entry in os.scandir(path):
+        if entry.is_file():
+            total += entry.stat().st_size
+    return total
+
+
+class SheetStaging:
+    """
+    Uploaded sheets parsed once and kept on disk by content hash.
+    Each staged sheet is a directory of gzip-pickled DataFrame chunks
+    (already cleaned, as iter_sheet_frames yields them) plus meta.json.
+    The hash is the token handed to the client for preview / generation.
+    """
+
+    def __init__(self, root, ttl=STAGING_TTL_SECONDS, max_bytes=int(STAGING_MAX_MB * 1024 * 1024)):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, token):
+        if not token or not TOKEN_RE.match(token):
+            return None
+        return os.path.join(self.root, token)
+
+    def stage(self, source, filename=None):
+        """Parses the upload unless the same sheet is already staged; returns its meta"""
+        filename = filename or getattr(source, "filename", "")
+        stream = getattr(source, "stream", source)
+        token = _sheet_hash(stream, filename)
+
+        existing = self.get(token)
+        if existing:
+            logger.info(f"Sheet {token[:12]} already staged")
+            return existing
+
+        os.makedirs(self.root, exist_ok=True)
+        tmp_dir = os.path.join(self.root, f".{token}.{os.getpid()}.{threading.get_ident()}")
+        os.makedirs(tmp_dir)
+        try:
+            row_count = 0
+            chunks = 0
+            with SheetReader(stream, filename) as reader:
+                for df in iter_sheet_frames(reader):
+                    df.to_pickle(os.path.join(tmp_dir, f"chunk_{chunks:05d}.pkl.gz"), compression="gzip")
+                    chunks += 1
+                    row_count += len(df)
+                info = {
+                    "token": token,
+                    "filename": filename,
+                    "raw_columns": reader.raw_columns,
+                    "columns": reader.columns,
+                    "row_count": row_count,
+                    "chunks": chunks,
+                    "created_at": time.time(),
+                }
+            with open(os.path.join(tmp_dir, META_FILE), "w") as f:
+                json.dump(info, f)
+
+            self._install(tmp_dir, token)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        logger.info(f"Staged sheet {token[:12]}: {row_count} rows in {chunks} chunk(s)")
+        self.evict(keep=token)
+        return self.get(token)
+
+    def _install(self, tmp_dir, token):
+        """Moves a freshly parsed sheet into place"""
+        path = os.path.join(self.root, token)
+        try:
+            os.rename(tmp_dir, path)
+            return
+        except OSError:
+            pass
+        if self.get(token):
+            # Staged concurrently by another request: keep that copy
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        # An expired copy that was not evicted yet: replace it
+        with self._lock:
+            shutil.rmtree(path, ignore_errors=True)
+            try:
+                os.rename(tmp_dir, path)
+            except OSError:
+                # Replaced concurrently by another request: keep that copy
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def get(self, token):
+        """Meta of a staged sheet (and marks it as used), or None when unknown / expired"""
+        path = self._path(token)
+        if not path:
+            return None
+        meta_path = os.path.join(path, META_FILE)
+        try:
+            if time.time() - os.path.getmtime(meta_path) > self.ttl:
+                return None
+            with open(meta_path) as f:
+                info = json.load(f)
+            os.utime(meta_path)
+        except OSError:
+            return None
+        info["expires_in"] = self.ttl
+        return info
+
+    def iter_frames(self, token):
+        """Cleaned DataFrame chunks of a staged sheet, in row order"""
+        path = self._path(token)
+        info = self.get(token)
+        if not info:
+            raise KeyError(f"Staged sheet {token} not found or expired")
+        import pandas as pd
+        for n in range(info["chunks"]):
+            yield pd.read_pickle(os.path.join(path, f"chunk_{n:05d}.pkl.gz"), compression="gzip")
+
+    def sample(self, token, rows=5):
+        """First rows of a staged sheet as a DataFrame (None when empty)"""
+        for df in self.iter_frames(token):
+            return df.head(rows)
+        return None
+
+    def evict(self, keep=None):
+        """
+        Removes expired sheets, then the least recently used ones above the
+        disk bound (except keep, the sheet just staged)
+        """
+        with self._lock:
+            if not os.path.isdir(self.root):
+                return
+            now = time.time()
+            entries = []
+            for entry in os.scandir(self.root):
+                if not entry.is_dir() or not TOKEN_RE.match(entry.name):
+                    continue
+                try:
+                    used_at = os.path.getmtime(os.path.join(entry.path, META_FILE))
+                    size = _dir_size(entry.path)
+                except OSError:
+                    continue
+                if now - used_at > self.ttl:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    logger.info(f"Staged sheet {entry.name[:12]} expired")
+                    continue
+                entries.append((used_at, size, entry.path, entry.name))
+
+            total = sum(size for _, size, _, _ in entries)
+            for used_at, size, path, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if name == keep:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                logger.info(f"Staged sheet {name[:12]} evicted (disk bound)")
+
+
+# ---------------- VALIDATION ----------------
+def validate_staged(staging, token, content=None):
+    """
+    Problems that would make generation fail or produce empty fields:
+    returns {"errors": [...], "warnings": [...]}.
+    """
+    info = staging.get(token)
+    errors = []
+    warnings = []
+
+    roles = resolve_column_roles(info["columns"])
+    if not roles["name"]:
+        errors.append("No student name column found (expected one of: Name, Student Name, Full Name).")
+    if not info["row_count"]:
+        errors.append("No valid data rows found. Please check column headings.")
+    if not roles["reg"]:
+        warnings.append("No register number column found.")
+
+    sample = staging.sample(token)
+    if content and sample is not None:
+        # Placeholders of the body that no column (or derived value) provides
+        context, _ = build_context_columns(sample, roles)
+        try:
+            placeholders = meta.find_undeclared_variables(Environment().parse(content))
+        except Exception as e:
+            errors.append(f"Certificate content is not a valid template: {e}")
+        else:
+            for name in sorted(placeholders - set(context)):
+                warnings.append(f"Placeholder {{{{ {name} }}}} has no matching column and will be empty.")
+
+    return {"errors": errors, "warnings": warnings}
@@ -0,0 +1,166 @@
+"""
+Cold start helpers: timings of the startup phases, the background warm-up
+and gunicorn preload support.
+
+    python startup.py          # import app and report where the time went
+    python startup.py --top 30 # ... listing the 30 slowest module imports
+"""
+import os
+import re
+import sys
+import time
+import logging
+import argparse
+import threading
+import subprocess
+from contextlib import contextmanager
+
+from metrics import STARTUP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Log the time of every startup phase once the app is imported
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "0") == "1"
+# Render each page template once in the background after startup, so the
+# first request does not pay for the WeasyPrint import and font setup
+WARMUP_RENDER = os.getenv("WARMUP_RENDER", "0") == "1"
+# Page templates the warm-up renders
+WARMUP_TEMPLATES = [name.strip() for name in os.getenv("WARMUP_TEMPLATES", "certificate.html,Certificate_Acadeno.html").split(",") if name.strip()]
+# Set by gunicorn.conf.py when the app is preloaded in the gunicorn master:
+# background threads are started in each worker after the fork instead
+PRELOADED = os.getenv("GUNICORN_PRELOADED", "0") == "1"
+
+_started = time.perf_counter()
+_last = _started
+_lock = threading.Lock()
+PHASES = []  # [(phase, seconds)]
+
+
+# ---------------- PHASES ----------------
+def _record(name, seconds):
+    with _lock:
+        PHASES.append((name, seconds))
+    STARTUP_SECONDS.set(seconds, phase=name)
+
+
+def mark(name):
+    """Records the time since the previous mark (or since this module was imported) as phase name"""
+    global _last
+    now = time.perf_counter()
+    _record(name, now - _last)
+    _last = now
+
+
+@contextmanager
+def phase(name):
+    """Records the time spent in the block as phase name"""
+    global _last
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _last = time.perf_counter()
+        _record(name, _last - started)
+
+
+def report():
+    """Logs the startup phases (STARTUP_PROFILE=1 only)"""
+    if not STARTUP_PROFILE:
+        return
+    with _lock:
+        phases = list(PHASES)
+    lines = [f"  {name:<32} {seconds * 1000:8.1f} ms" for name, seconds in phases]
+    lines.append(f"  {'total':<32} {(time.perf_counter() - _started) * 1000:8.1f} ms")
+    logger.info(f"Startup profile (pid {os.getpid()}):\n" + "\n".join(lines))
+
+
+# ---------------- WARM-UP ----------------
+def warm_imports(with_weasyprint=False):
+    """
+    Imports the modules the routes load lazily. In the gunicorn master
+    (preload) they are then shared copy-on-write by every worker.
+    WeasyPrint is only worth it when rendering inline (RENDER_WORKERS=0);
+    the render workers import it themselves.
+    """
+    with phase("warm_imports"):
+        import pandas  # noqa: F401
+        import openpyxl  # noqa: F401
+        if with_weasyprint:
+            import weasyprint  # noqa: F401
+
+
+def start_warmup(render_fn, templates=None):
+    """Imports the lazy modules, then runs render_fn(template) for every warm-up template, in a background thread"""
+    templates = WARMUP_TEMPLATES if templates is None else templates
+
+    def run():
+        try:
+            warm_imports()
+        except Exception as e:
+            logger.warning(f"Warm-up imports failed: {e}")
+        for name in templates:
+            try:
+                with phase(f"warmup:{name}"):
+                    render_fn(name)
+            except Exception as e:
+                logger.warning(f"Warm-up render of {name} failed: {e}")
+        report()
+
+    thread = threading.Thread(target=run, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+# ---------------- IMPORT TIME REPORT ----------------
+IMPORTTIME_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_times(module="app"):
+    """
+    Runs `import module` with -X importtime in a fresh interpreter.
+    Returns ([(cumulative us, package)] of the modules it imports directly, other stderr lines).
+    """
+    env = dict(os.environ, STARTUP_PROFILE="1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+    packages = {}
+    children = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        cumulative_us, indent, name = int(match.group(2)), match.group(3), match.group(4)
+        # Children are listed before their parent, one level (2 spaces) deeper
+        if len(indent) == 3:
+            children.append((name.split(".")[0], cumulative_us))
+        elif len(indent) == 1:
+            if name == module:
+                for top, us in children:
+                    packages[top] = packages.get(top, 0) + us
+            children = []
+    startup_lines = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+    return sorted(((us, name) for name, us in packages.items()), reverse=True), startup_lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time and startup phases of the app")
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to list")
+    args = parser.parse_args()
+
+    packages, log_lines = import_times(args.module)
+    print(f"Slowest imports of `import {args.module}` (cumulative):")
+    for cumulative_us, name in packages[:args.top]:
+        print(f"  {name:<32} {cumulative_us / 1000:8.1f} ms")
+    profile = [line for line in log_lines if "Startup profile" in line or line.startswith("  ")]
+    if profile:
+        print()
+        print("\n".join(profile))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import os
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import UPLOADS, timed
+
+logger = logging.getLogger(__name__)
+
+# cloudinary | local | memory
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "cloudinary")
+# Where the local backend writes files, and the URL prefix they are served under
+STORAGE_LOCAL_DIR = os.getenv("STORAGE_LOCAL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "generated", "storage"))
+STORAGE_LOCAL_URL = os.getenv("STORAGE_LOCAL_URL", "/storage/")
+# Parallel uploads per batch; PDFs waiting for a free slot are bounded too
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", str(UPLOAD_CONCURRENCY * 4)))
+# Retries after a failed upload, waiting UPLOAD_BACKOFF_SECONDS * 2^attempt (plus jitter)
+UPLOAD_RETRIES = int(os.getenv("UPLOAD_RETRIES", "3"))
+UPLOAD_BACKOFF_SECONDS = float(os.getenv("UPLOAD_BACKOFF_SECONDS", "1"))
+
+
+# ---------------- BACKENDS ----------------
+class StorageBackend:
+    """upload(data, public_id) stores a PDF (bytes or file path) and returns its URL, raising on failure"""
+
+    name = "base"
+
+    def upload(self, data, public_id):
+        raise NotImplementedError
+
+
+class CloudinaryBackend(StorageBackend):
+    """Configured from the CLOUDINARY_* variables when first used (importing cloudinary is slow)"""
+
+    name = "cloudinary"
+
+    def __init__(self):
+        import cloudinary
+        cloudinary.config(
+            cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
+            api_key=os.getenv("CLOUDINARY_API_KEY"),
+            api_secret=os.getenv("CLOUDINARY_API_SECRET")
+        )
+
+    def upload(self, data, public_id):
+        import cloudinary.uploader
+        response = cloudinary.uploader.upload(data, public_id=public_id, resource_type="auto")
+        url = response.get("secure_url")
+        if not url:
+            raise RuntimeError(f"Cloudinary returned no URL: {response}")
+        return url
+
+
+def _read(data):
+    if isinstance(data, str):
+        with open(data, "rb") as f:
+            return f.read()
+    return data
+
+
+class LocalBackend(StorageBackend):
+    """Files under STORAGE_LOCAL_DIR (offline runs; served by the app)"""
+
+    name = "local"
+
+    def __init__(self, root=STORAGE_LOCAL_DIR, base_url=STORAGE_LOCAL_URL):
+        self.root = root
+        self.base_url = base_url
+
+    def upload(self, data, public_id):
+        os.makedirs(self.root, exist_ok=True)
+        name = f"{public_id}.pdf"
+        tmp_path = os.path.join(self.root, f".{name}.{threading.get_ident()}")
+        with open(tmp_path, "wb") as f:
+            f.write(_read(data))
+        os.replace(tmp_path, os.path.join(self.root, name))
+        return f"{self.base_url}{name}"
+
+
+class MemoryBackend(StorageBackend):
+    """Keeps uploads in a dict (tests)"""
+
+    name = "memory"
+
+    def __init__(self):
+        self.files = {}
+
+    def upload(self, data, public_id):
+        self.files[public_id] = _read(data)
+        return f"memory://{public_id}"
+
+
+BACKENDS = {
+    "cloudinary": CloudinaryBackend,
+    "local": LocalBackend,
+    "memory": MemoryBackend,
+}
+
+_backend = None
+
+
+def get_storage_backend():
+    global _backend
+    if _backend is None:
+        if STORAGE_BACKEND not in BACKENDS:
+            raise ValueError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}' (expected one of: {', '.join(BACKENDS)})")
+        _backend = BACKENDS[STORAGE_BACKEND]()
+        logger.info(f"Storage backend: {_backend.name}")
+    return _backend
+
+
+# ---------------- UPLOADS ----------------
+def upload_with_retries(data, public_id, backend=None, retries=UPLOAD_RETRIES, backoff=UPLOAD_BACKOFF_SECONDS):
+    """Uploads with exponential backoff; returns the URL, or None once every attempt failed"""
+    backend = backend or get_storage_backend()
+    for attempt in range(retries + 1):
+        try:
+            with timed("upload"):
+                url = backend.upload(data, public_id)
+            UPLOADS.inc(backend=backend.name, result="uploaded")
+            logger.info(f"Upload successful: {url}")
+            return url
+        except Exception as e:
+            if attempt == retries:
+                UPLOADS.inc(backend=backend.name, result="failed")
+                logger.error(f"Upload of {public_id} failed after {attempt + 1} attempt(s): {e}", exc_info=True)
+                return None
+            UPLOADS.inc(backend=backend.name, result="retried")
+            delay = backoff * (2 ** attempt) * (1 + random.random() / 2)
+            logger.warning(f"Upload of {public_id} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+class UploadStage:
+    """
+    Upload stage running alongside rendering: PDFs are uploaded as soon as
+    they are submitted, at most UPLOAD_CONCURRENCY at a time. submit() blocks
+    while UPLOAD_QUEUE_SIZE uploads are waiting, so memory stays bounded.
+    on_done(public_id, url) is called from the upload thread when each one
+    finishes (url is None when it failed).
+    """
+
+    def __init__(self, backend=None, concurrency=UPLOAD_CONCURRENCY, queue_size=UPLOAD_QUEUE_SIZE):
+        self.backend = backend or get_storage_backend()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="upload")
+        self._slots = threading.BoundedSemaphore(max(concurrency, queue_size))
+        self._lock = threading.Lock()
+        self.uploaded = 0
+        self.failed = 0
+
+    def _run(self, data, public_id, on_done):
+        try:
+            url = upload_with_retries(data, public_id, self.backend)
+            with self._lock:
+                if url:
+                    self.uploaded += 1
+                else:
+                    self.failed += 1
+            if on_done:
+                try:
+                    on_done(public_id, url)
+                except Exception as e:
+                    logger.error(f"Recording upload of {public_id} failed: {e}", exc_info=True)
+            return url
+        finally:
+            self._slots.release()
+
+    def submit(self, data, public_id, on_done=None):
+        self._slots.acquire()
+        try:
+            return self._executor.submit(self._run, data, public_id, on_done)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def close(self):
+        """Waits for every submitted upload"""
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
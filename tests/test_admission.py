@@ -0,0 +1,89 @@
+import time
+import threading
+
+import pytest
+
+import admission
+from admission import AdmissionController, Overloaded, SINGLE, BULK, BATCH
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+
+def _waiting(controller):
+    return sum(controller.stats()["waiting"].values())
+
+
+def test_waiters_are_served_by_priority_then_arrival():
+    controller = AdmissionController(max_renders=1, memory_mb=1000)
+    held = controller.acquire(SINGLE, renders=1)
+    granted = []
+
+    def wait(priority):
+        with controller.acquire(priority, renders=1):
+            granted.append(priority)
+
+    threads = []
+    for priority in (BATCH, BULK, SINGLE):
+        threads.append(threading.Thread(target=wait, args=(priority,)))
+        threads[-1].start()
+        _wait_for(lambda: _waiting(controller) == len(threads))
+
+    held.release()
+    for thread in threads:
+        thread.join(5)
+    assert granted == [SINGLE, BULK, BATCH]
+    assert controller.stats()["renders"] == 0
+
+
+def test_no_capacity_in_time_is_rejected_with_retry_after():
+    controller = AdmissionController(max_renders=1, memory_mb=1000)
+    with controller.acquire(BULK, renders=1):
+        with pytest.raises(Overloaded) as rejected:
+            controller.acquire(SINGLE, renders=1, timeout=0.05)
+    # The 429 carries Retry-After: the starting guess of how long a single render holds its slot
+    assert rejected.value.retry_after == 2
+    assert "retry in 2 seconds" in str(rejected.value)
+    assert controller.stats()["waiting"]["single"] == 0
+
+
+def test_full_wait_queue_is_rejected_straight_away():
+    controller = AdmissionController(max_renders=1, memory_mb=1000, max_waiting=1)
+    held = controller.acquire(BULK, renders=1)
+    waiter = threading.Thread(target=lambda: controller.acquire(BULK, renders=1, timeout=5).release())
+    waiter.start()
+    _wait_for(lambda: _waiting(controller) == 1)
+
+    started = time.monotonic()
+    with pytest.raises(Overloaded, match="Too many requests are waiting") as rejected:
+        controller.batch(timeout=5)
+    assert time.monotonic() - started < 1
+    assert rejected.value.retry_after == 60
+
+    held.release()
+    waiter.join(5)
+
+
+def test_retry_after_follows_how_long_capacity_is_held(monkeypatch):
+    monkeypatch.setitem(admission.INITIAL_HOLD_SECONDS, BATCH, 1000.0)
+    controller = AdmissionController(max_renders=1, memory_mb=1000)
+    assert controller.retry_after(BATCH) == 300
+    assert controller.retry_after(SINGLE) == 2
+
+    # Quick renders bring the estimate down, never below a second
+    for _ in range(50):
+        controller.acquire(SINGLE, renders=1).release()
+    assert controller.retry_after(SINGLE) == 1
+
+
+def test_work_bigger_than_the_budget_runs_alone():
+    controller = AdmissionController(max_renders=2, memory_mb=100)
+    with controller.acquire(BATCH, memory_mb=500):
+        with pytest.raises(Overloaded):
+            controller.acquire(SINGLE, renders=1, timeout=0.05)
+    with controller.acquire(SINGLE, renders=1):
+        pass
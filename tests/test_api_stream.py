@@ -0,0 +1,74 @@
+import io
+import json
+import queue
+import threading
+
+from api_stream import iter_ndjson, records_row_batches, iter_result_lines
+
+
+def test_ndjson_lines_are_numbered_and_bad_lines_reported():
+    body = io.StringIO('{"name": "Ada"}\n\n  \n{"name": \n[1, 2]\n')
+    records = list(iter_ndjson(body))
+
+    assert [number for number, _ in records] == [1, 4, 5]
+    assert records[0][1] == {"name": "Ada"}
+    assert isinstance(records[1][1], ValueError)
+    assert str(records[1][1]).startswith("Invalid JSON:")
+    assert records[2][1] == [1, 2]
+
+
+def test_unusable_rows_fail_with_their_row_number():
+    failures = []
+    row_numbers = []
+    records = iter_ndjson(io.StringIO(
+        '{"Name": "Ada", "Issue Date": "2024-03-01"}\n'
+        '{"name": \n'
+        '"just a string"\n'
+        '{"course": "no name here"}\n'
+        '{"student_name": "Grace"}\n'
+    ))
+    batches = list(records_row_batches(records, row_numbers, lambda number, error: failures.append((number, str(error))), batch_rows=10))
+
+    assert row_numbers == [1, 5]
+    assert [fields["student_name"] for _, fields in batches[0]] == ["Ada", "Grace"]
+    assert [number for number, _ in failures] == [2, 3, 4]
+    assert failures[0][1].startswith("Invalid JSON:")
+    assert failures[1][1] == "A row must be a JSON object"
+    assert failures[2][1].startswith("No student name")
+
+
+def test_waiting_for_input_hands_on_an_empty_batch():
+    records = [(1, {"name": "Ada"}), None, (2, {"name": "Grace"})]
+    batches = list(records_row_batches(iter(records), [], lambda number, error: None, batch_rows=10))
+    assert [len(batch) for batch in batches] == [1, 1]
+
+
+def test_result_lines_end_with_an_error_line_and_the_summary():
+    results = queue.Queue()
+    finished = object()
+    stop = threading.Event()
+    for result in (
+        {"row": 1, "status": "done", "certificate_number": "C-1", "url": "u", "download_url": "/certificates/C-1.pdf"},
+        {"row": 2, "status": "failed", "error": "No student name"},
+        {"error": "Render pool is gone"},
+        finished,
+    ):
+        results.put(result)
+
+    lines = list(iter_result_lines(results, finished, "api_1", stop))
+    assert all(line.endswith("\n") for line in lines)
+    parsed = [json.loads(line) for line in lines]
+    assert parsed[1] == {"row": 2, "status": "failed", "error": "No student name"}
+    assert parsed[2] == {"error": "Render pool is gone"}
+    assert parsed[3] == {"summary": {"batch_id": "api_1", "done": 1, "failed": 1}}
+    assert stop.is_set()
+
+
+def test_client_going_away_stops_reading():
+    results = queue.Queue()
+    stop = threading.Event()
+    results.put({"row": 1, "status": "failed", "error": "x"})
+    lines = iter_result_lines(results, object(), "api_1", stop)
+    next(lines)
+    lines.close()
+    assert stop.is_set()
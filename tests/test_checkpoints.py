@@ -0,0 +1,52 @@
+import os
+
+from db import migrate
+from checkpoints import BatchCheckpoint
+
+
+def _checkpoint(tmp_path, job_id="job-1"):
+    db_path = str(tmp_path / "certificates.db")
+    migrate(db_path)
+    return BatchCheckpoint(db_path, job_id, str(tmp_path / "artifacts" / job_id))
+
+
+def test_resume_skips_rows_already_rendered(tmp_path):
+    checkpoint = _checkpoint(tmp_path)
+    checkpoint.reserved([(0, "C-1"), (1, "C-2"), (2, "C-3")])
+    checkpoint.rendered([0], b"%PDF-1", "C-1.pdf")
+    checkpoint.uploaded("C-1", "https://example.test/C-1.pdf")
+    checkpoint.rendered([1], b"%PDF-2", "C-2.pdf")
+
+    # The job is picked up again by a new run
+    resumed = BatchCheckpoint(checkpoint.db_path, checkpoint.job_id, checkpoint.artifact_dir)
+    rows = resumed.load()
+    assert {index: row["certificate_number"] for index, row in rows.items()} == {0: "C-1", 1: "C-2", 2: "C-3"}
+    assert resumed.resumable(0)["url"] == "https://example.test/C-1.pdf"
+    assert resumed.resumable(1)["url"] is None
+    # Reserved only: rendered again, with the same number
+    assert resumed.resumable(2) is None
+    assert resumed.resumable(3) is None
+
+
+def test_rows_whose_pdf_is_gone_are_rendered_again(tmp_path):
+    checkpoint = _checkpoint(tmp_path)
+    checkpoint.reserved([(0, "C-1"), (1, "C-2")])
+    path = checkpoint.rendered([0, 1], b"%PDF-chunk", "chunk_0.pdf")
+    os.remove(path)
+
+    checkpoint.load()
+    assert checkpoint.resumable(0) is None
+    assert checkpoint.resumable(1) is None
+
+
+def test_clear_drops_rows_and_artifacts_of_its_job_only(tmp_path):
+    checkpoint = _checkpoint(tmp_path)
+    other = _checkpoint(tmp_path, job_id="job-2")
+    checkpoint.reserved([(0, "C-1")])
+    checkpoint.rendered([0], b"%PDF-1", "C-1.pdf")
+    other.reserved([(0, "C-9")])
+
+    checkpoint.clear()
+    assert checkpoint.load() == {}
+    assert not os.path.exists(checkpoint.artifact_dir)
+    assert other.load()[0]["certificate_number"] == "C-9"
@@ -0,0 +1,32 @@
+import os
+import time
+
+from janitor import remove_old_dirs, remove_old_files
+
+
+def _write(path, age_seconds):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"pdf")
+    then = time.time() - age_seconds
+    os.utime(path, (then, then))
+
+
+def test_old_checkpoint_dirs_go_unless_their_job_is_active(tmp_path):
+    _write(str(tmp_path / "failed" / "row_1.pdf"), 7200)
+    _write(str(tmp_path / "running" / "row_1.pdf"), 7200)
+    _write(str(tmp_path / "recent" / "row_1.pdf"), 7200)
+    _write(str(tmp_path / "recent" / "row_2.pdf"), 60)
+    _write(str(tmp_path / "certificates_done.zip"), 7200)
+
+    assert remove_old_dirs(str(tmp_path), 3600, keep={"running"}) == 1
+    assert sorted(os.listdir(tmp_path)) == ["certificates_done.zip", "recent", "running"]
+
+
+def test_old_files_in_keep_stay(tmp_path):
+    _write(str(tmp_path / "old.xlsx"), 7200)
+    _write(str(tmp_path / "queued.xlsx"), 7200)
+    _write(str(tmp_path / "new.xlsx"), 60)
+
+    assert remove_old_files(str(tmp_path), 3600, keep=[str(tmp_path / "queued.xlsx")]) == 1
+    assert sorted(os.listdir(tmp_path)) == ["new.xlsx", "queued.xlsx"]
@@ -0,0 +1,28 @@
+import time
+
+from db import migrate, query
+from jobs import create_job, JobProgress, keep_alive
+
+
+def test_keep_alive_refreshes_the_heartbeat_while_blocked(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    migrate(db_path)
+    job_id = create_job(db_path, None, {})
+    started = time.time()
+
+    with keep_alive(JobProgress(db_path, job_id), interval=0.05):
+        time.sleep(0.3)
+
+    heartbeat_at = query(db_path, "SELECT heartbeat_at FROM jobs WHERE id = ?", (job_id,))[0][0]
+    assert heartbeat_at is not None and heartbeat_at >= started
+
+
+def test_keep_alive_closes_the_connection_of_its_ticker(tmp_path, monkeypatch):
+    import jobs
+    closed = []
+    monkeypatch.setattr(jobs, "close_connections", lambda: closed.append(True))
+    db_path = str(tmp_path / "jobs.db")
+    migrate(db_path)
+    with keep_alive(JobProgress(db_path, create_job(db_path, None, {})), interval=0.05):
+        time.sleep(0.1)
+    assert closed == [True]
@@ -0,0 +1,57 @@
+import threading
+
+from db import migrate, close_connections
+from numbering import init_numbering, reserve_certificate_numbers, peek_certificate_number, claim_certificate_number
+
+
+def _sequence(tmp_path, start_number=1):
+    db_path = str(tmp_path / "certificates.db")
+    migrate(db_path)
+    init_numbering(db_path, start_number)
+    return db_path
+
+
+def test_claim_takes_the_peeked_number_only_while_it_is_next(tmp_path):
+    db_path = _sequence(tmp_path, start_number=415)
+    number = peek_certificate_number(db_path)
+    assert number == 415
+
+    # Nothing is used up until the claim: a failed render leaves no gap
+    assert peek_certificate_number(db_path) == 415
+    assert claim_certificate_number(db_path, number)
+    assert peek_certificate_number(db_path) == 416
+
+    # A batch reserving in between wins; the stale number is not claimed twice
+    number = peek_certificate_number(db_path)
+    assert reserve_certificate_numbers(db_path, 1) == number
+    assert not claim_certificate_number(db_path, number)
+    assert claim_certificate_number(db_path, number + 1)
+
+
+def test_concurrent_reservations_never_overlap(tmp_path):
+    db_path = _sequence(tmp_path, start_number=1)
+    blocks = []
+    errors = []
+
+    def reserve(worker):
+        try:
+            for i in range(20):
+                count = 1 + (worker + i) % 5
+                blocks.append((reserve_certificate_numbers(db_path, count), count))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            close_connections()
+
+    threads = [threading.Thread(target=reserve, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    numbers = [first + offset for first, count in blocks for offset in range(count)]
+    total = sum(count for _, count in blocks)
+    # Every number handed out exactly once, with no gaps left behind
+    assert sorted(numbers) == list(range(1, total + 1))
+    assert peek_certificate_number(db_path) == total + 1
@@ -0,0 +1,23 @@
+from pdf_cache import PdfCache, certificate_key
+
+
+def test_overwriting_a_key_keeps_the_size_of_one_copy(tmp_path):
+    cache = PdfCache(str(tmp_path), max_bytes=1024 * 1024)
+    cache.put("ab12", b"x" * 100)
+    assert cache.stats()["bytes"] == 100
+    cache.put("ab12", b"y" * 60)
+    assert cache.stats()["bytes"] == 60
+    assert cache.get("ab12") == (b"y" * 60, None)
+
+
+def test_put_evicts_above_the_bound(tmp_path):
+    cache = PdfCache(str(tmp_path), max_bytes=250)
+    for key in ("aa01", "aa02", "aa03"):
+        cache.put(key, b"z" * 100)
+    assert cache.stats()["bytes"] <= 250 * 0.9
+    assert cache.get("aa03") is not None
+
+
+def test_render_variants_get_their_own_keys():
+    keys = {certificate_key("<html></html>", "body {}", mode, "assets") for mode in ("full", "batch", "layered")}
+    assert len(keys) == 3
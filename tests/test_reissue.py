@@ -0,0 +1,87 @@
+import json
+
+import pandas as pd
+
+from db import migrate, transaction
+from ingest import clean_frame
+from reissue import IncrementalIssue
+from sheet_prep import iter_row_contexts
+
+
+def _certificate(db_path, cert_no, name, issue_date, template="certificate.html"):
+    stored = json.dumps({"template": template, "context": {"student_name": name, "issue_date": issue_date}})
+    with transaction(db_path) as conn:
+        conn.execute(
+            "INSERT INTO certificates (certificate_number, student_name, render_context) VALUES (?, ?, ?)",
+            (cert_no, name, stored)
+        )
+
+
+def _rows(columns):
+    """(template_context, fields) of every row of a sheet given as {column: values}"""
+    return [(context, fields) for _, context, fields in iter_row_contexts(clean_frame(pd.DataFrame(columns)))]
+
+
+def _lookup(reissue, rows):
+    keys = [reissue.key(*row) for row in rows]
+    return keys, reissue.lookup([(key, *row) for key, row in zip(keys, rows)])
+
+
+def test_rows_without_an_issue_record_match_certificates_issued_before(tmp_path):
+    db_path = str(tmp_path / "certificates.db")
+    migrate(db_path)
+    _certificate(db_path, "C-1", "Asha Rao", "05-01-2026")
+    _certificate(db_path, "C-2", "Asha Rao", "05-01-2026")
+    _certificate(db_path, "C-3", "Ravi K", "05-01-2026", template="Certificate_Acadeno.html")
+    _certificate(db_path, "C-4", "Meera", "06-01-2026")
+
+    reissue = IncrementalIssue(db_path, {"template": "certificate.html"})
+    keys, found = _lookup(reissue, _rows({
+        "name": ["Asha Rao", "Ravi K", "Meera"],
+        "register_number": ["R1", "", ""],
+        "issue_date": ["05/01/2026", "05/01/2026", "07/01/2026"],
+    }))
+
+    # The newest certificate of the same name, date and template; no row hash, so it is rendered again
+    assert list(found) == [keys[0]]
+    assert found[keys[0]]["certificate_number"] == "C-2"
+    assert found[keys[0]]["row_hash"] is None
+
+
+def test_sheets_without_an_issue_date_match_on_the_name(tmp_path):
+    db_path = str(tmp_path / "certificates.db")
+    migrate(db_path)
+    _certificate(db_path, "C-1", "Asha Rao", "05-01-2026")
+    _certificate(db_path, "C-2", "Ravi K", "06-01-2026")
+
+    reissue = IncrementalIssue(db_path, {})
+    keys, found = _lookup(reissue, _rows({"name": ["Asha Rao", "Ravi K", "Meera"], "department": ["CSE", "ECE", "ME"]}))
+
+    assert {key: row["certificate_number"] for key, row in found.items()} == {keys[0]: "C-1", keys[1]: "C-2"}
+
+
+def test_blank_issue_dates_do_not_follow_the_calendar():
+    reissue = IncrementalIssue(None, {})
+    (context, fields), = _rows({"name": ["Asha Rao"], "issue_date": [None]})
+    tomorrow = dict(context, issue_date="01-01-2099"), dict(fields, issue_date="01-01-2099")
+
+    assert context["issue_date"]  # the certificate still shows today's date
+    assert reissue.key(context, fields) == reissue.key(*tomorrow)
+    assert reissue.row_hash(context, fields) == reissue.row_hash(*tomorrow)
+
+
+def test_issue_records_win_over_certificates_issued_before(tmp_path):
+    db_path = str(tmp_path / "certificates.db")
+    migrate(db_path)
+    _certificate(db_path, "C-1", "Asha Rao", "05-01-2026")
+    _certificate(db_path, "C-2", "Asha Rao", "05-01-2026")
+
+    reissue = IncrementalIssue(db_path, {})
+    (context, fields), = _rows({"name": ["Asha Rao"], "register_number": ["R1"], "issue_date": ["05/01/2026"]})
+    key = reissue.key(context, fields)
+    reissue.issued(key, "C-1", "hash")
+    reissue.flush()
+
+    found = reissue.lookup([(key, context, fields)])
+    assert found[key]["certificate_number"] == "C-1"
+    assert found[key]["row_hash"] == "hash"
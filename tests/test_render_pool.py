@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from render_pool import RenderPool
+
+
+class Unloadable:
+    """Pickles in the parent, fails to load in the worker"""
+
+    def __reduce__(self):
+        return _refuse, ()
+
+
+def _refuse():
+    raise RuntimeError("cannot load this task")
+
+
+def _echo(value):
+    return value
+
+
+def _crash():
+    os._exit(3)
+
+
+def _pid():
+    return os.getpid()
+
+
+@pytest.fixture
+def pool():
+    pool = RenderPool(workers=1, max_docs=100, rss_limit_mb=10_000)
+    yield pool
+    pool.shutdown()
+
+
+def test_a_task_that_cannot_be_loaded_fails_its_future(pool):
+    with pytest.raises(RuntimeError, match="cannot load this task"):
+        pool.submit(_echo, Unloadable()).result(timeout=60)
+    # The worker survived and takes the next task
+    assert pool.submit(_echo, "next").result(timeout=60) == "next"
+
+
+def test_a_worker_dying_with_a_task_fails_it_and_is_replaced(pool):
+    with pytest.raises(RuntimeError, match="exit code 3"):
+        pool.submit(_crash).result(timeout=60)
+    assert pool.submit(_echo, "after").result(timeout=60) == "after"
+
+
+def test_workers_are_recycled_after_max_docs_without_losing_tasks():
+    pool = RenderPool(workers=1, max_docs=2, rss_limit_mb=10_000)
+    try:
+        # Queued at once: tasks waiting while a worker exits go to its replacement
+        futures = [pool.submit(_pid) for _ in range(5)]
+        pids = [future.result(timeout=60) for future in futures]
+    finally:
+        pool.shutdown()
+    assert len(set(pids)) == 3
+    assert all(pids.count(pid) <= 2 for pid in pids)
+
+
+def test_tasks_queued_behind_a_crash_still_run(pool):
+    crashed = pool.submit(_crash)
+    queued = [pool.submit(_echo, i) for i in range(3)]
+    with pytest.raises(RuntimeError, match="exit code 3"):
+        crashed.result(timeout=60)
+    assert [future.result(timeout=60) for future in queued] == [0, 1, 2]
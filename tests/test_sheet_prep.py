@@ -0,0 +1,164 @@
+import re
+from datetime import datetime
+
+import pandas as pd
+
+from ingest import clean_frame
+from sheet_prep import iter_row_contexts, record_context
+
+
+# ---------------- ROW-WISE REFERENCE ----------------
+# The df.iterrows() context build the column-wise one replaced, kept as it was
+def _safe_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and pd.isna(value):
+        return ""
+    return str(value).strip()
+
+
+def _format_semester(semester):
+    if semester is None or pd.isna(semester):
+        return ""
+    semester = str(semester).strip()
+    if not semester:
+        return ""
+    match = re.match(r"^(\d+)(st|nd|rd|th)$", semester, re.IGNORECASE)
+    if match:
+        return f"{match.group(1)}<sup>{match.group(2)}</sup>"
+    if semester.isdigit():
+        sem = int(semester)
+        suffix = {1: "st", 2: "nd", 3: "rd"}.get(sem % 10, "th")
+        return f"{sem}{suffix}"
+    return semester
+
+
+def _font_size(name):
+    length = len(str(name))
+    if length > 25:
+        return "28px"
+    if length > 20:
+        return "34px"
+    if length > 15:
+        return "40px"
+    return "52px"
+
+
+def _format_internship_duration(row):
+    hours = row.get("internship_hours")
+    if not pd.isna(hours) and str(hours).strip():
+        return f"{int(hours)} Hours"
+    start = row.get("start_date") or row.get("joining_date") or row.get("start")
+    end = row.get("end_date") or row.get("ending_date") or row.get("end")
+    if not pd.isna(start) and not pd.isna(end):
+        try:
+            return f"from {pd.to_datetime(start).strftime('%d-%m-%Y')} to {pd.to_datetime(end).strftime('%d-%m-%Y')}"
+        except Exception:
+            pass
+    return ""
+
+
+def _row_wise(df):
+    for _, row in df.iterrows():
+        issue_date_val = row.get("issue_date") or row.get("date")
+        if not pd.isna(issue_date_val) and hasattr(issue_date_val, "strftime"):
+            issue_date = issue_date_val.strftime("%d-%m-%Y")
+        else:
+            issue_date = datetime.now().strftime("%d-%m-%Y")
+
+        template_context = {}
+        for col in df.columns:
+            value = row.get(col)
+            if col == "semester":
+                template_context[col] = _format_semester(value)
+            elif col == "internship_duration":
+                template_context[col] = _format_internship_duration(row)
+            elif col in ["start_date", "end_date", "joining_date", "ending_date"] and not pd.isna(value):
+                template_context[col] = pd.to_datetime(value).strftime("%d-%m-%Y")
+            elif col == "issue_date":
+                template_context[col] = issue_date
+            else:
+                template_context[col] = _safe_value(value)
+
+        if "course_name" not in template_context and "subject" in template_context:
+            template_context["course_name"] = template_context["subject"]
+        if "internship_program" not in template_context:
+            template_context["internship_program"] = template_context.get("subject") or template_context.get("department", "")
+
+        reg_val = None
+        for key in template_context.keys():
+            if "register" in key or "reg" in key:
+                reg_val = template_context[key]
+                break
+        if reg_val:
+            template_context["reg_id"] = reg_val
+            template_context["register_number"] = reg_val
+
+        if "internship_duration" not in template_context:
+            template_context["internship_duration"] = _format_internship_duration(row)
+
+        student_name_val = (
+            row.get("student_name") or row.get("full_name") or row.get("name") or row.get("full_name_with_initial")
+        )
+        yield template_context, {
+            "student_name": _safe_value(student_name_val),
+            "student_name_style": f"font-size: {_font_size(student_name_val)};",
+            "place": _safe_value(row.get("place")),
+            "issue_date": issue_date,
+        }
+
+
+def _sheet():
+    return clean_frame(pd.DataFrame({
+        "student_name": ["Asha Rao", 0, "  Meera Krishnan Nair  "],
+        "name": ["Ignored", "Ravi K", "Ignored"],
+        "register_number": ["R1", "", "R3"],
+        "department": ["CSE", "ECE", ""],
+        "subject": ["", "Embedded", "Industrial Visit to KSEB"],
+        "semester": [3, "2nd", 5],
+        "date": ["05/01/2026", "06/01/2026", "07/01/2026"],
+        "start_date": ["01/12/2025", "02/12/2025", "03/12/2025"],
+        "end_date": ["31/12/2025", "30/12/2025", "29/12/2025"],
+        "internship_hours": [None, 40, None],
+        "dob": [datetime(2004, 5, 6), datetime(2003, 1, 2), datetime(2004, 12, 31)],
+        "place": ["Calicut", None, "Kochi"],
+    }))
+
+
+# ---------------- PARITY ----------------
+def test_column_wise_contexts_match_the_row_wise_path():
+    df = _sheet()
+    expected = list(_row_wise(df))
+    actual = list(iter_row_contexts(df))
+    assert len(actual) == len(expected) == 3
+    for (_, template_context, fields), (expected_context, expected_fields) in zip(actual, expected):
+        assert template_context == expected_context
+        assert {name: fields[name] for name in expected_fields} == expected_fields
+
+
+def test_timestamps_outside_the_date_columns_keep_their_text():
+    _, template_context, _ = next(iter_row_contexts(_sheet()))
+    assert template_context["dob"] == "2004-05-06 00:00:00"
+    assert template_context["date"] == "2026-01-05 00:00:00"
+
+
+def test_name_falls_back_per_row_and_reg_id_only_when_set():
+    rows = [(context, fields) for _, context, fields in iter_row_contexts(_sheet())]
+    assert [fields["student_name"] for _, fields in rows] == ["Asha Rao", "Ravi K", "Meera Krishnan Nair"]
+    assert rows[0][0]["reg_id"] == "R1"
+    assert "reg_id" not in rows[1][0] and "register_number" in rows[1][0]
+
+
+def test_empty_dates_are_blank():
+    # Deliberate difference from the row-wise path, which printed "NaT"
+    df = clean_frame(pd.DataFrame({"name": ["Asha"], "date": [None], "dob": [pd.NaT], "start_date": ["not a date"]}))
+    _, template_context, _ = next(iter_row_contexts(df))
+    assert template_context["date"] == template_context["dob"] == template_context["start_date"] == ""
+
+
+def test_record_context_matches_a_sheet_row():
+    record = {"name": "Ravi K", "register_number": "", "date": "06/01/2026", "department": "ECE"}
+    template_context, fields = record_context(record)
+    _, sheet_context, sheet_fields = next(iter_row_contexts(clean_frame(pd.DataFrame({k: [v] for k, v in record.items()}))))
+    assert template_context == sheet_context
+    assert fields == sheet_fields
@@ -0,0 +1,49 @@
+import io
+import os
+import time
+
+import openpyxl
+
+from staging import SheetStaging
+
+
+def _sheet_bytes():
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["Name", "Register Number"])
+    ws.append(["Asha", "R1"])
+    ws.append(["Ravi", "R2"])
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+# Saved once: workbooks carry their save time, the same upload must hash the same
+SHEET = _sheet_bytes()
+
+
+def _sheet():
+    return io.BytesIO(SHEET)
+
+
+def test_stage_again_after_expiry_replaces_the_expired_copy(tmp_path):
+    staging = SheetStaging(str(tmp_path), ttl=1)
+    first = staging.stage(_sheet(), "roster.xlsx")
+    time.sleep(1.5)
+    assert staging.get(first["token"]) is None
+
+    again = staging.stage(_sheet(), "roster.xlsx")
+
+    assert again is not None
+    assert again["token"] == first["token"]
+    assert again["row_count"] == 2
+    assert sum(len(df) for df in staging.iter_frames(again["token"])) == 2
+    # Nothing is left behind from the replaced copy
+    assert sorted(os.listdir(tmp_path)) == [first["token"]]
+
+
+def test_stage_same_sheet_reuses_staged_copy(tmp_path):
+    staging = SheetStaging(str(tmp_path))
+    first = staging.stage(_sheet(), "roster.xlsx")
+    again = staging.stage(_sheet(), "roster.xlsx")
+    assert again["created_at"] == first["created_at"]
@@ -0,0 +1,37 @@
+from db import migrate, transaction, query
+from verification import CertificateLookups
+
+
+def _version(db_path):
+    return query(db_path, "SELECT version FROM table_versions WHERE name = 'certificates'")[0][0]
+
+
+def test_upload_urls_do_not_drop_the_cache_but_still_show(tmp_path):
+    db_path = str(tmp_path / "certificates.db")
+    migrate(db_path)
+    with transaction(db_path) as conn:
+        conn.execute("INSERT INTO certificates (certificate_number, student_name) VALUES ('C-1', 'Asha Rao')")
+    lookups = CertificateLookups(db_path)
+    assert lookups.lookup("C-1")["cloudinary_url"] is None
+    assert lookups.search("asha")["results"][0]["cloudinary_url"] is None
+
+    version = _version(db_path)
+    with transaction(db_path) as conn:
+        conn.execute("UPDATE certificates SET cloudinary_url = 'https://example.com/C-1.pdf' WHERE certificate_number = 'C-1'")
+    assert _version(db_path) == version
+    assert lookups.lookup("c-1")["cloudinary_url"] == "https://example.com/C-1.pdf"
+    assert lookups.search("asha")["results"][0]["cloudinary_url"] == "https://example.com/C-1.pdf"
+    assert lookups.page()["results"][0]["cloudinary_url"] == "https://example.com/C-1.pdf"
+
+
+def test_renaming_a_certificate_drops_the_cache(tmp_path):
+    db_path = str(tmp_path / "certificates.db")
+    migrate(db_path)
+    with transaction(db_path) as conn:
+        conn.execute("INSERT INTO certificates (certificate_number, student_name) VALUES ('C-1', 'Asha Rao')")
+    lookups = CertificateLookups(db_path)
+    assert lookups.lookup("C-1")["student_name"] == "Asha Rao"
+
+    with transaction(db_path) as conn:
+        conn.execute("UPDATE certificates SET student_name = 'Asha R' WHERE certificate_number = 'C-1'")
+    assert lookups.lookup("C-1")["student_name"] == "Asha R"
@@ -0,0 +1,171 @@
+import io
+import os
+import re
+import csv
+import threading
+import logging
+
+from db import get_connection
+from compiled_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Lookups / search pages kept in memory
+VERIFY_CACHE_SIZE = int(os.getenv("VERIFY_CACHE_SIZE", "1024"))
+MAX_PAGE_SIZE = 200
+EXPORT_FETCH_ROWS = 1000
+
+PUBLIC_COLUMNS = "certificate_number, student_name, cloudinary_url"
+# Server paths (pdf_path) stay internal: the export links the public download route instead
+EXPORT_COLUMNS = {
+    "id": "id",
+    "certificate_number": "certificate_number",
+    "student_name": "student_name",
+    "download_url": "'/certificates/' || certificate_number || '.pdf'",
+    "cloudinary_url": "cloudinary_url",
+}
+
+
+class CertificateLookups:
+    """
+    Read side of the certificates table for verification traffic.
+    Results are cached in an LRU that is dropped whenever the certificates
+    change: table_versions is bumped by triggers on every insert / delete
+    and on changes of a number or name (also from other processes and
+    /clear_db), and checked per call. Upload URLs written later do not
+    drop it; cached rows still without one read it again.
+    """
+
+    def __init__(self, db_path, max_entries=VERIFY_CACHE_SIZE):
+        self.db_path = db_path
+        self._cache = LRUCache(max_entries)
+        self._version = None
+        self._lock = threading.Lock()
+        self._has_fts = None
+
+    def _conn(self):
+        return get_connection(self.db_path)
+
+    def _cached(self, key, factory):
+        version = self._conn().execute(
+            "SELECT version FROM table_versions WHERE name = 'certificates'"
+        ).fetchone()[0]
+        with self._lock:
+            if version != self._version:
+                self._cache.clear()
+                self._version = version
+        return self._cache.get_or_create(key, factory)
+
+    def _with_urls(self, rows):
+        """Fills in (in place) the URLs of cached rows whose upload finished after they were read"""
+        missing = [row for row in rows if not row["cloudinary_url"]]
+        if missing:
+            numbers = [row["certificate_number"] for row in missing]
+            urls = dict(self._conn().execute(
+                f"""SELECT certificate_number, cloudinary_url FROM certificates
+                    WHERE certificate_number IN ({','.join('?' * len(numbers))}) AND cloudinary_url IS NOT NULL""",
+                numbers
+            ).fetchall())
+            for row in missing:
+                if row["certificate_number"] in urls:
+                    row["cloudinary_url"] = urls[row["certificate_number"]]
+        return rows
+
+    def has_fts(self):
+        if self._has_fts is None:
+            self._has_fts = bool(self._conn().execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'certificates_fts'"
+            ).fetchone())
+        return self._has_fts
+
+    # ---------------- QUERIES ----------------
+    def lookup(self, certificate_number):
+        """The certificate with this number, or None"""
+        number = certificate_number.strip().upper()
+
+        def load():
+            row = self._conn().execute(
+                f"SELECT {PUBLIC_COLUMNS} FROM certificates WHERE certificate_number = ?", (number,)
+            ).fetchone()
+            return dict(row) if row else None
+        certificate = self._cached(("lookup", number), load)
+        if certificate:
+            self._with_urls([certificate])
+        return certificate
+
+    def search(self, text, limit=20, offset=0):
+        """
+        Certificates whose student name (or number) has words starting with
+        the words of text, best matches first. Falls back to a substring
+        match when nothing starts with them (or without FTS5).
+        """
+        words = re.findall(r"\w+", text.lower())
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        offset = max(0, offset)
+        if not words:
+            return {"results": [], "has_more": False}
+
+        def load():
+            rows = []
+            if self.has_fts():
+                match = " ".join(f'"{word}"*' for word in words)
+                rows = self._conn().execute(
+                    f"""SELECT {PUBLIC_COLUMNS} FROM certificates
+                        JOIN (SELECT rowid, rank FROM certificates_fts WHERE certificates_fts MATCH ?) AS hits
+                        ON hits.rowid = certificates.id
+                        ORDER BY hits.rank, certificates.id LIMIT ? OFFSET ?""",
+                    (match, limit + 1, offset)
+                ).fetchall()
+            if not rows and offset == 0:
+                rows = self._conn().execute(
+                    f"""SELECT {PUBLIC_COLUMNS} FROM certificates WHERE student_name LIKE ?
+                        ORDER BY id LIMIT ? OFFSET ?""",
+                    (f"%{' '.join(words)}%", limit + 1, offset)
+                ).fetchall()
+            return {"results": [dict(row) for row in rows[:limit]], "has_more": len(rows) > limit}
+        result = self._cached(("search", tuple(words), limit, offset), load)
+        self._with_urls(result["results"])
+        return result
+
+    def page(self, page=1, per_page=50):
+        """One page of all certificates, newest first"""
+        page = max(1, page)
+        per_page = max(1, min(per_page, MAX_PAGE_SIZE))
+
+        def load():
+            conn = self._conn()
+            total = conn.execute("SELECT COUNT(*) FROM certificates").fetchone()[0]
+            rows = conn.execute(
+                f"SELECT {PUBLIC_COLUMNS} FROM certificates ORDER BY id DESC LIMIT ? OFFSET ?",
+                (per_page, (page - 1) * per_page)
+            ).fetchall()
+            return {
+                "results": [dict(row) for row in rows],
+                "page": page,
+                "per_page": per_page,
+                "total": total,
+                "pages": (total + per_page - 1) // per_page,
+            }
+        result = self._cached(("page", page, per_page), load)
+        self._with_urls(result["results"])
+        return result
+
+    def iter_csv(self):
+        """The whole table as CSV text chunks (not cached, read in batches)"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        cursor = self._conn().execute(f"SELECT {', '.join(EXPORT_COLUMNS.values())} FROM certificates ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_ROWS)
+            if not rows:
+                break
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    def stats(self):
+        return self._cache.stats()
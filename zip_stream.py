@@ -0,0 +1,51 @@
+import io
+import zipfile
+from datetime import datetime
+
+
+class _StreamBuffer(io.RawIOBase):
+    """Write-only, non-seekable sink that hands out what was written so far"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStream:
+    """
+    Builds a ZIP incrementally for a streamed HTTP response.
+    Entries are stored without deflate (PDFs are already compressed) and
+    written with data descriptors, so only the current entry is in memory.
+    """
+
+    def __init__(self):
+        self._buffer = _StreamBuffer()
+        self._zip = zipfile.ZipFile(self._buffer, "w", compression=zipfile.ZIP_STORED)
+
+    def add(self, data, name):
+        """Adds one file and returns the bytes to send for it"""
+        info = zipfile.ZipInfo(name, date_time=datetime.now().timetuple()[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        self._zip.writestr(info, data)
+        return self._buffer.drain()
+
+    def close(self):
+        """Finishes the archive and returns the central directory bytes"""
+        self._zip.close()
+        return self._buffer.drain()